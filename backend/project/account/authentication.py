@@ -2,10 +2,90 @@ from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from django.contrib.auth import get_user_model
 from django.conf import settings
+from django.utils.functional import SimpleLazyObject
+from project.instrumentation import timed
+from .cache import user_cache
 import jwt
 
 User = get_user_model()
 
+# Claims added in CustomTokenObtainPairSerializer.get_token
+PRINCIPAL_CLAIMS = ('id', 'username', 'email', 'role', 'mfaEnabled')
+
+class TokenPrincipal(SimpleLazyObject):
+    """
+    Authenticated user built from access-token claims.
+
+    id, username, email, role and mfa_enabled are answered from the token
+    and the principal compares, filters and assigns like a User instance.
+    Any other attribute, and any write, hydrates the full row through the
+    user cache. is_active is read from the row too: the token alone cannot
+    tell that the account was deactivated after it was issued, and such a
+    token stays usable until it expires (refreshing it is refused).
+    """
+    _meta = User._meta
+
+    def __init__(self, claims):
+        user_id = claims['id']
+        super().__init__(lambda: user_cache.get(user_id))
+        self.__dict__['_claims'] = claims
+
+    @property
+    def __class__(self):
+        return User
+
+    def __getattr__(self, name):
+        # Only hydrate for attributes a User could actually have, so ORM
+        # probes such as hasattr(value, 'resolve_expression') stay free
+        if not name.startswith('_') and not hasattr(User, name):
+            raise AttributeError(name)
+        return super().__getattr__(name)
+
+    def __eq__(self, other):
+        if isinstance(other, TokenPrincipal) or hasattr(other, '_meta'):
+            return other._meta.concrete_model is User._meta.concrete_model and other.pk == self.pk
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.pk)
+
+    def __bool__(self):
+        return True
+
+    @property
+    def pk(self):
+        return self._claims['id']
+
+    id = pk
+
+    @property
+    def username(self):
+        return self._claims['username']
+
+    @property
+    def email(self):
+        return self._claims['email']
+
+    @property
+    def role(self):
+        return self._claims['role']
+
+    @property
+    def mfa_enabled(self):
+        return self._claims['mfaEnabled']
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def is_admin_user(self):
+        return self.role == 'admin'
+
+    def is_regular_user(self):
+        return self.role == 'regular'
+
+    def is_guest_user(self):
+        return self.role == 'guest'
+
 class CustomTokenAuthentication(BaseAuthentication):
     def authenticate(self, request):
         auth = request.META.get('HTTP_AUTHORIZATION')
@@ -19,7 +99,8 @@ class CustomTokenAuthentication(BaseAuthentication):
                 raise AuthenticationFailed('Invalid token prefix')
 
             # Validate the token and get the user
-            user = self.get_user_from_token(token)
+            with timed('auth'):
+                user = self.get_user_from_token(token)
             if user is None:
                 raise AuthenticationFailed('Invalid token')
 
@@ -30,12 +111,21 @@ class CustomTokenAuthentication(BaseAuthentication):
 
     def get_user_from_token(self, token):
         try:
-            # Decode the token (replace 'your_secret_key' with your actual secret key)
             payload = jwt.decode(token, settings.SECRET_KEY, algorithms=['HS256'])
-            print(payload)
-            user_id = payload.get('user_id')  # Adjust based on your token payload structure
-            return User.objects.get(id=user_id)
         except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
             return None  # Token is invalid or expired
+
+        # In claims mode (opt-in, see settings) the principal is built from
+        # the token alone; older tokens without the custom claims fall back
+        # to a cached lookup
+        mode = getattr(settings, 'TOKEN_AUTHENTICATION_MODE', 'database')
+        if mode == 'claims' and all(claim in payload for claim in PRINCIPAL_CLAIMS):
+            return TokenPrincipal({claim: payload[claim] for claim in PRINCIPAL_CLAIMS})
+
+        user_id = payload.get('user_id')  # Adjust based on your token payload structure
+        try:
+            user = user_cache.get(user_id)
         except User.DoesNotExist:
-            return None  # User does not exist
\ No newline at end of file
+            return None  # User does not exist
+        # Deactivated accounts are turned away as soon as the row says so
+        return user if user.is_active else None
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.contrib.auth import get_user_model
+import copy
+import threading
+import time
+
+class UserCache:
+    """
+    Bounded, per-process LRU cache of User rows with a TTL. Entries are
+    dropped by the User post_save/post_delete signals; the TTL bounds how
+    long other worker processes can serve a stale row.
+    """
+    def __init__(self, maxsize=None, ttl=None):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation so a lookup that raced with one does
+        # not put the row it read back into the cache
+        self._generation = 0
+
+    @property
+    def maxsize(self):
+        if self._maxsize is None:
+            return getattr(settings, 'USER_CACHE_SIZE', 1024)
+        return self._maxsize
+
+    @property
+    def ttl(self):
+        if self._ttl is None:
+            return getattr(settings, 'USER_CACHE_TTL', 60)
+        return self._ttl
+
+    def get(self, user_id):
+        """
+        Return a private copy of the user, loading it on a miss. Raises
+        User.DoesNotExist like User.objects.get().
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                expires_at, user = entry
+                if expires_at > now:
+                    self._entries.move_to_end(user_id)
+                    return copy.copy(user)
+                del self._entries[user_id]
+            generation = self._generation
+
+        user = get_user_model().objects.get(pk=user_id)
+
+        if self.maxsize > 0:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[user_id] = (now + self.ttl, user)
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return copy.copy(user)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+user_cache = UserCache()
@@ -57,8 +57,9 @@ class CustomTokenRefreshSerializer(TokenRefreshSerializer):
         data = super().validate(attrs)
         # Here you can add additional claims if needed
         # For example, you can fetch the user from the refresh token
-        refresh = self.get_token(attrs['refresh'])
-        user = refresh.user  # Get the user associated with the refresh token
+        # The submitted token may have just been blacklisted by rotation
+        refresh = self.token_class(data.get('refresh', attrs['refresh']))
+        user = User.objects.get(id=refresh['user_id'])  # Get the user associated with the refresh token
 
         # Add custom claims to the access token
         data['mfaEnabled'] = user.mfa_enabled
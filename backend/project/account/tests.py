@@ -1,3 +1,214 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+import threading
 
-# Create your tests here.
+from django.contrib.auth.models import Group
+from django.core.cache import caches
+from django.test import Client, TestCase, override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from storage.models import EncryptedFile
+from .authentication import CustomTokenAuthentication, TokenPrincipal
+from .cache import user_cache
+from .models import User
+from .serializers import CustomTokenObtainPairSerializer
+from .throttling import hashing_slot, take_token
+
+# Throttle tests keep their buckets in a cache of their own
+THROTTLE_TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'throttle-tests'},
+}
+
+@override_settings(CACHES=THROTTLE_TEST_CACHES)
+class LoginThrottleTests(TestCase):
+    """
+    Login attempts beyond a bucket's capacity get 429 with Retry-After,
+    and concurrent attempts never spend the same token twice.
+    """
+    def setUp(self):
+        caches['shared'].clear()
+        User.objects.create_user(username='alice', email='alice@example.com', password='alice-password-123')
+
+    def login(self, username='alice', password='wrong-password', ip='10.0.0.1'):
+        return self.client.post('/user/login', {'username': username, 'password': password},
+                                content_type='application/json', secure=True, REMOTE_ADDR=ip)
+
+    @override_settings(LOGIN_THROTTLE_BUCKETS={'ip': (100, 1), 'username': (2, 1 / 60)})
+    def test_username_bucket(self):
+        self.assertEqual(self.login().status_code, 400)
+        self.assertEqual(self.login(ip='10.0.0.2').status_code, 400)
+        # A new address does not refill the username's bucket
+        response = self.login(ip='10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertAlmostEqual(int(response['Retry-After']), 60, delta=1)
+        # Nor does the right password
+        self.assertEqual(self.login(password='alice-password-123', ip='10.0.0.4').status_code, 429)
+
+    @override_settings(LOGIN_THROTTLE_BUCKETS={'ip': (1, 1 / 30), 'username': (100, 1)})
+    def test_ip_bucket(self):
+        self.assertEqual(self.login(username='alice').status_code, 400)
+        response = self.login(username='bob')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(self.login(username='bob', ip='10.0.0.2').status_code, 400)
+
+    @override_settings(LOGIN_MAX_CONCURRENT_HASHES=1, LOGIN_BUSY_RETRY_AFTER=3)
+    def test_hashing_slots(self):
+        with hashing_slot('login'):
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '3')
+        # The slot is free again once the check is over
+        self.assertEqual(self.login().status_code, 400)
+
+    def test_concurrent_tokens(self):
+        capacity = 5
+        start = threading.Barrier(16)
+
+        def attempt(_):
+            start.wait()
+            return take_token('throttle:test:concurrent', capacity, 1 / 3600)[0]
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            allowed = sum(executor.map(attempt, range(16)))
+        self.assertEqual(allowed, capacity)
+
+class TokenPrincipalTests(TestCase):
+    """
+    In claims mode, which is opt-in, the principal answers the token's
+    claims without a query and behaves like a User; anything else loads
+    the row.
+    """
+    def setUp(self):
+        user_cache.clear()
+        self.user = User.objects.create_user(
+            username='carol', email='carol@example.com', password='carol-password-123', role='guest'
+        )
+        self.token = str(CustomTokenObtainPairSerializer.get_token(self.user).access_token)
+
+    def authenticate(self, token=None):
+        return CustomTokenAuthentication().get_user_from_token(token or self.token)
+
+    @override_settings(TOKEN_AUTHENTICATION_MODE='claims')
+    def test_claims_only(self):
+        with self.assertNumQueries(0):
+            principal = self.authenticate()
+            self.assertIsInstance(principal, User)
+            self.assertIsInstance(principal, TokenPrincipal)
+            self.assertEqual((principal.pk, principal.id), (self.user.pk, self.user.pk))
+            self.assertEqual((principal.username, principal.email), ('carol', 'carol@example.com'))
+            self.assertEqual(principal.role, 'guest')
+            self.assertTrue(principal.is_guest_user())
+            self.assertFalse(principal.mfa_enabled)
+            self.assertEqual(principal, self.user)
+            self.assertEqual(hash(principal), hash(self.user))
+            # Used as a filter value without loading the row
+            str(Group.objects.filter(user=principal).query)
+
+        # Other attributes load the row once
+        with self.assertNumQueries(1):
+            self.assertEqual(principal.date_joined, self.user.date_joined)
+            self.assertEqual(principal.last_name, '')
+
+    @override_settings(TOKEN_AUTHENTICATION_MODE='claims')
+    def test_token_without_claims(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            user = self.authenticate(str(token))
+        self.assertNotIsInstance(user, TokenPrincipal)
+        self.assertEqual(user, self.user)
+
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save()
+        with override_settings(TOKEN_AUTHENTICATION_MODE='database'):
+            self.assertIsNone(self.authenticate())
+        with override_settings(TOKEN_AUTHENTICATION_MODE='claims'):
+            # The token is trusted until it expires, but the row is not
+            # dressed up as active
+            principal = self.authenticate()
+            self.assertIsInstance(principal, TokenPrincipal)
+            self.assertFalse(principal.is_active)
+
+    def test_deactivated_user_is_refused(self):
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+        with override_settings(TOKEN_AUTHENTICATION_MODE='database'):
+            self.assertEqual(client.get('/storage/files', secure=True).status_code, 200)
+            self.user.is_active = False
+            self.user.save()
+            self.assertEqual(client.get('/storage/files', secure=True).status_code, 403)
+
+class TokenRevocationTests(TestCase):
+    """
+    With the default authentication mode a live token, claims and all, stops
+    working once its user is deactivated and stops carrying a role its
+    user has lost.
+    """
+    def setUp(self):
+        user_cache.clear()
+        self.owner, self.admin = (
+            User.objects.create_user(username=name, email=f'{name}@example.com',
+                                     password=f'{name}-password-123', role=role)
+            for name, role in (('dave', 'regular'), ('erin', 'admin'))
+        )
+        self.file = EncryptedFile.objects.create(
+            user=self.owner, file_name='notes.bin', file_type='application/octet-stream',
+            file_size=0, encrypted_file='encrypted_files/notes.bin',
+        )
+
+    def client_for(self, user):
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        self.assertIn('role', token)
+        return Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_deactivated_user(self):
+        client = self.client_for(self.owner)
+        self.assertEqual(client.get('/storage/files', secure=True).status_code, 200)
+        self.owner.is_active = False
+        self.owner.save()
+        self.assertEqual(client.get('/storage/files', secure=True).status_code, 403)
+
+    def test_demoted_admin(self):
+        client = self.client_for(self.admin)
+        response = client.get('/storage/files', secure=True)
+        self.assertEqual([file['id'] for file in response.json()], [self.file.pk])
+        self.admin.role = 'regular'
+        self.admin.save()
+        self.assertEqual(client.get('/storage/files', secure=True).json(), [])
+        response = client.delete(f'/storage/files/{self.file.pk}', secure=True)
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(EncryptedFile.objects.filter(pk=self.file.pk).exists())
+
+class TokenRefreshTests(TestCase):
+    """
+    Refreshing rotates the refresh token and returns the user's claims
+    alongside the new pair; a rotated-out token cannot be used again.
+    """
+    def setUp(self):
+        self.user = User.objects.create_user(
+            username='frank', email='frank@example.com', password='frank-password-123', role='guest'
+        )
+        self.refresh_token = str(CustomTokenObtainPairSerializer.get_token(self.user))
+
+    def refresh(self, token):
+        return self.client.post('/user/token/refresh', {'refresh': token},
+                                content_type='application/json', secure=True)
+
+    def test_refresh(self):
+        response = self.refresh(self.refresh_token)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(
+            (data['id'], data['username'], data['email'], data['role'], data['mfaEnabled']),
+            (self.user.pk, 'frank', 'frank@example.com', 'guest', False)
+        )
+        self.assertEqual(AccessToken(data['access'])['user_id'], self.user.pk)
+        self.assertNotEqual(data['refresh'], self.refresh_token)
+
+        # The rotated-out token is blacklisted; its replacement works
+        self.assertEqual(self.refresh(self.refresh_token).status_code, 401)
+        self.assertEqual(self.refresh(data['refresh']).status_code, 200)
+
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.refresh(self.refresh_token).status_code, 401)
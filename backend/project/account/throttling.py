@@ -0,0 +1,145 @@
+"""
+Load shedding for the login and MFA endpoints.
+
+Token buckets per client IP and per username, kept in the
+LOGIN_THROTTLE_CACHE cache alias, turn away bursts with 429 before any
+password is hashed or code checked. On top of that, password checks
+hold one of LOGIN_MAX_CONCURRENT_HASHES slots in the same cache; a login
+that finds them all taken gets 429 with Retry-After instead of queueing
+behind the hashing. The alias defaults to the cache shared by every
+worker; a per-process cache would give each worker its own buckets and
+slots. Buckets are updated under a lock taken with cache.add(), which is
+atomic on the database, Redis and memcached backends, so concurrent
+attempts cannot spend the same token.
+"""
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.exceptions import Throttled
+from rest_framework.throttling import BaseThrottle
+from project.metrics import Counter
+import hashlib
+import math
+import time
+import uuid
+
+login_attempts = Counter(
+    'secureshare_login_attempts_total',
+    'Login and MFA attempts by outcome: admitted, or rejected by a throttle or the hashing cap',
+    ['endpoint', 'outcome']
+)
+
+# A bucket lock left behind by a killed worker frees itself after this
+BUCKET_LOCK_TIMEOUT = 2  # seconds
+BUCKET_LOCK_ATTEMPTS = 10
+BUCKET_LOCK_BACKOFF = 0.01  # seconds
+
+def throttle_cache():
+    return caches[getattr(settings, 'LOGIN_THROTTLE_CACHE', 'shared')]
+
+@contextmanager
+def _bucket_lock(cache, key):
+    # Yields whether the lock was taken within BUCKET_LOCK_ATTEMPTS tries
+    lock, owner = f'{key}:lock', uuid.uuid4().hex
+    for _ in range(BUCKET_LOCK_ATTEMPTS):
+        if cache.add(lock, owner, BUCKET_LOCK_TIMEOUT):
+            break
+        time.sleep(BUCKET_LOCK_BACKOFF)
+    else:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        if cache.get(lock) == owner:
+            cache.delete(lock)
+
+def take_token(key, capacity, rate, now=None):
+    """
+    Take one token from the bucket stored under `key`, holding at most
+    `capacity` tokens and refilling at `rate` tokens/second. Returns
+    (allowed, seconds until a token is available).
+    """
+    cache = throttle_cache()
+    with _bucket_lock(cache, key) as locked:
+        if not locked:
+            # Other attempts on the same bucket keep it busy: a burst
+            return False, 1
+        now = time.time() if now is None else now
+        tokens, updated = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * rate)
+        if tokens < 1:
+            return False, (1 - tokens) / rate
+        # An untouched bucket is full again after capacity / rate seconds
+        cache.set(key, (tokens - 1, now), math.ceil(capacity / rate))
+        return True, 0
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    One token per request from the bucket named by `bucket` in
+    LOGIN_THROTTLE_BUCKETS. Views name themselves with throttle_scope, so
+    login and MFA attempts drain separate buckets.
+    """
+    bucket = None
+
+    def get_ident_key(self, request, view):
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        ident = self.get_ident_key(request, view)
+        if ident is None:
+            return True
+        capacity, rate = settings.LOGIN_THROTTLE_BUCKETS[self.bucket]
+        key = f'throttle:{view.throttle_scope}:{self.bucket}:{ident}'
+        allowed, self._wait = take_token(key, capacity, rate)
+        if not allowed:
+            login_attempts.inc(endpoint=view.throttle_scope, outcome=f'throttled_{self.bucket}')
+        return allowed
+
+    def wait(self):
+        return self._wait
+
+class ClientIPThrottle(TokenBucketThrottle):
+    bucket = 'ip'
+
+    def get_ident_key(self, request, view):
+        return self.get_ident(request)
+
+class UsernameThrottle(TokenBucketThrottle):
+    bucket = 'username'
+
+    def get_ident_key(self, request, view):
+        username = request.data.get('username') if hasattr(request.data, 'get') else None
+        if not isinstance(username, str) or not username:
+            return None
+        # Fixed-length and safe for any cache backend's key rules
+        return hashlib.sha256(username.lower().encode()).hexdigest()
+
+@contextmanager
+def hashing_slot(endpoint):
+    """
+    Hold one of the LOGIN_MAX_CONCURRENT_HASHES password-check slots for
+    the duration of the block, or raise Throttled (429 with Retry-After)
+    when none is free. A slot left behind by a killed worker frees itself
+    after LOGIN_HASH_SLOT_TIMEOUT seconds.
+    """
+    cache = throttle_cache()
+    owner = uuid.uuid4().hex
+    timeout = getattr(settings, 'LOGIN_HASH_SLOT_TIMEOUT', 10)
+    for slot in range(getattr(settings, 'LOGIN_MAX_CONCURRENT_HASHES', 2)):
+        key = f'throttle:hashing-slot:{slot}'
+        if cache.add(key, owner, timeout):
+            break
+    else:
+        login_attempts.inc(endpoint=endpoint, outcome='busy')
+        raise Throttled(
+            wait=getattr(settings, 'LOGIN_BUSY_RETRY_AFTER', 1),
+            detail='Too many sign-ins in progress, try again shortly.'
+        )
+
+    login_attempts.inc(endpoint=endpoint, outcome='admitted')
+    try:
+        yield
+    finally:
+        if cache.get(key) == owner:
+            cache.delete(key)
@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
 from .authentication import CustomTokenAuthentication
+from .throttling import ClientIPThrottle, UsernameThrottle, hashing_slot, login_attempts
 from .serializers import (
     UserRegistrationSerializer,
     UserLoginSerializer,
@@ -41,13 +42,19 @@ class UserRegistrationView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class UserLoginView(APIView):
+    throttle_classes = [ClientIPThrottle, UsernameThrottle]
+    throttle_scope = 'login'
+
     def post(self, request):
         serializer = UserLoginSerializer(data=request.data)
         if serializer.is_valid():
-            user = authenticate(
-                username=serializer.validated_data['username'],
-                password=serializer.validated_data['password']
-            )
+            # Password hashing is the expensive part; cap how much of it
+            # runs at once
+            with hashing_slot(self.throttle_scope):
+                user = authenticate(
+                    username=serializer.validated_data['username'],
+                    password=serializer.validated_data['password']
+                )
 
             if user is None:
                 return Response({'error': 'Invalid credentials'}, 
@@ -151,6 +158,9 @@ class MFAVerifyView(APIView):
         )
 
 class MFALoginVerifyView(APIView):
+    throttle_classes = [ClientIPThrottle, UsernameThrottle]
+    throttle_scope = 'mfa'
+
     def post(self, request):
         serializer = MFALoginVerifySerializer(data=request.data)
         if not serializer.is_valid():
@@ -158,6 +168,7 @@ class MFALoginVerifyView(APIView):
                 serializer.errors, 
                 status=status.HTTP_400_BAD_REQUEST
             )
+        login_attempts.inc(endpoint=self.throttle_scope, outcome='admitted')
         
         code = serializer.validated_data['code']
         username = serializer.validated_data['username']
@@ -0,0 +1,55 @@
+import os
+import resource
+import sys
+import tempfile
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def setup_django(database=None, media_root=None):
+    # Boot Django against a throwaway test database and media directory so
+    # benchmarks never touch db.sqlite3 or mediafiles/. Passing a database
+    # file and media directory lets several processes, e.g. a benchmark and
+    # the server it drives, share the same throwaway state.
+    if PROJECT_DIR not in sys.path:
+        sys.path.insert(0, PROJECT_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+
+    import django
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import override_settings, setup_test_environment
+
+    if database is not None:
+        connection.settings_dict['TEST']['NAME'] = database
+    override_settings(MEDIA_ROOT=media_root or tempfile.mkdtemp(prefix='bench-media-')).enable()
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=database is not None)
+
+def create_user(username='bench', role='regular', **extra):
+    from account.models import User
+    return User.objects.create_user(
+        username=username,
+        email=f'{username}@example.com',
+        password='bench-password-123',
+        role=role,
+        **extra
+    )
+
+def auth_client(user):
+    from django.test import Client
+    from account.serializers import CustomTokenObtainPairSerializer
+
+    token = CustomTokenObtainPairSerializer.get_token(user).access_token
+    return Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+def peak_rss_bytes():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def parse_size(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
@@ -0,0 +1,308 @@
+"""
+Concurrent slow-client transfers one worker process sustains, sync vs async.
+
+`sync` is today's deployment: a gunicorn sync worker running project.wsgi.
+`async` is a gunicorn uvicorn worker running project.asgi, which routes to
+storage.async_views. Each mode gets exactly one worker process. N clients
+then download (or upload) a blob, each capped at --rate bytes/s, while a
+probe lists files. A worker that serves the clients one at a time needs
+N times the ideal transfer time; one that overlaps them needs about one.
+
+On loopback the kernel buffers up to net.ipv4.tcp_rmem[2] bytes of every
+queued upload, which hides the sync worker's queueing; give upload runs a
+--size well above that.
+
+    python -m benchmarks.concurrent_transfers
+    python -m benchmarks.concurrent_transfers --clients 1 8 32 --direction upload
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from benchmarks import PROJECT_DIR, parse_size, setup_django
+
+MODES = ['sync', 'async']
+WORKER_CLASSES = {'sync': 'sync', 'async': 'uvicorn_worker.UvicornWorker'}
+READ_SIZE = 64 * 1024
+# Small client socket buffers keep the kernel from absorbing a whole
+# transfer, so the server really has to wait for slow clients
+CLIENT_SOCKET_BUFFER = 64 * 1024
+
+def serve(mode, port, database, media_root):
+    os.environ['ASYNC_VIEWS'] = '1' if mode == 'async' else '0'
+    setup_django(database, media_root)
+
+    from django.db import connections
+    from gunicorn.app.base import BaseApplication
+
+    connections.close_all()
+
+    class Server(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'127.0.0.1:{port}')
+            self.cfg.set('workers', 1)
+            self.cfg.set('worker_class', WORKER_CLASSES[mode])
+            # Same limit as scripts/run.sh
+            self.cfg.set('timeout', 120)
+            self.cfg.set('loglevel', 'warning')
+
+        def load(self):
+            if mode == 'async':
+                from django.core.asgi import get_asgi_application
+                return get_asgi_application()
+            from django.core.wsgi import get_wsgi_application
+            return get_wsgi_application()
+
+    Server().run()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Server on port {port} did not start')
+
+async def open_connection(port):
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, CLIENT_SOCKET_BUFFER)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, CLIENT_SOCKET_BUFFER)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ('127.0.0.1', port))
+    return await asyncio.open_connection(sock=sock, limit=READ_SIZE * 2)
+
+def request_head(method, path, token, extra=''):
+    # X-Forwarded-Proto stands in for the TLS-terminating proxy, so
+    # SECURE_SSL_REDIRECT lets plain HTTP through
+    return (
+        f'{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n'
+        f'Authorization: Bearer {token}\r\nX-Forwarded-Proto: https\r\n'
+        f'Connection: close\r\n{extra}\r\n'
+    ).encode()
+
+async def read_response_head(reader):
+    head = await reader.readuntil(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:] if ': ' in line)
+    return int(lines[0].split()[1]), {key.lower(): value for key, value in headers.items()}
+
+async def throttle(started, transferred, rate):
+    delay = started + transferred / rate - time.monotonic()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+async def download(port, token, file_id, rate):
+    started = time.monotonic()
+    reader, writer = await open_connection(port)
+    writer.write(request_head('GET', f'/storage/download/{file_id}', token))
+    await writer.drain()
+    status, _ = await read_response_head(reader)
+    first_byte = time.monotonic()
+    received = 0
+    while data := await reader.read(READ_SIZE):
+        received += len(data)
+        await throttle(first_byte, received, rate)
+    writer.close()
+    return {'status': status, 'bytes': received, 'started': started,
+            'first_byte': first_byte, 'finished': time.monotonic()}
+
+async def upload(port, token, size, rate):
+    boundary = uuid.uuid4().hex
+    fields = {'file_name': 'bench.bin', 'file_type': 'application/octet-stream', 'file_size': str(size)}
+    preamble = ''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in fields.items()
+    )
+    preamble += (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="encrypted_key"; filename="key"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n{"k" * 32}\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    )
+    trailer = f'\r\n--{boundary}--\r\n'.encode()
+    length = len(preamble) + size + len(trailer)
+
+    started = time.monotonic()
+    reader, writer = await open_connection(port)
+    writer.write(request_head('POST', '/storage/upload', token, (
+        f'Content-Type: multipart/form-data; boundary={boundary}\r\n'
+        f'Content-Length: {length}\r\n'
+    )) + preamble.encode())
+    sent = 0
+    block = bytes(READ_SIZE)
+    while sent < size:
+        data = block[:min(READ_SIZE, size - sent)]
+        writer.write(data)
+        await writer.drain()
+        sent += len(data)
+        await throttle(started, sent, rate)
+    writer.write(trailer)
+    await writer.drain()
+    status, _ = await read_response_head(reader)
+    first_byte = time.monotonic()
+    writer.close()
+    return {'status': status, 'bytes': sent, 'started': started,
+            'first_byte': first_byte, 'finished': first_byte}
+
+async def probe(port, token, delay):
+    # A cheap request arriving while the transfers are in progress
+    await asyncio.sleep(delay)
+    started = time.monotonic()
+    reader, writer = await open_connection(port)
+    writer.write(request_head('GET', '/storage/files?limit=1', token))
+    await writer.drain()
+    status, _ = await read_response_head(reader)
+    await reader.read()
+    writer.close()
+    return status, time.monotonic() - started
+
+def peak_in_flight(transfers):
+    # Transfers whose bytes were actually moving at the same moment
+    events = sorted(
+        [(t['first_byte'], 1) for t in transfers] + [(t['finished'], -1) for t in transfers]
+    )
+    peak = current = 0
+    for _, step in events:
+        current += step
+        peak = max(peak, current)
+    return peak
+
+async def run_round(args, port, token, file_id, clients):
+    size, rate = parse_size(args.size), parse_size(args.rate)
+    if args.direction == 'download':
+        transfers = [download(port, token, file_id, rate) for _ in range(clients)]
+    else:
+        transfers = [upload(port, token, size, rate) for _ in range(clients)]
+
+    started = time.monotonic()
+    probe_task = asyncio.ensure_future(probe(port, token, min(1.0, size / rate / 2)))
+    results = await asyncio.wait_for(asyncio.gather(*transfers, return_exceptions=True), args.timeout)
+    wall = time.monotonic() - started
+    probe_status, probe_latency = await probe_task
+
+    done = [r for r in results if isinstance(r, dict) and r['status'] < 400]
+    ideal = size / rate
+    ttfb = [r['first_byte'] - r['started'] for r in done]
+    return {
+        'clients': clients,
+        'completed': len(done),
+        'failed': clients - len(done),
+        'wall_seconds': wall,
+        'ideal_seconds': ideal,
+        # Average number of transfers the worker kept moving at once
+        'effective_concurrency': len(done) * ideal / wall if wall else None,
+        'peak_in_flight': peak_in_flight(done) if args.direction == 'download' else None,
+        'ttfb_median_seconds': statistics.median(ttfb) if ttfb else None,
+        'ttfb_max_seconds': max(ttfb) if ttfb else None,
+        'probe_status': probe_status,
+        'probe_latency_seconds': probe_latency,
+    }
+
+def shared_database(workdir):
+    # The benchmark and its servers share one throwaway database: a file
+    # in the work directory for SQLite, a named test database otherwise
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    from django.conf import settings
+
+    if settings.DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+        return os.path.join(workdir, 'db.sqlite3')
+    return f'test_transfers_{os.getpid()}'
+
+def create_fixtures(size):
+    from django.core.files.storage import default_storage
+    from account.serializers import CustomTokenObtainPairSerializer
+    from benchmarks import create_user
+    from storage.models import EncryptedFile, KeyEnvelope
+
+    user = create_user()
+    name = 'encrypted_files/bench.bin'
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as blob:
+        blob.truncate(size)
+    file = EncryptedFile.objects.create(
+        user=user,
+        file_name='bench.bin',
+        file_type='application/octet-stream',
+        file_size=size,
+        encrypted_file=name,
+    )
+    KeyEnvelope.objects.create(file=file, wrapped_key=os.urandom(32))
+    token = str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+    return token, file.id
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--clients', nargs='+', type=int, default=[1, 4, 16])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--direction', choices=['download', 'upload'], default='download')
+    parser.add_argument('--size', default='16M', help='bytes per transfer')
+    parser.add_argument('--rate', default='4M', help='bytes/s per client')
+    parser.add_argument('--timeout', type=float, default=600)
+    parser.add_argument('--serve', choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--media', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.database, args.media)
+        return
+
+    workdir = tempfile.mkdtemp(prefix='bench-transfers-')
+    database = shared_database(workdir)
+    media_root = os.path.join(workdir, 'media')
+    try:
+        setup_django(database, media_root)
+        token, file_id = create_fixtures(parse_size(args.size))
+        from django.db import connection, connections
+        connections.close_all()
+
+        results = []
+        try:
+            for mode in args.modes:
+                port = free_port()
+                server = subprocess.Popen(
+                    [sys.executable, '-m', 'benchmarks.concurrent_transfers', '--serve', mode,
+                     '--port', str(port), '--database', database, '--media', media_root],
+                    cwd=PROJECT_DIR
+                )
+                try:
+                    wait_for_port(port)
+                    for clients in args.clients:
+                        result = asyncio.run(run_round(args, port, token, file_id, clients))
+                        results.append({'mode': mode, 'direction': args.direction, **result})
+                finally:
+                    server.terminate()
+                    server.wait()
+        finally:
+            connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{'mode':>6} {'clients':>8} {'done':>5} {'wall s':>8} {'ideal s':>8} "
+          f"{'concurrency':>12} {'max TTFB s':>11} {'probe s':>8}")
+    for r in results:
+        print(f"{r['mode']:>6} {r['clients']:>8} {r['completed']:>5} {r['wall_seconds']:>8.1f} "
+              f"{r['ideal_seconds']:>8.1f} {r['effective_concurrency']:>12.1f} "
+              f"{r['ttfb_max_seconds'] or 0:>11.2f} {r['probe_latency_seconds']:>8.2f}")
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Peak RSS and throughput of FileDownloadView, buffered vs streaming.
+
+Each (size, mode) pair runs in its own interpreter so ru_maxrss reflects
+only that download. Blobs are sparse files, so the numbers measure the
+worker rather than the disk.
+
+    python -m benchmarks.download_memory
+    python -m benchmarks.download_memory --sizes 10M 500M 2G
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from benchmarks import PROJECT_DIR, parse_size, peak_rss_bytes, setup_django
+
+MODES = ['buffered', 'streaming']
+
+def buffered_download(file, request=None):
+    # The pre-streaming implementation: whole blob read, sliced and re-joined
+    from django.http import HttpResponse
+    from storage.downloads import set_download_headers
+
+    file_content = file.encrypted_file.read()
+    iv = file_content[:12]
+    encrypted_data = file_content[12:]
+    response_data = iv + encrypted_data
+    response = HttpResponse(content=response_data, content_type=str(file.file_type))
+    response['Content-Length'] = str(len(response_data))
+    return set_download_headers(response, file, file.wrapped_key())
+
+def run_worker(size, mode):
+    setup_django()
+
+    from django.core.files.storage import default_storage
+    from benchmarks import auth_client, create_user
+    from storage.models import EncryptedFile, KeyEnvelope
+    import storage.views
+
+    if mode == 'buffered':
+        storage.views.stream_encrypted_file = buffered_download
+
+    user = create_user()
+    name = 'encrypted_files/bench.bin'
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as blob:
+        blob.truncate(size)
+
+    file = EncryptedFile.objects.create(
+        user=user,
+        file_name='bench.bin',
+        file_type='application/octet-stream',
+        file_size=size,
+        encrypted_file=name,
+    )
+    KeyEnvelope.objects.create(file=file, wrapped_key=os.urandom(32))
+    client = auth_client(user)
+
+    baseline = peak_rss_bytes()
+    start = time.perf_counter()
+    response = client.get(f'/storage/download/{file.id}', secure=True)
+    if response.streaming:
+        received = sum(len(chunk) for chunk in response.streaming_content)
+    else:
+        received = len(response.content)
+    response.close()
+    elapsed = time.perf_counter() - start
+    os.remove(path)
+
+    return {
+        'mode': mode,
+        'size': size,
+        'status': response.status_code,
+        'bytes': received,
+        'seconds': elapsed,
+        'throughput_mb_s': received / elapsed / 1024 ** 2 if elapsed else None,
+        'peak_rss_mb': peak_rss_bytes() / 1024 ** 2,
+        'peak_rss_growth_mb': (peak_rss_bytes() - baseline) / 1024 ** 2,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', nargs='+', default=['10M', '500M', '2G'])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_worker(parse_size(args.sizes[0]), args.modes[0])))
+        return
+
+    results = []
+    for size in args.sizes:
+        for mode in args.modes:
+            proc = subprocess.run(
+                [sys.executable, '-m', 'benchmarks.download_memory', '--worker',
+                 '--sizes', size, '--modes', mode],
+                cwd=PROJECT_DIR, capture_output=True, text=True
+            )
+            if proc.returncode != 0:
+                # Most likely the buffered path was OOM-killed
+                results.append({'mode': mode, 'size': parse_size(size),
+                                'error': proc.stderr.strip().splitlines()[-1:] or f'exit {proc.returncode}'})
+                continue
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'size':>8} {'mode':>10} {'peak RSS':>10} {'growth':>10} {'MB/s':>8}")
+    for r in results:
+        size = f"{r['size'] / 1024 ** 2:.0f}M"
+        if 'error' in r:
+            print(f"{size:>8} {r['mode']:>10}  failed: {r['error']}")
+            continue
+        print(f"{size:>8} {r['mode']:>10} {r['peak_rss_mb']:>9.1f}M "
+              f"{r['peak_rss_growth_mb']:>9.1f}M {r['throughput_mb_s']:>8.1f}")
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Write throughput and "database is locked" rate on SQLite, default vs tuned.
+
+Several processes, standing in for the gunicorn workers, hammer one SQLite
+file through the real views for a fixed time: small uploads, direct shares
+and share-link create + redeem. `default` is the stock configuration
+(rollback journal, no busy timeout, deferred transactions); `tuned` is the
+SQLITE_PROFILE=tuned profile from project.settings.
+
+    python -m benchmarks.sqlite_writes
+    python -m benchmarks.sqlite_writes --workers 3 6 --duration 20
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks import PROJECT_DIR, setup_django
+
+PROFILES = ['default', 'tuned']
+OPERATIONS = ['upload', 'share', 'redeem']
+RECIPIENTS = 8
+FILES = 4
+
+def prepare(workdir):
+    setup_django(os.path.join(workdir, 'db.sqlite3'), os.path.join(workdir, 'media'))
+
+    from django.core.files.base import ContentFile
+    from account.serializers import CustomTokenObtainPairSerializer
+    from benchmarks import create_user
+    from storage.models import EncryptedFile, KeyEnvelope
+
+    owner = create_user('owner')
+    recipients = [create_user(f'recipient{i}') for i in range(RECIPIENTS)]
+    files = []
+    for i in range(FILES):
+        file = EncryptedFile(user=owner, file_name=f'f{i}', file_type='application/octet-stream', file_size=1)
+        file.encrypted_file.save(f'f{i}', ContentFile(b'x' * 29), save=False)
+        file.save()
+        KeyEnvelope.objects.create(file=file, wrapped_key=b'k' * 32)
+        files.append(file.id)
+
+    token = lambda user: str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+    return {
+        'owner': token(owner),
+        'recipients': [{'email': user.email, 'token': token(user)} for user in recipients],
+        'files': files,
+    }
+
+def is_lock_error(text):
+    return 'database is locked' in text or 'database table is locked' in text
+
+def run_operation(client, fixtures, rng, operation):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    owner = {'HTTP_AUTHORIZATION': f"Bearer {fixtures['owner']}"}
+    file_id = rng.choice(fixtures['files'])
+    recipient = rng.choice(fixtures['recipients'])
+
+    if operation == 'upload':
+        return [client.post('/storage/upload', {
+            'file': SimpleUploadedFile('blob', os.urandom(1024 + 28)),
+            'encrypted_key': SimpleUploadedFile('key', b'k' * 32),
+            'file_name': 'blob',
+            'file_type': 'application/octet-stream',
+            'file_size': 1024,
+        }, secure=True, **owner)]
+    if operation == 'share':
+        return [client.post(f'/storage/share/{file_id}', {
+            'shared_with_email': recipient['email'],
+            'permission': 'view',
+        }, content_type='application/json', secure=True, **owner)]
+
+    created = client.post(f'/storage/share/{file_id}/share-link', {}, content_type='application/json', secure=True, **owner)
+    if created.status_code != 201:
+        return [created]
+    return [created, client.get(f"/storage/share/link/{created.json()['token']}", secure=True,
+                                HTTP_AUTHORIZATION=f"Bearer {recipient['token']}")]
+
+def run_worker(workdir, seed, start_at, duration):
+    setup_django(os.path.join(workdir, 'db.sqlite3'), os.path.join(workdir, 'media'))
+
+    from django.test import Client
+
+    with open(os.path.join(workdir, 'fixtures.json')) as handle:
+        fixtures = json.load(handle)
+    client = Client(raise_request_exception=True)
+    rng = random.Random(seed)
+    counts = {'ok': 0, 'locked': 0, 'error': 0}
+    latencies = []
+
+    time.sleep(max(0.0, start_at - time.time()))
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        started = time.monotonic()
+        try:
+            responses = run_operation(client, fixtures, rng, rng.choice(OPERATIONS))
+            failed = [r for r in responses if r.status_code >= 400]
+            if not failed:
+                outcome = 'ok'
+            elif any(is_lock_error(r.content.decode(errors='replace')) for r in failed):
+                outcome = 'locked'
+            else:
+                outcome = 'error'
+        except Exception as e:
+            outcome = 'locked' if is_lock_error(str(e)) else 'error'
+        counts[outcome] += 1
+        latencies.append(time.monotonic() - started)
+    return {'counts': counts, 'latencies': latencies}
+
+def run_profile(profile, workers, duration):
+    workdir = tempfile.mkdtemp(prefix='bench-sqlite-')
+    env = dict(os.environ, SQLITE_PROFILE=profile, DATABASE_ENGINE='sqlite')
+    try:
+        proc = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.sqlite_writes', '--prepare', workdir],
+            cwd=PROJECT_DIR, env=env, check=True, capture_output=True, text=True
+        )
+        with open(os.path.join(workdir, 'fixtures.json'), 'w') as handle:
+            handle.write(proc.stdout.strip().splitlines()[-1])
+
+        # Workers boot first and start together
+        start_at = time.time() + 5
+        procs = [
+            subprocess.Popen(
+                [sys.executable, '-m', 'benchmarks.sqlite_writes', '--worker', workdir,
+                 '--seed', str(seed), '--start-at', str(start_at), '--duration', str(duration)],
+                cwd=PROJECT_DIR, env=env, stdout=subprocess.PIPE, text=True
+            )
+            for seed in range(workers)
+        ]
+        outputs = [json.loads(p.communicate()[0].strip().splitlines()[-1]) for p in procs]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    counts = {key: sum(o['counts'][key] for o in outputs) for key in ('ok', 'locked', 'error')}
+    latencies = sorted(latency for o in outputs for latency in o['latencies'])
+    total = sum(counts.values())
+    return {
+        'profile': profile,
+        'workers': workers,
+        'duration_seconds': duration,
+        'operations': total,
+        **counts,
+        'ok_per_second': counts['ok'] / duration,
+        'lock_error_rate': counts['locked'] / total if total else None,
+        'latency_median_ms': statistics.median(latencies) * 1000 if latencies else None,
+        'latency_p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', nargs='+', type=int, default=[3])
+    parser.add_argument('--profiles', nargs='+', choices=PROFILES, default=PROFILES)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--prepare', metavar='WORKDIR', help=argparse.SUPPRESS)
+    parser.add_argument('--worker', metavar='WORKDIR', help=argparse.SUPPRESS)
+    parser.add_argument('--seed', type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument('--start-at', type=float, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.prepare:
+        print(json.dumps(prepare(args.prepare)))
+        return
+    if args.worker:
+        print(json.dumps(run_worker(args.worker, args.seed, args.start_at, args.duration)))
+        return
+
+    results = [
+        run_profile(profile, workers, args.duration)
+        for workers in args.workers
+        for profile in args.profiles
+    ]
+
+    print(f"{'profile':>8} {'workers':>8} {'ok/s':>8} {'locked':>8} {'errors':>7} "
+          f"{'lock rate':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for r in results:
+        print(f"{r['profile']:>8} {r['workers']:>8} {r['ok_per_second']:>8.1f} {r['locked']:>8} "
+              f"{r['error']:>7} {r['lock_error_rate'] or 0:>10.1%} "
+              f"{r['latency_median_ms'] or 0:>8.1f} {r['latency_p95_ms'] or 0:>8.1f}")
+    print(json.dumps(results))
+
+if __name__ == '__main__':
+    main()
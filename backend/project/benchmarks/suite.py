@@ -0,0 +1,469 @@
+"""
+End-to-end latency, throughput, peak RSS and query counts per endpoint.
+
+Each case is a scenario and a parameter, e.g. upload:1M or list:100k, and
+runs in its own interpreter against a fresh throwaway database, so peak
+RSS is that case's alone. Requests go through the Django test client
+in-process, or with --server gunicorn over HTTP to a one-worker gunicorn
+sync server started for the case; peak RSS is then the worker's. Query
+counts and DB time come from the Server-Timing header, which the suite
+turns on along with effectively unlimited login throttles.
+
+In-process uploads hold the whole request body in the benchmark, so their
+peak RSS includes it; use --server gunicorn to measure the server alone.
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --cases upload:1K list:1k login --output before.json
+    python -m benchmarks.suite --server gunicorn --cases download:64M
+
+The full JSON report goes to stdout (and --output): compare two runs case
+by case to spot regressions between commits.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from benchmarks import PROJECT_DIR, create_user, parse_size, peak_rss_bytes, setup_django
+
+SERVERS = ['inprocess', 'gunicorn']
+DEFAULT_CASES = [
+    'upload:1K', 'upload:1M', 'upload:64M', 'upload:1G',
+    'download:1K', 'download:1M', 'download:64M', 'download:1G',
+    'list:1k', 'list:100k', 'list:1M',
+    'share', 'redeem', 'login', 'refresh',
+]
+# Large transfers repeat until about this many bytes have moved, and at
+# least MIN_TRANSFERS times
+TRANSFER_BUDGET = 2 * 1024 ** 3
+MIN_TRANSFERS = 3
+READ_SIZE = 64 * 1024
+FIXTURE_BATCH_SIZE = 5000
+BENCH_SETTINGS = {
+    'SERVER_TIMING': True,
+    'LOGIN_THROTTLE_BUCKETS': {'ip': (10 ** 9, 10 ** 9), 'username': (10 ** 9, 10 ** 9)},
+}
+SERVER_TIMING_DB = re.compile(r'db;dur=([\d.]+);desc="(\d+) queries"')
+
+class Body:
+    # A multipart body produced block by block, so large uploads never
+    # have to exist in memory when sent over HTTP
+    def __init__(self, preamble, size, trailer):
+        self.preamble = preamble
+        self.size = size
+        self.trailer = trailer
+        self.length = len(preamble) + size + len(trailer)
+
+    def chunks(self):
+        yield self.preamble
+        block = bytes(READ_SIZE)
+        sent = 0
+        while sent < self.size:
+            data = block[:min(READ_SIZE, self.size - sent)]
+            sent += len(data)
+            yield data
+        yield self.trailer
+
+    def __bytes__(self):
+        return self.preamble + bytes(self.size) + self.trailer
+
+class Request:
+    def __init__(self, method, path, token=None, body=b'', content_type='application/json'):
+        self.method = method
+        self.path = path
+        self.token = token
+        self.body = body
+        self.content_type = content_type
+
+class InProcessTransport:
+    name = 'inprocess'
+
+    def __init__(self):
+        from django.test import Client
+        self.client = Client()
+
+    def send(self, request):
+        headers = {'Authorization': f'Bearer {request.token}'} if request.token else {}
+        body = bytes(request.body)
+        response = self.client.generic(
+            request.method, request.path, body, request.content_type, secure=True, headers=headers
+        )
+        if response.streaming:
+            received = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            received = len(response.content)
+        response.close()
+        return response.status_code, response.get('Server-Timing', ''), received
+
+class HttpTransport:
+    name = 'gunicorn'
+
+    def __init__(self, port):
+        self.port = port
+
+    def send(self, request):
+        # X-Forwarded-Proto stands in for the TLS-terminating proxy
+        headers = {'X-Forwarded-Proto': 'https', 'Content-Type': request.content_type}
+        if request.token:
+            headers['Authorization'] = f'Bearer {request.token}'
+        if isinstance(request.body, Body):
+            headers['Content-Length'] = str(request.body.length)
+            body = request.body.chunks()
+        else:
+            body = request.body
+        connection = http.client.HTTPConnection('127.0.0.1', self.port)
+        try:
+            connection.request(request.method, request.path, body, headers)
+            response = connection.getresponse()
+            received = 0
+            while data := response.read(READ_SIZE):
+                received += len(data)
+            return response.status, response.getheader('Server-Timing', ''), received
+        finally:
+            connection.close()
+
+def parse_count(value):
+    # 1k, 100k, 1M visible files
+    units = {'K': 1000, 'M': 1000 ** 2}
+    value = value.strip().upper()
+    if value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def access_token(user):
+    from account.serializers import CustomTokenObtainPairSerializer
+    return str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+
+def create_files(owner, count, name='encrypted_files/bench.bin', size=0):
+    """
+    Bulk-create `count` files owned by `owner` with their key envelopes and
+    owner visibility rows and version, which bulk_create would otherwise
+    skip. Returns the file ids.
+    """
+    from storage.models import EncryptedFile, FileVisibility, KeyEnvelope
+    from storage.visibility import bump
+
+    ids = []
+    for start in range(0, count, FIXTURE_BATCH_SIZE):
+        files = EncryptedFile.objects.bulk_create([
+            EncryptedFile(user=owner, file_name=f'bench-{start + i}.bin', file_type='application/octet-stream',
+                          file_size=size, encrypted_file=name)
+            for i in range(min(FIXTURE_BATCH_SIZE, count - start))
+        ])
+        KeyEnvelope.objects.bulk_create([KeyEnvelope(file=file, wrapped_key=b'k' * 32) for file in files])
+        FileVisibility.objects.bulk_create([
+            FileVisibility(user=owner, file=file, permission='owner', uploaded_at=file.uploaded_at)
+            for file in files
+        ])
+        ids.extend(file.pk for file in files)
+    bump([owner.pk])
+    return ids
+
+def share_files(file_ids, recipient):
+    from storage.models import EncryptedFile, FileShare
+    from storage.visibility import grant_shares
+
+    for start in range(0, len(file_ids), FIXTURE_BATCH_SIZE):
+        batch = file_ids[start:start + FIXTURE_BATCH_SIZE]
+        shares = FileShare.objects.bulk_create(
+            [FileShare(file_id=file_id, shared_with=recipient, permission='view') for file_id in batch]
+        )
+        grant_shares(shares, EncryptedFile.objects.in_bulk(batch))
+        EncryptedFile.objects.filter(pk__in=batch).update(is_shared=True)
+
+def upload_requests(param, count):
+    from storage.uploads import ENCRYPTION_OVERHEAD
+
+    size = parse_size(param)
+    token = access_token(create_user(role='admin'))  # no quota
+    boundary = uuid.uuid4().hex
+    fields = {'file_name': 'bench.bin', 'file_type': 'application/octet-stream',
+              'file_size': str(max(size - ENCRYPTION_OVERHEAD, 0))}
+    preamble = ''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+        for name, value in fields.items()
+    ) + (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="encrypted_key"; filename="key"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n{"k" * 32}\r\n'
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="bench.bin"\r\n'
+        f'Content-Type: application/octet-stream\r\n\r\n'
+    )
+    body = Body(preamble.encode(), size, f'\r\n--{boundary}--\r\n'.encode())
+    content_type = f'multipart/form-data; boundary={boundary}'
+    return [Request('POST', '/storage/upload', token, body, content_type) for _ in range(count)], size
+
+def download_requests(param, count):
+    from django.core.files.storage import default_storage
+
+    size = parse_size(param)
+    user = create_user()
+    name = 'encrypted_files/bench.bin'
+    path = default_storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Sparse, so the numbers measure the server rather than the disk
+    with open(path, 'wb') as blob:
+        blob.truncate(size)
+    [file_id] = create_files(user, 1, name, size)
+    token = access_token(user)
+    return [Request('GET', f'/storage/download/{file_id}', token) for _ in range(count)], size
+
+def list_requests(param, count):
+    # A quarter of the visible files are shared by another user
+    visible = parse_count(param)
+    user = create_user()
+    create_files(user, visible - visible // 4)
+    share_files(create_files(create_user('owner'), visible // 4), user)
+    token = access_token(user)
+    return [Request('GET', '/storage/files?limit=50', token) for _ in range(count)], 0
+
+def share_requests(param, count):
+    # Every request shares a different file
+    owner = create_user()
+    recipient = create_user('recipient')
+    token = access_token(owner)
+    body = json.dumps({'shared_with_email': recipient.email, 'permission': 'view'}).encode()
+    return [Request('POST', f'/storage/share/{file_id}', token, body) for file_id in create_files(owner, count)], 0
+
+def redeem_requests(param, count):
+    from storage.models import ShareableLink
+
+    owner = create_user()
+    recipient = create_user('recipient')
+    expires_at = datetime.now(timezone.utc) + timedelta(days=1)
+    links = ShareableLink.objects.bulk_create([
+        ShareableLink(file_id=file_id, created_by=owner, expires_at=expires_at)
+        for file_id in create_files(owner, count)
+    ])
+    token = access_token(recipient)
+    return [Request('GET', f'/storage/share/link/{link.token}', token) for link in links], 0
+
+def login_requests(param, count):
+    # The bench user's password is hashed with the configured hasher (PBKDF2)
+    user = create_user()
+    body = json.dumps({'username': user.username, 'password': 'bench-password-123'}).encode()
+    return [Request('POST', '/user/login', body=body) for _ in range(count)], 0
+
+def refresh_requests(param, count):
+    # Refresh tokens rotate and are blacklisted after use, so one each
+    from account.serializers import CustomTokenObtainPairSerializer
+
+    user = create_user()
+    return [
+        Request('POST', '/user/token/refresh',
+                body=json.dumps({'refresh': str(CustomTokenObtainPairSerializer.get_token(user))}).encode())
+        for _ in range(count)
+    ], 0
+
+SCENARIOS = {
+    'upload': upload_requests,
+    'download': download_requests,
+    'list': list_requests,
+    'share': share_requests,
+    'redeem': redeem_requests,
+    'login': login_requests,
+    'refresh': refresh_requests,
+}
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    cuts = statistics.quantiles(values, n=100, method='inclusive') if len(values) > 1 else values * 99
+    return {'mean': statistics.fmean(values), 'min': values[0], 'p50': cuts[49],
+            'p95': cuts[94], 'p99': cuts[98], 'max': values[-1]}
+
+def worker_peak_rss(pid):
+    # VmHWM of the gunicorn worker(s), the children of the arbiter
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as file:
+            children = file.read().split()
+    except OSError:
+        return None
+    peak = None
+    for child in children:
+        try:
+            with open(f'/proc/{child}/status') as file:
+                for line in file:
+                    if line.startswith('VmHWM:'):
+                        peak = max(peak or 0, int(line.split()[1]) * 1024)
+        except OSError:
+            continue
+    return peak
+
+def serve(port, database, media_root):
+    import django
+    from django.test.utils import override_settings
+    from benchmarks.concurrent_transfers import serve as serve_gunicorn
+
+    # Settings must be loaded before they can be overridden
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    django.setup()
+    override_settings(**BENCH_SETTINGS).enable()
+    serve_gunicorn('sync', port, database, media_root)
+
+def measure(transport, requests, warmup):
+    for request in requests[:warmup]:
+        transport.send(request)
+
+    latencies, queries, db_seconds, statuses = [], [], [], {}
+    received = 0
+    started = time.perf_counter()
+    for request in requests[warmup:]:
+        start = time.perf_counter()
+        status, server_timing, size = transport.send(request)
+        latencies.append(time.perf_counter() - start)
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        received += size
+        if match := SERVER_TIMING_DB.search(server_timing):
+            db_seconds.append(float(match.group(1)) / 1000)
+            queries.append(int(match.group(2)))
+    return time.perf_counter() - started, latencies, queries, db_seconds, statuses, received
+
+def run_case(case, args):
+    from benchmarks.concurrent_transfers import free_port, shared_database, wait_for_port
+
+    scenario, _, param = case.partition(':')
+    workdir = tempfile.mkdtemp(prefix='bench-suite-')
+    database = shared_database(workdir) if args.server == 'gunicorn' else None
+    media_root = os.path.join(workdir, 'media')
+    try:
+        setup_django(database, media_root)
+        from django.conf import settings
+        from django.db import connection, connections
+        from django.test.utils import override_settings
+
+        override_settings(**BENCH_SETTINGS).enable()
+        server = None
+        try:
+            iterations = args.iterations
+            if scenario in ('upload', 'download'):
+                iterations = min(iterations, max(MIN_TRANSFERS, TRANSFER_BUDGET // max(parse_size(param), 1)))
+            requests, size = SCENARIOS[scenario](param, args.warmup + iterations)
+
+            if args.server == 'gunicorn':
+                connections.close_all()
+                port = free_port()
+                server = subprocess.Popen(
+                    [sys.executable, '-m', 'benchmarks.suite', '--serve', '--port', str(port),
+                     '--database', database, '--media', media_root],
+                    cwd=PROJECT_DIR
+                )
+                wait_for_port(port)
+                transport = HttpTransport(port)
+            else:
+                transport = InProcessTransport()
+
+            seconds, latencies, queries, db_seconds, statuses, received = measure(transport, requests, args.warmup)
+            peak_rss = worker_peak_rss(server.pid) if server else peak_rss_bytes()
+        finally:
+            if server:
+                server.terminate()
+                server.wait()
+            connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    transferred = None
+    if scenario == 'upload':
+        transferred = size * len(latencies)
+    elif scenario == 'download':
+        transferred = received
+    return {
+        'case': case,
+        'scenario': scenario,
+        'param': param or None,
+        'server': args.server,
+        'database': settings.DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        'requests': len(latencies),
+        'statuses': statuses,
+        'seconds': seconds,
+        'requests_per_second': len(latencies) / seconds if seconds else None,
+        'bytes_per_second': transferred / seconds if transferred is not None and seconds else None,
+        'latency_seconds': percentiles(latencies),
+        'queries': percentiles(queries),
+        'db_seconds': percentiles(db_seconds),
+        'peak_rss_bytes': peak_rss,
+    }
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=PROJECT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, metavar='SCENARIO[:PARAM]',
+                        help=f"scenarios: {', '.join(SCENARIOS)}")
+    parser.add_argument('--server', choices=SERVERS, default='inprocess')
+    parser.add_argument('--iterations', type=int, default=20, help='measured requests per case')
+    parser.add_argument('--warmup', type=int, default=2, help='unmeasured requests per case')
+    parser.add_argument('--output', help='also write the JSON report here')
+    parser.add_argument('--run-case', help=argparse.SUPPRESS)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--database', help=argparse.SUPPRESS)
+    parser.add_argument('--media', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.port, args.database, args.media)
+        return
+    if args.run_case:
+        print(json.dumps(run_case(args.run_case, args)))
+        return
+
+    for case in args.cases:
+        if case.partition(':')[0] not in SCENARIOS:
+            parser.error(f'unknown scenario in {case!r}')
+
+    results = []
+    for case in args.cases:
+        proc = subprocess.run(
+            [sys.executable, '-m', 'benchmarks.suite', '--run-case', case, '--server', args.server,
+             '--iterations', str(args.iterations), '--warmup', str(args.warmup)],
+            cwd=PROJECT_DIR, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            results.append({'case': case, 'error': proc.stderr.strip().splitlines()[-1:] or f'exit {proc.returncode}'})
+        else:
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        sys.stderr.write(f"{case}: {'failed' if 'error' in results[-1] else 'done'}\n")
+
+    print(f"{'case':>14} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>8} {'peak RSS':>10}",
+          file=sys.stderr)
+    for r in results:
+        if 'error' in r:
+            print(f"{r['case']:>14}  failed: {r['error']}", file=sys.stderr)
+            continue
+        latency = r['latency_seconds']
+        queries = r['queries']['p50'] if r['queries'] else float('nan')
+        print(f"{r['case']:>14} {r['requests_per_second']:>9.1f} {latency['p50'] * 1000:>9.1f} "
+              f"{latency['p95'] * 1000:>9.1f} {latency['p99'] * 1000:>9.1f} {queries:>8.0f} "
+              f"{r['peak_rss_bytes'] / 1024 ** 2:>9.1f}M", file=sys.stderr)
+
+    report = {
+        'commit': commit(),
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'server': args.server,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report))
+
+if __name__ == '__main__':
+    main()
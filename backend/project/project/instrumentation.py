@@ -0,0 +1,195 @@
+"""
+Per-request timing, exported through project.metrics and, when
+SERVER_TIMING is set, as a Server-Timing response header.
+
+InstrumentationMiddleware runs first and times the rest of the chain.
+While it runs, a context variable holds the request's RequestTimings:
+every database connection counts its queries into it, and timed() blocks
+(authentication uses one) add named spans. Context variables follow the
+request into sync_to_async threads, so async views are measured the same
+way. Work done while a streaming body is sent, after the view returned,
+is outside the timings; only the bytes sent are counted.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from .metrics import Counter, Histogram
+import time
+
+request_duration = Histogram(
+    'secureshare_request_duration_seconds',
+    'Time from the request reaching the middleware until the view returned',
+    ['view', 'method']
+)
+requests_total = Counter(
+    'secureshare_requests_total',
+    'Requests by view, method and response status',
+    ['view', 'method', 'status']
+)
+db_queries = Histogram(
+    'secureshare_request_db_queries',
+    'Database queries per request',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+)
+db_duration = Histogram(
+    'secureshare_request_db_seconds',
+    'Time per request spent in database queries',
+    ['view']
+)
+auth_duration = Histogram(
+    'secureshare_request_auth_seconds',
+    'Time per request spent authenticating the access token',
+    ['view']
+)
+request_bytes = Counter(
+    'secureshare_request_bytes_total',
+    'Request body bytes, as declared by Content-Length',
+    ['view']
+)
+response_bytes = Counter(
+    'secureshare_response_bytes_total',
+    'Response body bytes; streamed bodies are counted as they are sent',
+    ['view']
+)
+
+class RequestTimings:
+    __slots__ = ('queries', 'db_seconds', 'spans')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        # span name -> seconds
+        self.spans = {}
+
+_current = ContextVar('request_timings', default=None)
+
+@contextmanager
+def timed(name):
+    # Adds the block's duration to the current request's `name` span
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings is not None:
+            timings.spans[name] = timings.spans.get(name, 0.0) + time.perf_counter() - start
+
+def count_queries(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.queries += 1
+        timings.db_seconds += time.perf_counter() - start
+
+def _install(connection, **kwargs):
+    # Connections are reopened on the same wrapper object
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+connection_created.connect(_install)
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Unmatched paths share one label rather than one each
+    return match.view_name if match else 'unmatched'
+
+def _count_stream(response, view):
+    # Count streamed bytes as they go out, in whichever mode the body is
+    content = response.streaming_content
+    if response.is_async:
+        async def counted():
+            sent = 0
+            try:
+                async for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                response_bytes.inc(sent, view=view)
+    else:
+        def counted():
+            sent = 0
+            try:
+                for chunk in content:
+                    sent += len(chunk)
+                    yield chunk
+            finally:
+                response_bytes.inc(sent, view=view)
+    response.streaming_content = counted()
+
+def _server_timing(total, timings):
+    entries = [f'total;dur={total * 1000:.1f}']
+    entries.append(f'db;dur={timings.db_seconds * 1000:.1f};desc="{timings.queries} queries"')
+    for name, seconds in timings.spans.items():
+        entries.append(f'{name};dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
+
+class InstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+        # Connections opened before this module was imported
+        for connection in connections.all(initialized_only=True):
+            _install(connection)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timings)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timings)
+
+    def record(self, request, response, elapsed, timings):
+        view = _view_name(request)
+        request_duration.observe(elapsed, view=view, method=request.method)
+        requests_total.inc(view=view, method=request.method, status=response.status_code)
+        db_queries.observe(timings.queries, view=view)
+        db_duration.observe(timings.db_seconds, view=view)
+        if 'auth' in timings.spans:
+            auth_duration.observe(timings.spans['auth'], view=view)
+
+        try:
+            received = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            received = 0
+        if received:
+            request_bytes.inc(received, view=view)
+
+        if not response.streaming:
+            response_bytes.inc(len(response.content), view=view)
+        elif response.has_header('Content-Length'):
+            response_bytes.inc(int(response['Content-Length']), view=view)
+        elif getattr(response, 'file_to_stream', None) is None:
+            _count_stream(response, view)
+        # A FileResponse without a length is left alone so the server can
+        # still hand its file to sendfile; its bytes go uncounted
+
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = _server_timing(elapsed, timings)
+        return response
@@ -0,0 +1,190 @@
+"""
+Metrics shared across worker processes, rendered in the Prometheus text
+format at /metrics.
+
+Each process counts in memory and writes its samples to
+METRICS_DIR/<pid>.json at most once per METRICS_FLUSH_INTERVAL and at
+exit; on an event loop the write is handed to a background thread.
+collect() adds up the files of every process, including workers that
+have since exited, so totals survive worker restarts; point METRICS_DIR
+at a fresh directory per deployment (scripts/run.sh does). Without
+METRICS_DIR nothing is written and each process reports its own counts.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+import asyncio
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+
+_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_metrics = {}
+# (sample name, ((label, value), ...)) -> value for this process
+_samples = {}
+_last_flush = 0.0
+_file_name = None
+_flusher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='metrics-flush')
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None)
+
+def _add(name, labels, amount):
+    with _lock:
+        key = (name, labels)
+        _samples[key] = _samples.get(key, 0) + amount
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _metrics[name] = self
+
+    def _labels(self, labels):
+        return tuple((name, str(labels[name])) for name in self.labelnames)
+
+    def sample_names(self):
+        return [self.name]
+
+    def inc(self, amount=1, **labels):
+        _add(self.name, self._labels(labels), amount)
+        maybe_flush()
+
+class Histogram(Counter):
+    kind = 'histogram'
+    # Seconds; suits request latencies
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def sample_names(self):
+        return [f'{self.name}_bucket', f'{self.name}_sum', f'{self.name}_count']
+
+    def observe(self, value, **labels):
+        labels = self._labels(labels)
+        # Buckets are stored cumulative, as exposed, and every one is
+        # written so each series has the full set
+        for bound in self.buckets:
+            _add(f'{self.name}_bucket', labels + (('le', repr(float(bound))),), int(value <= bound))
+        _add(f'{self.name}_bucket', labels + (('le', '+Inf'),), 1)
+        _add(f'{self.name}_sum', labels, value)
+        _add(f'{self.name}_count', labels, 1)
+        maybe_flush()
+
+def _after_fork():
+    # A forked worker starts from zero under a file name of its own; what
+    # the parent counted stays the parent's
+    global _file_name
+    _samples.clear()
+    _file_name = None
+
+os.register_at_fork(after_in_child=_after_fork)
+
+def _path(directory):
+    global _file_name
+    if _file_name is None:
+        # Unique even when a pid is reused by a later worker
+        _file_name = f'{os.getpid()}-{time.time_ns()}.json'
+    return os.path.join(directory, _file_name)
+
+def _rows():
+    with _lock:
+        return [[name, [list(pair) for pair in labels], value] for (name, labels), value in _samples.items()]
+
+def flush():
+    global _last_flush
+    directory = metrics_dir()
+    with _flush_lock:
+        _last_flush = time.monotonic()
+        rows = _rows()
+        if not rows or directory is None:
+            return
+        os.makedirs(directory, exist_ok=True)
+        # Readers only ever see a complete file
+        handle, temporary = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(handle, 'w') as file:
+            json.dump(rows, file)
+        os.replace(temporary, _path(directory))
+
+def _on_event_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+def maybe_flush():
+    global _last_flush
+    if time.monotonic() - _last_flush < getattr(settings, 'METRICS_FLUSH_INTERVAL', 1.0):
+        return
+    if _on_event_loop():
+        # Async views and middleware must not wait on the file write
+        _last_flush = time.monotonic()
+        _flusher.submit(flush)
+    else:
+        flush()
+
+atexit.register(flush)
+
+def collect():
+    """
+    Sum the samples of every process: {sample name: {labels: value}}, with
+    labels as a tuple of (name, value) pairs.
+    """
+    totals = {}
+    for rows in _processes():
+        for name, labels, value in rows:
+            labels = tuple(tuple(pair) for pair in labels)
+            series = totals.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + value
+    return totals
+
+def _processes():
+    # The rows of each process, this one's current
+    directory = metrics_dir()
+    if directory is None:
+        yield _rows()
+        return
+    flush()
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return
+    with entries:
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as file:
+                    yield json.load(file)
+            except (OSError, ValueError):
+                continue
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _bucket_order(labels):
+    # Histogram buckets in increasing order, +Inf last
+    bound = dict(labels).get('le')
+    return (tuple(pair for pair in labels if pair[0] != 'le'), float(bound) if bound else 0)
+
+def render():
+    samples = collect()
+    lines = []
+    for family in sorted(_metrics):
+        metric = _metrics[family]
+        lines.append(f'# HELP {family} {metric.documentation}')
+        lines.append(f'# TYPE {family} {metric.kind}')
+        for name in metric.sample_names():
+            for labels, value in sorted(samples.pop(name, {}).items(), key=lambda item: _bucket_order(item[0])):
+                pairs = ','.join(f'{key}="{_escape(label)}"' for key, label in labels)
+                lines.append(f'{name}{{{pairs}}} {value}' if pairs else f'{name} {value}')
+    return '\n'.join(lines) + '\n'
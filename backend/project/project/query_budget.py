@@ -0,0 +1,114 @@
+"""
+Query budgets for API endpoints, for use in tests.
+
+QueryBudgetMixin.assertQueryBudget() runs one request against datasets of
+growing size and fails when the request runs more queries than its
+budget, or more queries on the largest dataset than on the smallest,
+which is how an N+1 shows up. The failure lists the queries of the
+offending run grouped by the project line that issued them.
+"""
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.db import connection
+from . import instrumentation
+import os
+import traceback
+
+# Frames that only pass queries through and never cause them
+_PASS_THROUGH = {os.path.abspath(__file__), os.path.abspath(instrumentation.__file__)}
+
+def call_site():
+    """
+    The innermost frame of project code, as 'path:line in function', or
+    None when the query came from outside the project.
+    """
+    base = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if (filename.startswith(base) and 'site-packages' not in filename
+                and filename not in _PASS_THROUGH):
+            return f'{os.path.relpath(filename, base)}:{frame.lineno} in {frame.name}'
+    return None
+
+class QueryLog:
+    """
+    Records (sql, call site) for every query run on the default connection
+    inside the block.
+    """
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site()))
+        return execute(sql, params, many, context)
+
+    def __enter__(self):
+        self._wrapper = connection.execute_wrapper(self)
+        self._wrapper.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._wrapper.__exit__(*exc_info)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def by_call_site(self):
+        # [(site, [sql, ...])], most queries first
+        sites = {}
+        for sql, site in self.queries:
+            sites.setdefault(site or '<outside the project>', []).append(sql)
+        return sorted(sites.items(), key=lambda item: -len(item[1]))
+
+    def report(self, samples=2):
+        lines = []
+        for site, statements in self.by_call_site():
+            lines.append(f'{len(statements):>4} x {site}')
+            for sql in list(dict.fromkeys(statements))[:samples]:
+                lines.append(f'         {sql}')
+        return '\n'.join(lines)
+
+def read_body(response):
+    """
+    The whole body of a test client response, streamed or not. A body
+    streamed by an async view is consumed on an event loop of its own.
+    """
+    if not response.streaming:
+        return response.content
+    if response.is_async:
+        async def consume():
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(consume)()
+    return b''.join(response.streaming_content)
+
+class QueryBudgetMixin:
+    """
+    TestCase mixin. query_budget_sizes are the dataset sizes each endpoint
+    is run against, smallest first.
+    """
+    query_budget_sizes = (1, 5, 20)
+
+    def assertQueryBudget(self, request, populate, budget, sizes=None):
+        """
+        For each size, call populate(size) to grow the dataset to that size,
+        then request() and count its queries, including those run while a
+        streamed body is read. Fails if any run is over `budget` or the
+        largest dataset takes more queries than the smallest.
+        """
+        runs = []
+        for size in sizes or self.query_budget_sizes:
+            populate(size)
+            with QueryLog() as log:
+                response = request()
+                read_body(response)
+            self.assertLess(response.status_code, 400, f'{size} rows: status {response.status_code}')
+            runs.append((size, log))
+
+        counts = ', '.join(f'{len(log)} at {size}' for size, log in runs)
+        over = [(size, log) for size, log in runs if len(log) > budget]
+        if over:
+            size, log = over[0]
+            self.fail(f'Over the budget of {budget} queries ({counts}); queries at {size}:\n{log.report()}')
+        first, (last_size, last) = runs[0][1], runs[-1]
+        if len(last) > len(first):
+            self.fail(f'Queries grow with rows ({counts}); queries at {last_size}:\n{last.report()}')
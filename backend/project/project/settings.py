@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 from pathlib import Path
+import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -39,6 +40,10 @@ CORS_EXPOSE_HEADERS = [
     'Encrypted-Key',
     'Content-Length',
     'Content-Type',
+    'Accept-Ranges',
+    'Content-Range',
+    'ETag',
+    'Last-Modified',
 ]
 
 CORS_ALLOW_HEADERS = [
@@ -47,7 +52,9 @@ CORS_ALLOW_HEADERS = [
     'authorization',
     'content-type',
     'dnt',
+    'if-range',
     'origin',
+    'range',
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
@@ -57,6 +64,9 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ),
+    # Throttles key clients by REMOTE_ADDR; set NUM_PROXIES when running
+    # behind proxies that append to X-Forwarded-For
+    'NUM_PROXIES': int(os.environ.get('NUM_PROXIES', '0')),
 }
 
 # Application definition
@@ -78,6 +88,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'project.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -111,13 +122,64 @@ WSGI_APPLICATION = 'project.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DATABASE_ENGINE=postgresql selects PostgreSQL, configured from the
+# POSTGRES_* variables; anything else keeps the local SQLite file. The
+# backend-tests compose service runs the suite on the former.
+
+DATABASE_ENGINE = os.environ.get('DATABASE_ENGINE', 'sqlite')
+
+if DATABASE_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'secureshare'),
+            'USER': os.environ.get('POSTGRES_USER', 'secureshare'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        }
     }
-}
+    # Connections are health-checked before reuse, whether they come from
+    # the pool or persist between requests
+    DATABASES['default']['CONN_HEALTH_CHECKS'] = True
+    if os.environ.get('POSTGRES_POOL', '1') == '1':
+        # One psycopg pool per worker process. Django hands the connection
+        # back at the end of each request, so CONN_MAX_AGE must stay 0.
+        DATABASES['default']['OPTIONS'] = {
+            'pool': {
+                'min_size': int(os.environ.get('POSTGRES_POOL_MIN_SIZE', 2)),
+                'max_size': int(os.environ.get('POSTGRES_POOL_MAX_SIZE', 10)),
+                'timeout': 10,
+            }
+        }
+    else:
+        DATABASES['default']['CONN_MAX_AGE'] = int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600))
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / 'db.sqlite3',
+        }
+    }
+    if os.environ.get('SQLITE_PROFILE') == 'tuned':
+        # Single-node production profile: readers never block the writer
+        # (WAL), commits fsync only at checkpoints (synchronous=NORMAL),
+        # and a contended lock is waited for instead of failing at once.
+        # BEGIN IMMEDIATE makes every atomic() block take the write lock
+        # up front, so a transaction cannot fail half-way when it
+        # upgrades from reading to writing.
+        DATABASES['default']['OPTIONS'] = {
+            # Seconds to wait on a lock (SQLite's busy_timeout)
+            'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)),
+            'transaction_mode': 'IMMEDIATE',
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA mmap_size=268435456;'  # 256 MiB
+                'PRAGMA cache_size=-65536;'  # 64 MiB, in KiB when negative
+                'PRAGMA temp_store=MEMORY;'
+            ),
+        }
 
 AUTH_USER_MODEL = 'account.User'
 
@@ -151,6 +213,55 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# 'shared' is seen by every worker: Redis when REDIS_URL is set (needs the
+# redis package), otherwise a database table made by createcachetable
+# (scripts/run.sh runs it). 'default' stays per process
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ['REDIS_URL'],
+    } if os.environ.get('REDIS_URL') else {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'shared_cache',
+    },
+}
+
+# Login and MFA throttling (account/throttling). Token buckets as
+# (capacity, refill rate in attempts per second), kept in the
+# LOGIN_THROTTLE_CACHE alias, which must be shared for the limits and
+# the hashing cap to hold across workers
+LOGIN_THROTTLE_CACHE = 'shared'
+LOGIN_THROTTLE_BUCKETS = {
+    'ip': (20, 20 / 60),
+    'username': (5, 5 / 60),
+}
+# Password checks allowed to run at once; more get 429 with Retry-After
+LOGIN_MAX_CONCURRENT_HASHES = 2
+LOGIN_HASH_SLOT_TIMEOUT = 10  # seconds
+LOGIN_BUSY_RETRY_AFTER = 1  # seconds
+
+# Metrics (project/metrics), summed over every worker that writes to
+# METRICS_DIR; unset, each process reports only its own and writes
+# nothing. /metrics answers loopback clients, or anyone presenting
+# METRICS_TOKEN as a bearer token when it is set
+METRICS_DIR = os.environ.get('METRICS_DIR') or None
+METRICS_FLUSH_INTERVAL = 1.0  # seconds
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN') or None
+# Add a Server-Timing header (total, db and auth time) to every response
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '0') == '1'
+
+# CustomTokenAuthentication: 'database' loads the User row through the user
+# cache, so a deactivated or demoted user is refused within USER_CACHE_TTL.
+# 'claims' builds request.user from the access token alone and trusts its
+# role until the token expires (ACCESS_TOKEN_LIFETIME); opt in only where
+# that window is acceptable
+TOKEN_AUTHENTICATION_MODE = 'database'
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 60  # seconds
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -173,6 +284,62 @@ STATICFILES_DIRS = [Path(BASE_DIR,'static'),]
 MEDIA_URL = "/media/"
 MEDIA_ROOT = Path(BASE_DIR, 'mediafiles')
 
+# Serve uploads, downloads and the file list from the native async views
+# in storage.async_views. project.asgi turns this on; under WSGI the async
+# views would run on a per-request event loop and buffer their bodies.
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', '0') == '1'
+
+# File transfer
+# Size of each block read from storage when streaming a download
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Let the front proxy send download bodies: None streams from Python
+# (development), 'x-accel-redirect' for nginx, 'x-sendfile' for
+# Apache/lighttpd. For nginx, DOWNLOAD_OFFLOAD_PREFIX must be an internal
+# location aliased to MEDIA_ROOT, e.g.
+#     location /protected/ { internal; alias /project/mediafiles/; }
+DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD') or None
+DOWNLOAD_OFFLOAD_PREFIX = '/protected/'
+# Largest number of files in one streamed ZIP download
+DOWNLOAD_BATCH_MAX_FILES = 500
+# Keyset pagination for FileListView (?limit=&cursor=)
+FILE_LIST_PAGE_SIZE = 50
+FILE_LIST_MAX_PAGE_SIZE = 500
+# EncryptedFile.can_access result cache (storage/access_cache). Set
+# ACCESS_CACHE_BACKEND to a CACHES alias to share entries across workers;
+# without one, each worker keeps grants only for ACCESS_CACHE_LOCAL_TTL
+ACCESS_CACHE_SIZE = 10000
+ACCESS_CACHE_TTL = 300  # seconds
+ACCESS_CACHE_LOCAL_TTL = 5  # seconds
+ACCESS_CACHE_BACKEND = None
+# Largest number of file x recipient pairs in one bulk share request
+BULK_SHARE_MAX_PAIRS = 10000
+# Largest number of files in one bulk delete request
+BULK_DELETE_MAX_FILES = 1000
+# Blobs of deleted files are unlinked after commit by a background thread
+# in the deleting process (storage/reclaim); with this off only the
+# reclaim_blobs management command unlinks them
+BLOB_RECLAIM_IN_PROCESS = True
+# Blobs younger than this are never reported as orphans: an upload writes
+# its blob before the EncryptedFile row exists
+ORPHAN_GRACE_PERIOD = timedelta(hours=1)
+# Largest upload accepted per role, in bytes (None means unlimited)
+UPLOAD_MAX_SIZE_BY_ROLE = {
+    'admin': None,
+    'regular': 2 * 1024 * 1024 * 1024,
+    'guest': 0,
+}
+# Total bytes of stored files allowed per role (None means unlimited),
+# checked against the StorageUsage counters (storage/usage)
+STORAGE_QUOTA_BY_ROLE = {
+    'admin': None,
+    'regular': 10 * 1024 * 1024 * 1024,
+    'guest': 0,
+}
+# Chunked upload sessions (storage/uploads)
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = timedelta(hours=24)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -0,0 +1,84 @@
+from unittest import mock
+import asyncio
+import os
+import tempfile
+import threading
+
+from django.test import TestCase, override_settings
+from account.models import User
+from account.serializers import CustomTokenObtainPairSerializer
+from . import metrics
+from .instrumentation import requests_total
+
+class MetricsTests(TestCase):
+    """
+    The middleware counts every request, Server-Timing reports where the
+    time went, and /metrics only answers loopback clients or the token.
+    """
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.metrics_dir = metrics_dir.name
+        self.enterContext(override_settings(METRICS_DIR=self.metrics_dir))
+
+    def requests(self, **labels):
+        labels = tuple((name, str(labels[name])) for name in requests_total.labelnames)
+        return metrics.collect().get('secureshare_requests_total', {}).get(labels, 0)
+
+    def test_requests_are_counted(self):
+        before = self.requests(view='files', method='GET', status=403)
+        for _ in range(3):
+            self.assertEqual(self.client.get('/storage/files', secure=True).status_code, 403)
+        self.assertEqual(self.requests(view='files', method='GET', status=403), before + 3)
+        self.assertTrue(any(name.endswith('.json') for name in os.listdir(self.metrics_dir)))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing(self):
+        user = User.objects.create_user(username='gina', email='gina@example.com')
+        token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        response = self.client.get('/storage/files', secure=True, HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        entries = [entry.split(';')[0] for entry in response['Server-Timing'].split(', ')]
+        self.assertEqual(entries, ['total', 'db', 'auth'])
+        self.assertIn('queries"', response['Server-Timing'])
+
+        with override_settings(SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get('/storage/files', secure=True))
+
+    def test_loopback_only(self):
+        response = self.client.get('/metrics', secure=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE secureshare_requests_total counter', response.content.decode())
+        self.assertEqual(self.client.get('/metrics', secure=True, REMOTE_ADDR='10.0.0.1').status_code, 403)
+        self.assertEqual(self.client.post('/metrics', secure=True).status_code, 405)
+
+    @override_settings(METRICS_TOKEN='metrics-token')
+    def test_token(self):
+        # Once a token is set, loopback clients need it too
+        self.assertEqual(self.client.get('/metrics', secure=True).status_code, 403)
+        for token, expected in (('wrong-token', 403), ('metrics-token-', 403), ('metrics-token', 200)):
+            response = self.client.get('/metrics', secure=True, REMOTE_ADDR='10.0.0.1',
+                                       HTTP_AUTHORIZATION=f'Bearer {token}')
+            self.assertEqual(response.status_code, expected, token)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0)
+    def test_async_flush_leaves_the_event_loop(self):
+        flushed_on = []
+        with mock.patch.object(metrics, 'flush', lambda: flushed_on.append(threading.current_thread())):
+            async def count():
+                requests_total.inc(view='test', method='GET', status=200)
+
+            asyncio.run(count())
+            # Wait for the flush thread to go idle
+            metrics._flusher.submit(lambda: None).result()
+        self.assertEqual(len(flushed_on), 1)
+        self.assertIsNot(flushed_on[0], threading.current_thread())
+
+    @override_settings(METRICS_DIR=None)
+    def test_without_metrics_dir(self):
+        before = self.requests(view='test', method='GET', status=200)
+        with mock.patch.object(metrics.tempfile, 'mkstemp') as mkstemp:
+            requests_total.inc(view='test', method='GET', status=200)
+            metrics.flush()
+            self.assertEqual(self.requests(view='test', method='GET', status=200), before + 1)
+        mkstemp.assert_not_called()
@@ -18,9 +18,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from .views import metrics
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('user/', include('account.urls')),
     path('storage/', include('storage.urls')),
+    path('metrics', metrics, name='metrics'),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT) + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
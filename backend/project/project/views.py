@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_GET
+from .metrics import render
+import hmac
+
+LOOPBACK = ('127.0.0.1', '::1')
+
+@require_GET
+def metrics(request):
+    token = settings.METRICS_TOKEN
+    if token:
+        presented = request.headers.get('Authorization', '').removeprefix('Bearer ')
+        if not hmac.compare_digest(presented.encode(), token.encode()):
+            return HttpResponseForbidden()
+    elif request.META.get('REMOTE_ADDR') not in LOOPBACK:
+        return HttpResponseForbidden()
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
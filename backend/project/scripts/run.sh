@@ -13,11 +13,33 @@ python manage.py makemigrations
 echo "Applying migrations..."
 python manage.py migrate
 
-# Run Gunicorn with SSL
-echo "Starting Gunicorn..."
-gunicorn project.wsgi:application \
-    --bind 0.0.0.0:8000 \
-    --certfile=/project/scripts/localhost.crt \
-    --keyfile=/project/scripts/localhost.key \
-    --workers 3 \
-    --timeout 120
\ No newline at end of file
+# Table behind the shared cache when REDIS_URL is not set
+python manage.py createcachetable
+
+# Workers' metrics are summed from METRICS_DIR; start each run from zero
+export METRICS_DIR="${METRICS_DIR:-/tmp/secureshare-metrics}"
+rm -rf "$METRICS_DIR"
+
+# Run Gunicorn with SSL. SERVER_MODE=asgi serves project.asgi through
+# uvicorn workers, where a slow upload or download no longer holds a
+# whole worker; the default stays on sync WSGI workers. Under ASGI an
+# upload body is spooled to disk before the size and quota checks run
+# (see storage/async_views.py), so cap body sizes at the proxy.
+if [ "$SERVER_MODE" = "asgi" ]; then
+    echo "Starting Gunicorn (ASGI)..."
+    gunicorn project.asgi:application \
+        --worker-class uvicorn_worker.UvicornWorker \
+        --bind 0.0.0.0:8000 \
+        --certfile=/project/scripts/localhost.crt \
+        --keyfile=/project/scripts/localhost.key \
+        --workers 3 \
+        --timeout 120
+else
+    echo "Starting Gunicorn..."
+    gunicorn project.wsgi:application \
+        --bind 0.0.0.0:8000 \
+        --certfile=/project/scripts/localhost.crt \
+        --keyfile=/project/scripts/localhost.key \
+        --workers 3 \
+        --timeout 120
+fi
\ No newline at end of file
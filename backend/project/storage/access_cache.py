@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from project.metrics import Counter
+import threading
+import time
+
+# Stored for "no access" so a cached denial is distinguishable from a miss
+NO_ACCESS = ''
+
+lookups = Counter(
+    'secureshare_access_cache_lookups_total',
+    'File permission lookups by cache backend (local or shared) and result (hit or miss)',
+    ['backend', 'result']
+)
+
+class AccessCache:
+    """
+    Bounded per-process LRU/TTL cache of EncryptedFile.can_access results
+    keyed on (file_id, user_id). When ACCESS_CACHE_BACKEND names one of
+    CACHES, that shared backend is used instead so all workers see the
+    same entries and invalidations.
+
+    Entries are invalidated by the FileShare and EncryptedFile signals in
+    storage.signals; the TTL bounds anything those cannot see. Those
+    invalidations only reach the process that made the change, so the
+    per-process cache keeps grants for ACCESS_CACHE_LOCAL_TTL at most and
+    never keeps denials: a new share is visible on every worker at once,
+    and a revoked one within seconds.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+    @property
+    def maxsize(self):
+        return getattr(settings, 'ACCESS_CACHE_SIZE', 10000)
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'ACCESS_CACHE_TTL', 300)
+
+    @property
+    def local_ttl(self):
+        return min(self.ttl, getattr(settings, 'ACCESS_CACHE_LOCAL_TTL', 5))
+
+    @property
+    def backend(self):
+        alias = getattr(settings, 'ACCESS_CACHE_BACKEND', None)
+        return caches[alias] if alias else None
+
+    def _key(self, file_id, user_id):
+        # The per-file version lets invalidate_file() drop every user's
+        # entry in a shared backend with a single write
+        version = self.backend.get(f'storage:access-version:{file_id}', 0)
+        return f'storage:access:{file_id}:{version}:{user_id}'
+
+    def get(self, file_id, user_id, resolve):
+        """
+        Return the cached permission for (file_id, user_id), calling
+        `resolve()` and caching its result on a miss.
+        """
+        backend = self.backend
+        if backend is not None:
+            key = self._key(file_id, user_id)
+            cached = backend.get(key)
+            if cached is not None:
+                lookups.inc(backend='shared', result='hit')
+                return cached or None
+            lookups.inc(backend='shared', result='miss')
+            permission = resolve()
+            backend.set(key, permission or NO_ACCESS, self.ttl)
+            return permission
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get((file_id, user_id))
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end((file_id, user_id))
+            else:
+                entry = None
+                generation = self._generation
+        # Counted outside the lock; the counters have their own
+        if entry is not None:
+            lookups.inc(backend='local', result='hit')
+            return entry[1]
+        lookups.inc(backend='local', result='miss')
+
+        permission = resolve()
+
+        if self.maxsize > 0 and permission:
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[(file_id, user_id)] = (now + self.local_ttl, permission)
+                    self._entries.move_to_end((file_id, user_id))
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        return permission
+
+    def invalidate(self, file_id, user_id):
+        backend = self.backend
+        if backend is not None:
+            backend.delete(self._key(file_id, user_id))
+        with self._lock:
+            self._generation += 1
+            self._entries.pop((file_id, user_id), None)
+
+    def invalidate_many(self, pairs):
+        pairs = list(pairs)
+        backend = self.backend
+        if backend is not None:
+            file_ids = {file_id for file_id, _ in pairs}
+            versions = backend.get_many([f'storage:access-version:{file_id}' for file_id in file_ids])
+            backend.delete_many([
+                f'storage:access:{file_id}:{versions.get(f"storage:access-version:{file_id}", 0)}:{user_id}'
+                for file_id, user_id in pairs
+            ])
+        with self._lock:
+            self._generation += 1
+            for pair in pairs:
+                self._entries.pop(pair, None)
+
+    def invalidate_file(self, file_id):
+        backend = self.backend
+        if backend is not None:
+            version_key = f'storage:access-version:{file_id}'
+            if not backend.add(version_key, 1, None):
+                try:
+                    backend.incr(version_key)
+                except ValueError:
+                    # Evicted between add() and incr()
+                    backend.set(version_key, 1, None)
+        with self._lock:
+            self._generation += 1
+            for key in [key for key in self._entries if key[0] == file_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        # Hits and misses are counted in secureshare_access_cache_lookups_total
+        return {
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+access_cache = AccessCache()
@@ -0,0 +1,110 @@
+from django.http import StreamingHttpResponse
+from .downloads import chunk_size, encode_key
+from .models import EncryptedFile, wrapped_keys
+from zipfile import ZIP_STORED, ZipFile, ZipInfo
+import asyncio
+import json
+import os
+
+MANIFEST_NAME = 'manifest.json'
+
+class _ArchiveSink:
+    # Write-only, unseekable target for ZipFile; bytes are handed to the
+    # response as soon as they are written
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def archive_name(file):
+    # Prefix with the id so equal file names cannot collide, and drop any
+    # directory components a client may have put in the name
+    name = os.path.basename(file.file_name.replace('\\', '/')) or 'file'
+    return f'{file.pk}-{name}'
+
+def build_manifest(files, keys):
+    return [
+        {
+            'id': file.pk,
+            'name': archive_name(file),
+            'file_name': file.file_name,
+            'file_type': file.file_type,
+            'file_size': file.file_size,
+            'sha256': file.sha256,
+            'encrypted_key': encode_key(keys[file.pk]),
+        }
+        for file in files
+    ]
+
+def batch_files(user, file_ids):
+    """
+    Resolve an archive request: returns the files in request order, their
+    wrapped keys, and the ids that are missing, not accessible to `user`
+    or without a blob on disk.
+    """
+    # One query resolves the files and the caller's access to all of them
+    files = EncryptedFile.objects.filter(id__in=file_ids)
+    if user.role != 'admin':
+        files = files.filter(visible_to__user=user)
+    files = {file.pk: file for file in files}
+    keys = wrapped_keys(list(files), user)
+
+    unavailable = [
+        file_id for file_id in file_ids
+        if file_id not in files or file_id not in keys or not files[file_id].encrypted_file
+        or not files[file_id].encrypted_file.storage.exists(files[file_id].encrypted_file.name)
+    ]
+    return [files[file_id] for file_id in file_ids if file_id in files], keys, unavailable
+
+def zip_response(body):
+    response = StreamingHttpResponse(body, content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="files.zip"'
+    response['Access-Control-Expose-Headers'] = 'Content-Disposition'
+    return response
+
+def stream_zip(files, keys):
+    """
+    Yield a ZIP archive (stored, no compression) holding manifest.json and
+    every file's encrypted blob. Blobs are copied in DOWNLOAD_CHUNK_SIZE
+    blocks, so memory use does not depend on the archive size. `keys` maps
+    file id to its wrapped key.
+    """
+    return (data for data in _zip_chunks(files, keys) if data)
+
+async def astream_zip(files, keys):
+    # Async twin of stream_zip for ASGI: the archive is built by the same
+    # generator, advanced in the default thread pool one chunk at a time,
+    # so memory stays flat instead of the body being collected into a list
+    chunks = _zip_chunks(files, keys)
+    try:
+        while (data := await asyncio.to_thread(next, chunks, None)) is not None:
+            if data:
+                yield data
+    finally:
+        await asyncio.to_thread(chunks.close)
+
+def _zip_chunks(files, keys):
+    sink = _ArchiveSink()
+    with ZipFile(sink, 'w', compression=ZIP_STORED, allowZip64=True) as archive:
+        archive.writestr(MANIFEST_NAME, json.dumps(build_manifest(files, keys), indent=2))
+        yield sink.drain()
+
+        for file in files:
+            info = ZipInfo(archive_name(file), date_time=file.uploaded_at.timetuple()[:6])
+            info.compress_type = ZIP_STORED
+            with file.encrypted_file.open('rb') as blob, archive.open(info, 'w', force_zip64=True) as entry:
+                for data in iter(lambda: blob.read(chunk_size()), b''):
+                    entry.write(data)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
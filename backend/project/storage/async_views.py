@@ -0,0 +1,263 @@
+"""
+Native async versions of the transfer and listing endpoints, routed in
+place of the DRF views when ASYNC_VIEWS is set (project.asgi sets it).
+
+Under ASGI the request body is received by the event loop before the view
+runs and download and archive bodies are async iterators, so a slow
+client costs a coroutine instead of a worker. Disk I/O runs in the
+default thread pool and the ORM is used through its async API; code that
+needs a transaction or the synchronous caches runs through sync_to_async.
+
+Because Django's ASGI handler spools the whole body before any view
+code runs, uploads here are bounded differently from the WSGI views: the
+Content-Length, role limit and quota checks reject an oversized upload
+before it is parsed and stored, but not before it has been received into
+a temporary file, and the blob is written twice (spool, then
+encrypted_files/) rather than once. Cap request sizes at the proxy when
+that matters.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.exceptions import AuthenticationFailed
+from account.authentication import CustomTokenAuthentication
+from .archives import astream_zip, batch_files, zip_response
+from .downloads import astream_encrypted_file
+from .listing import (
+    InvalidListParameter,
+    apaginate_rows,
+    conditional_list,
+    list_etag,
+    order_rows,
+    page_size,
+    set_list_validators,
+    visible_rows,
+)
+from .models import EncryptedFile, UploadSession
+from .serializers import BatchDownloadSerializer, EncryptedFileSerializer
+from .usage import QuotaExceeded
+from .visibility import aversion
+from .uploads import (
+    FORM_OVERHEAD,
+    ChunkSizeMismatch,
+    EncryptedBlobUploadHandler,
+    UploadTooLarge,
+    matches_declared_size,
+    max_upload_size,
+    quota_upload_size,
+    record_upload,
+    session_status,
+    write_chunk,
+)
+import asyncio
+import json
+
+class AsyncAPIView(View):
+    """
+    Minimal async counterpart of the DRF APIView setup used in views.py:
+    token authentication, IsAuthenticated, and JSON error bodies in the
+    same shape DRF produces.
+    """
+    authentication_classes = [CustomTokenAuthentication]
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Token-authenticated like the DRF views, so no CSRF
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    async def authenticate(self, request):
+        for authentication_class in self.authentication_classes:
+            # Falls back to the user cache, and so the database, for tokens
+            # without principal claims
+            result = await sync_to_async(authentication_class().authenticate)(request)
+            if result is not None:
+                return result[0]
+        return None
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            user = await self.authenticate(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({'detail': str(e.detail)}, status=403)
+        if user is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=403)
+        request.user = user
+        return await super().dispatch(request, *args, **kwargs)
+
+def _record_and_serialize(user, data, file_size, file, wrapped_key):
+    # One trip to the sync thread: the transaction and the owner lookup
+    # made by the serializer both need it
+    return EncryptedFileSerializer(record_upload(user, data, file_size, file, wrapped_key)).data
+
+class AsyncFileUploadView(AsyncAPIView):
+    async def post(self, request):
+        # Check if user has permission to upload
+        if request.user.role == 'guest':
+            return JsonResponse({'error': 'Guest users cannot upload files'}, status=403)
+
+        max_size = max_upload_size(request.user)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if max_size is not None and content_length > max_size + FORM_OVERHEAD:
+            return JsonResponse({'error': f'Upload exceeds the {max_size} byte limit'}, status=413)
+
+        quota_size = await sync_to_async(quota_upload_size)(request.user)
+        if quota_size is not None:
+            if content_length > quota_size + FORM_OVERHEAD:
+                return JsonResponse({'error': 'Upload exceeds the remaining storage quota'}, status=413)
+            max_size = quota_size if max_size is None else min(max_size, quota_size)
+
+        handler = EncryptedBlobUploadHandler(request, max_size)
+        request.upload_handlers.insert(0, handler)
+
+        try:
+            # The body is already spooled by the ASGI handler; parsing it
+            # copies the blob to encrypted_files/ on a pool thread
+            await asyncio.to_thread(getattr, request, 'FILES')
+
+            for field in ['file', 'encrypted_key']:
+                if field not in request.FILES:
+                    handler.discard()
+                    return JsonResponse({'error': f'Missing required field: {field}'}, status=400)
+            for field in ['file_name', 'file_type', 'file_size']:
+                if field not in request.POST:
+                    handler.discard()
+                    return JsonResponse({'error': f'Missing required field: {field}'}, status=400)
+
+            try:
+                file_size = int(request.POST['file_size'])
+            except ValueError:
+                handler.discard()
+                return JsonResponse({'error': 'file_size must be an integer'}, status=400)
+
+            file = request.FILES['file']
+            if not matches_declared_size(file.size, file_size):
+                handler.discard()
+                return JsonResponse({'error': 'file_size does not match the uploaded file'}, status=400)
+
+            wrapped_key = await asyncio.to_thread(request.FILES['encrypted_key'].read)
+            data = await sync_to_async(_record_and_serialize)(
+                request.user, request.POST, file_size, file, wrapped_key
+            )
+            return JsonResponse(data, status=201)
+
+        except UploadTooLarge as e:
+            return JsonResponse({'error': str(e)}, status=413)
+        except QuotaExceeded as e:
+            handler.discard()
+            return JsonResponse({'error': str(e)}, status=413)
+        except Exception as e:
+            handler.discard()
+            return JsonResponse({'error': str(e)}, status=400)
+
+class AsyncFileDownloadView(AsyncAPIView):
+    async def get(self, request, file_id):
+        try:
+            file = await EncryptedFile.objects.aget(id=file_id)
+        except EncryptedFile.DoesNotExist:
+            return JsonResponse({'error': 'File not found'}, status=404)
+        except Exception as e:
+            return JsonResponse({'error': str(e)}, status=500)
+
+        # Check if user has access to the file
+        if not await file.acan_access(request.user):
+            return JsonResponse({'error': 'You do not have permission to access this file'}, status=403)
+
+        if not file.encrypted_file:
+            return JsonResponse({'error': 'File not found on server'}, status=404)
+
+        try:
+            # Stream the stored blob (IV followed by ciphertext) as-is
+            return await astream_encrypted_file(file, request)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'File not found on server'}, status=404)
+        except Exception as e:
+            return JsonResponse({'error': f'Error reading file: {str(e)}'}, status=500)
+
+class AsyncBatchDownloadView(AsyncAPIView):
+    async def post(self, request):
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError as e:
+            return JsonResponse({'detail': f'JSON parse error - {e}'}, status=400)
+        serializer = BatchDownloadSerializer(data=data)
+        if not serializer.is_valid():
+            return JsonResponse(serializer.errors, status=400)
+
+        files, keys, unavailable = await sync_to_async(batch_files)(
+            request.user, serializer.validated_data['file_ids']
+        )
+        if unavailable:
+            return JsonResponse(
+                {'error': 'Some files were not found or are not accessible', 'file_ids': unavailable},
+                status=404
+            )
+
+        return zip_response(astream_zip(files, keys))
+
+class AsyncFileListView(AsyncAPIView):
+    async def get(self, request):
+        # Pagination is opt-in so existing clients keep getting a plain list
+        paginated = 'cursor' in request.GET or 'limit' in request.GET
+        try:
+            # Admins list every file, which no single version covers
+            etag = changed_at = None
+            if getattr(request.user, 'role', None) != 'admin':
+                version, changed_at = await aversion(request.user.pk)
+                etag = list_etag('files', f"{request.user.pk}-{getattr(request.user, 'role', '')}", version)
+                not_modified = conditional_list(request, etag, changed_at)
+                if not_modified:
+                    return not_modified
+
+            rows, id_field = visible_rows(request.user, request.GET)
+
+            if paginated:
+                page, next_cursor = await apaginate_rows(
+                    rows,
+                    request.GET.get('cursor'),
+                    page_size(request.GET.get('limit')),
+                    id_field
+                )
+            else:
+                page = [row async for row in order_rows(rows, id_field)]
+
+            files = page if id_field == 'id' else [row.file for row in page]
+            data = EncryptedFileSerializer(files, many=True).data
+
+            if paginated:
+                response = JsonResponse({'results': data, 'next_cursor': next_cursor})
+            else:
+                response = JsonResponse(data, safe=False)
+            return set_list_validators(response, etag, changed_at) if etag else response
+
+        except InvalidListParameter as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception:
+            return JsonResponse({'error': 'An error occurred while fetching files'}, status=500)
+
+class AsyncUploadChunkView(AsyncAPIView):
+    async def put(self, request, session_id, index):
+        try:
+            session = await UploadSession.objects.aget(pk=session_id, user_id=request.user.pk)
+        except UploadSession.DoesNotExist:
+            return JsonResponse({'detail': 'No UploadSession matches the given query.'}, status=404)
+
+        if index >= session.total_chunks:
+            return JsonResponse({'error': f'Chunk index must be below {session.total_chunks}'}, status=400)
+
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            await asyncio.to_thread(write_chunk, session, index, request, length)
+        except (ChunkSizeMismatch, ValueError) as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except FileNotFoundError:
+            return JsonResponse({'error': 'Upload session data not found'}, status=404)
+
+        # Keep active sessions away from the sweeper
+        await UploadSession.objects.filter(pk=session.pk).aupdate(updated_at=timezone.now())
+
+        return JsonResponse(await asyncio.to_thread(session_status, session))
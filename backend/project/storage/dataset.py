@@ -0,0 +1,292 @@
+"""
+Synthetic datasets for benchmarks and capacity planning.
+
+generate() writes users, files, shares and share links straight to the
+database with batched bulk_create, and writes the files' blobs from a
+thread pool while the next batch of rows is built. bulk_create sends no
+signals, so the rows the signals would have written are written here as
+well: owner and share FileVisibility rows, each file's default
+KeyEnvelope, the owners' StorageUsage counters and every user's
+VisibilityVersion. The result passes `visibility_index --verify` and
+`reconcile_usage --dry-run` unchanged.
+
+Shares and links follow a Zipf distribution over files: with skew s the
+k-th most popular file gets a share of the total proportional to
+1 / k**s, so 0 is uniform and larger values concentrate the fan-out on
+fewer files.
+"""
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from itertools import accumulate
+from account.models import User
+from .models import EncryptedFile, FileShare, FileVisibility, KeyEnvelope, ShareableLink, StorageUsage, VisibilityVersion
+from .reclaim import BLOB_DIR
+from .uploads import ENCRYPTION_OVERHEAD
+import math
+import os
+import random
+import time
+import uuid
+
+DEFAULT_ROLES = {'regular': 90, 'guest': 8, 'admin': 2}
+DEFAULT_BATCH_SIZE = 5000
+BLOB_MODES = ('sparse', 'random', 'none')
+# Every generated user signs in with this password
+PASSWORD = 'dataset-password'
+WRITE_BLOCK = 1024 * 1024
+# Share links expire between a day ago and a week from now
+LINK_EXPIRY_RANGE = (-1, 7)  # days
+LINK_USED_FRACTION = 0.1
+
+def _batches(count, batch_size):
+    for start in range(0, count, batch_size):
+        yield start, min(batch_size, count - start)
+
+def db_value(model, field_name, value):
+    return model._meta.get_field(field_name).get_db_prep_save(value, connection)
+
+def insert_rows(model, field_names, rows):
+    """
+    bulk_create for tuples of values already prepared with db_value(),
+    skipping the per-row model instance and SQL compilation that dominate
+    bulk_create at tens of millions of rows. Returns the number of rows.
+    """
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in field_names)
+    sql = f"INSERT INTO {quote(model._meta.db_table)} ({columns}) VALUES ({', '.join(['%s'] * len(field_names))})"
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+    return len(rows)
+
+def create_users(count, roles, prefix, batch_size, rng):
+    """
+    Create `count` users named <prefix><n>, with roles drawn by weight from
+    `roles`. Returns (ids, roles) in creation order.
+    """
+    # Hashing is the slow part of creating a user, so all share one hash
+    password = make_password(PASSWORD)
+    names, weights = zip(*roles.items())
+    ids = array('q')
+    user_roles = []
+    for start, size in _batches(count, batch_size):
+        batch_roles = rng.choices(names, weights, k=size)
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}{start + i}', email=f'{prefix}{start + i}@example.com',
+                 password=password, role=role)
+            for i, role in enumerate(batch_roles)
+        ])
+        VisibilityVersion.objects.bulk_create([VisibilityVersion(user_id=user.pk) for user in users])
+        ids.extend(user.pk for user in users)
+        user_roles.extend(batch_roles)
+    return ids, user_roles
+
+def write_blob(path, size, mode):
+    with open(path, 'wb') as blob:
+        if mode == 'sparse':
+            blob.truncate(size)
+            return
+        written = 0
+        while written < size:
+            written += blob.write(os.urandom(min(WRITE_BLOCK, size - written)))
+
+def create_files(owner_ids, count, min_size, max_size, blobs, batch_size, workers, rng):
+    """
+    Create `count` files spread uniformly over `owner_ids`. Blob sizes are
+    log-uniform between min_size and max_size. Returns (file ids, owner
+    ids, upload timestamps, {owner id: [bytes, files]}) in creation order.
+    """
+    if blobs != 'none':
+        os.makedirs(default_storage.path(BLOB_DIR), exist_ok=True)
+    low, high = math.log(max(min_size, 1)), math.log(max(max_size, min_size, 1))
+    ids, owners, uploaded = array('q'), array('q'), array('d')
+    usage = {}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dataset-blobs') as executor:
+        pending = []
+        for start, size in _batches(count, batch_size):
+            files = []
+            for i in range(size):
+                stored = max(int(math.exp(rng.uniform(low, high))), ENCRYPTION_OVERHEAD)
+                files.append(EncryptedFile(
+                    user_id=rng.choice(owner_ids),
+                    file_name=f'file-{start + i}.bin',
+                    file_type='application/octet-stream',
+                    file_size=stored - ENCRYPTION_OVERHEAD,
+                    encrypted_file=f'{BLOB_DIR}/{uuid.uuid4().hex}.bin',
+                ))
+            with transaction.atomic():
+                EncryptedFile.objects.bulk_create(files)
+                created_at = db_value(KeyEnvelope, 'created_at', datetime.now(timezone.utc))
+                insert_rows(KeyEnvelope, ('file', 'wrapped_key', 'created_at'), [
+                    (file.pk, db_value(KeyEnvelope, 'wrapped_key', rng.randbytes(32)), created_at)
+                    for file in files
+                ])
+                insert_rows(FileVisibility, ('user', 'file', 'permission', 'uploaded_at'), [
+                    (file.user_id, file.pk, 'owner', db_value(FileVisibility, 'uploaded_at', file.uploaded_at))
+                    for file in files
+                ])
+
+            for file in files:
+                ids.append(file.pk)
+                owners.append(file.user_id)
+                uploaded.append(file.uploaded_at.timestamp())
+                counter = usage.setdefault(file.user_id, [0, 0])
+                counter[0] += file.file_size
+                counter[1] += 1
+
+            # Keep at most one batch of blobs in flight behind the rows
+            for future in pending:
+                future.result()
+            pending = [] if blobs == 'none' else [
+                executor.submit(write_blob, default_storage.path(file.encrypted_file.name),
+                                file.file_size + ENCRYPTION_OVERHEAD, blobs)
+                for file in files
+            ]
+        for future in pending:
+            future.result()
+    return ids, owners, uploaded, usage
+
+def zipf_cumulative_weights(count, skew):
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+
+def fan_out(total, count, skew, cap, rng):
+    """
+    Split `total` draws over `count` items by Zipf popularity, in random
+    item order, with no item above `cap`. Draws over an item's cap go to
+    the next most popular items with room, and are dropped only once every
+    item is full. Returns the per-item counts.
+    """
+    counts = array('q', bytes(8 * count))
+    weights = zipf_cumulative_weights(count, skew)
+    ranks = range(count)
+    for _, size in _batches(total, 1_000_000):
+        for rank in rng.choices(ranks, cum_weights=weights, k=size):
+            counts[rank] += 1
+
+    overflow = 0
+    for rank in ranks:
+        if counts[rank] > cap:
+            overflow += counts[rank] - cap
+            counts[rank] = cap
+    for rank in ranks:
+        if not overflow:
+            break
+        moved = min(cap - counts[rank], overflow)
+        counts[rank] += moved
+        overflow -= moved
+
+    order = list(ranks)
+    rng.shuffle(order)
+    return array('q', (counts[rank] for rank in order))
+
+def create_shares(file_ids, owners, uploaded, user_ids, total, skew, batch_size, rng):
+    """
+    Share files with `total` recipients overall. A file shared d times goes
+    to d distinct users other than its owner, taken consecutively from a
+    random point in `user_ids`. Returns the number of shares created.
+    """
+    if not file_ids or len(user_ids) < 2:
+        return 0
+    counts = fan_out(total, len(file_ids), skew, len(user_ids) - 1, rng)
+    created_at = db_value(FileShare, 'created_at', datetime.now(timezone.utc))
+    created = 0
+    shares, rows, shared_files = [], [], []
+
+    def flush():
+        with transaction.atomic():
+            insert_rows(FileShare, ('file', 'shared_with', 'permission', 'created_at'), shares)
+            insert_rows(FileVisibility, ('user', 'file', 'permission', 'uploaded_at'), rows)
+            EncryptedFile.objects.filter(pk__in=shared_files).update(is_shared=True)
+        return len(shares)
+
+    for index, fan in enumerate(counts):
+        if not fan:
+            continue
+        file_id, owner_id = file_ids[index], owners[index]
+        uploaded_at = db_value(FileVisibility, 'uploaded_at', datetime.fromtimestamp(uploaded[index], tz=timezone.utc))
+        offset = rng.randrange(len(user_ids))
+        shared_files.append(file_id)
+        added = 0
+        step = 0
+        while added < fan:
+            user_id = user_ids[(offset + step) % len(user_ids)]
+            step += 1
+            if user_id == owner_id:
+                continue
+            permission = rng.choice(('view', 'download'))
+            shares.append((file_id, user_id, permission, created_at))
+            rows.append((user_id, file_id, permission, uploaded_at))
+            added += 1
+            if len(shares) >= batch_size:
+                created += flush()
+                shares, rows, shared_files = [], [], [file_id]
+    if shares:
+        created += flush()
+    return created
+
+def create_links(file_ids, owners, total, skew, batch_size, rng):
+    if not file_ids:
+        return 0
+    weights = zipf_cumulative_weights(len(file_ids), skew)
+    order = list(range(len(file_ids)))
+    rng.shuffle(order)
+    now = datetime.now(timezone.utc)
+    for _, size in _batches(total, batch_size):
+        links = []
+        for rank in rng.choices(range(len(file_ids)), cum_weights=weights, k=size):
+            index = order[rank]
+            links.append(ShareableLink(
+                file_id=file_ids[index],
+                created_by_id=owners[index],
+                permission=rng.choice(('view', 'download')),
+                expires_at=now + timedelta(days=rng.uniform(*LINK_EXPIRY_RANGE)),
+                is_used=rng.random() < LINK_USED_FRACTION,
+            ))
+        ShareableLink.objects.bulk_create(links)
+    return total
+
+def create_usage(user_ids, usage, batch_size):
+    for start, size in _batches(len(user_ids), batch_size):
+        StorageUsage.objects.bulk_create([
+            StorageUsage(user_id=user_id, used_bytes=usage.get(user_id, (0, 0))[0],
+                         file_count=usage.get(user_id, (0, 0))[1])
+            for user_id in user_ids[start:start + size]
+        ])
+    return len(user_ids)
+
+def generate(users, files, shares=0, links=0, roles=None, prefix='user', min_size=1024,
+             max_size=1024 * 1024, blobs='sparse', skew=1.0, batch_size=DEFAULT_BATCH_SIZE,
+             workers=None, seed=None, progress=None):
+    """
+    Build a dataset and return {phase: (rows, seconds)}. `progress`, if
+    given, is called with each phase's name, rows and seconds as it ends.
+    """
+    rng = random.Random(seed)
+    workers = workers or min(32, (os.cpu_count() or 1) + 4)
+    results = {}
+    started = time.perf_counter()
+
+    def done(name, rows):
+        nonlocal started
+        results[name] = (rows, time.perf_counter() - started)
+        if progress:
+            progress(name, *results[name])
+        started = time.perf_counter()
+
+    user_ids, user_roles = create_users(users, roles or DEFAULT_ROLES, prefix, batch_size, rng)
+    done('users', len(user_ids))
+
+    # Guests cannot store anything
+    owner_ids = [user_id for user_id, role in zip(user_ids, user_roles) if role != 'guest']
+    file_ids, owners, uploaded, usage = create_files(
+        owner_ids, files if owner_ids else 0, min_size, max_size, blobs, batch_size, workers, rng
+    )
+    done('files', len(file_ids))
+
+    done('usage', create_usage(user_ids, usage, batch_size))
+    done('shares', create_shares(file_ids, owners, uploaded, user_ids, shares, skew, batch_size, rng))
+    done('links', create_links(file_ids, owners, links, skew, batch_size, rng))
+    return results
@@ -0,0 +1,264 @@
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+from urllib.parse import quote
+import asyncio
+import base64
+import hashlib
+import secrets
+
+EXPOSED_HEADERS = [
+    'Accept-Ranges',
+    'Content-Disposition',
+    'Content-Length',
+    'Content-Range',
+    'Content-Type',
+    'ETag',
+    'Encrypted-Key',
+    'Last-Modified',
+    'Original-Type'
+]
+
+# Range headers with more parts than this are ignored and the full body is sent
+MAX_RANGES = 16
+
+def chunk_size():
+    return getattr(settings, 'DOWNLOAD_CHUNK_SIZE', 64 * 1024)
+
+class EncryptedBlobResponse(FileResponse):
+    # Stream the stored ciphertext in fixed-size blocks so worker memory
+    # does not grow with the file size.
+    @property
+    def block_size(self):
+        return chunk_size()
+
+def encode_key(encryption_key):
+    # BinaryField values come back as memoryview on some backends
+    if not isinstance(encryption_key, bytes):
+        encryption_key = bytes(encryption_key)
+    return base64.b64encode(encryption_key).decode('utf-8')
+
+def blob_etag(file, size):
+    # Stored blobs are never rewritten in place, so the row identity, the
+    # storage name and the stored size are enough for a strong validator.
+    source = f'{file.pk}:{file.encrypted_file.name}:{size}:{file.uploaded_at.isoformat()}'
+    return '"%s"' % hashlib.sha256(source.encode()).hexdigest()[:32]
+
+def set_download_headers(response, file, wrapped_key):
+    response['Content-Disposition'] = f'attachment; filename="{file.file_name}"'
+    response['Encrypted-Key'] = encode_key(wrapped_key)
+
+    # CORS headers
+    response['Access-Control-Expose-Headers'] = ', '.join(EXPOSED_HEADERS)
+    return response
+
+def parse_range_header(header, size):
+    """
+    Parse a bytes Range header into sorted, coalesced (start, end) pairs
+    with inclusive ends. Returns None when the header should be ignored and
+    an empty list when no range is satisfiable.
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges = []
+    parts = [part.strip() for part in spec.split(',') if part.strip()]
+    if len(parts) > MAX_RANGES:
+        return None
+    for part in parts:
+        first, sep, last = part.partition('-')
+        if not sep:
+            return None
+        first, last = first.strip(), last.strip()
+        if not (first.isdigit() or first == '') or not (last.isdigit() or last == ''):
+            return None
+
+        if first == '':
+            # Suffix range: the final N bytes
+            if last == '':
+                return None
+            suffix = int(last)
+            if suffix == 0 or size == 0:
+                continue
+            ranges.append((max(size - suffix, 0), size - 1))
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            if start >= size:
+                continue
+            end = int(last) if last else size - 1
+            ranges.append((start, min(end, size - 1)))
+
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+def if_range_matches(if_range, etag, last_modified):
+    if if_range.startswith('W/'):
+        return False
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
+
+def read_range(blob, start, end):
+    blob.seek(start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = blob.read(min(chunk_size(), remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+def stream_multipart(blob, ranges, parts, trailer):
+    for (start, end), head in zip(ranges, parts):
+        yield head
+        yield from read_range(blob, start, end)
+        yield b'\r\n'
+    yield trailer
+
+async def aread_range(blob, start, end):
+    # Async twin of read_range for ASGI: every seek/read runs in the
+    # default thread pool so the event loop never blocks on disk
+    await asyncio.to_thread(blob.seek, start)
+    remaining = end - start + 1
+    while remaining > 0:
+        data = await asyncio.to_thread(blob.read, min(chunk_size(), remaining))
+        if not data:
+            break
+        remaining -= len(data)
+        yield data
+
+async def astream_multipart(blob, ranges, parts, trailer):
+    for (start, end), head in zip(ranges, parts):
+        yield head
+        async for data in aread_range(blob, start, end):
+            yield data
+        yield b'\r\n'
+    yield trailer
+
+def partial_response(blob, file, ranges, size, asynchronous=False):
+    content_type = str(file.file_type)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        reader = aread_range if asynchronous else read_range
+        response = StreamingHttpResponse(
+            reader(blob, start, end),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    else:
+        boundary = secrets.token_hex(16)
+        parts = [
+            (
+                f'--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+            for start, end in ranges
+        ]
+        trailer = f'--{boundary}--\r\n'.encode()
+        length = len(trailer) + sum(
+            len(head) + end - start + 1 + 2
+            for head, (start, end) in zip(parts, ranges)
+        )
+        multipart = astream_multipart if asynchronous else stream_multipart
+        response = StreamingHttpResponse(
+            multipart(blob, ranges, parts, trailer),
+            status=206,
+            content_type=f'multipart/byteranges; boundary={boundary}'
+        )
+        response['Content-Length'] = str(length)
+
+    response._resource_closers.append(blob.close)
+    return response
+
+def offload_response(file, wrapped_key, mode):
+    """
+    Hand the body to the front proxy: nginx serves X-Accel-Redirect from an
+    internal location mapped onto MEDIA_ROOT, Apache/lighttpd serve the
+    absolute path in X-Sendfile. The proxy then handles Range, validators
+    and Content-Length itself.
+    """
+    response = HttpResponse(content_type=str(file.file_type))
+    if mode == 'x-accel-redirect':
+        prefix = getattr(settings, 'DOWNLOAD_OFFLOAD_PREFIX', '/protected/')
+        response['X-Accel-Redirect'] = prefix + quote(file.encrypted_file.name)
+    elif mode == 'x-sendfile':
+        response['X-Sendfile'] = file.encrypted_file.path
+    else:
+        raise ValueError(f'Unknown DOWNLOAD_OFFLOAD mode: {mode}')
+    return set_download_headers(response, file, wrapped_key)
+
+def open_blob(file):
+    blob = file.encrypted_file.open('rb')
+    return blob, file.encrypted_file.size
+
+def build_download_response(file, request, wrapped_key, blob, size, asynchronous=False):
+    """
+    Turn an open blob into the full, ranged (206) or 416 response. With
+    `asynchronous` the body is an async iterator, which ASGI servers can
+    send without tying up a thread per transfer.
+    """
+    etag = blob_etag(file, size)
+    last_modified = int(file.uploaded_at.timestamp())
+
+    ranges = None
+    range_header = request.META.get('HTTP_RANGE') if request is not None else None
+    if range_header:
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range_matches(if_range.strip(), etag, last_modified):
+            ranges = parse_range_header(range_header, size)
+
+    if ranges is None:
+        if asynchronous:
+            response = StreamingHttpResponse(aread_range(blob, 0, size - 1), content_type=str(file.file_type))
+            response['Content-Length'] = str(size)
+            response._resource_closers.append(blob.close)
+        else:
+            response = EncryptedBlobResponse(blob, content_type=str(file.file_type))
+    elif not ranges:
+        blob.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+    else:
+        response = partial_response(blob, file, ranges, size, asynchronous)
+
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    return set_download_headers(response, file, wrapped_key)
+
+def stream_encrypted_file(file, request=None):
+    # The only place key material is read: from the envelope table
+    wrapped_key = file.wrapped_key(request.user if request is not None else None)
+    if wrapped_key is None:
+        raise FileNotFoundError('No key envelope for this file')
+
+    offload = getattr(settings, 'DOWNLOAD_OFFLOAD', None)
+    if offload:
+        return offload_response(file, wrapped_key, offload)
+
+    blob, size = open_blob(file)
+    return build_download_response(file, request, wrapped_key, blob, size)
+
+async def astream_encrypted_file(file, request=None):
+    wrapped_key = await file.awrapped_key(request.user if request is not None else None)
+    if wrapped_key is None:
+        raise FileNotFoundError('No key envelope for this file')
+
+    offload = getattr(settings, 'DOWNLOAD_OFFLOAD', None)
+    if offload:
+        return offload_response(file, wrapped_key, offload)
+
+    blob, size = await asyncio.to_thread(open_blob, file)
+    return build_download_response(file, request, wrapped_key, blob, size, asynchronous=True)
@@ -0,0 +1,160 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date
+from .models import EncryptedFile, FileVisibility
+import base64
+import binascii
+import json
+
+class InvalidListParameter(ValueError):
+    pass
+
+def encode_cursor(uploaded_at, file_id):
+    position = {'t': uploaded_at.isoformat(), 'i': file_id}
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        position = json.loads(base64.urlsafe_b64decode(padded))
+        uploaded_at = parse_datetime(position['t'])
+        file_id = int(position['i'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidListParameter('Invalid cursor')
+    if uploaded_at is None:
+        raise InvalidListParameter('Invalid cursor')
+    return uploaded_at, file_id
+
+def page_size(value):
+    default = getattr(settings, 'FILE_LIST_PAGE_SIZE', 50)
+    maximum = getattr(settings, 'FILE_LIST_MAX_PAGE_SIZE', 500)
+    if value in (None, ''):
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise InvalidListParameter('limit must be an integer')
+    if size < 1:
+        raise InvalidListParameter('limit must be positive')
+    return min(size, maximum)
+
+def _int_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise InvalidListParameter(f'{name} must be an integer')
+
+def _datetime_param(params, name):
+    value = params.get(name)
+    if value in (None, ''):
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise InvalidListParameter(f'{name} must be an ISO 8601 datetime')
+    return parsed
+
+def filter_files(rows, params, prefix=''):
+    """
+    Apply the optional listing filters from the query string:
+    owner, file_type, min_size, max_size, uploaded_after, uploaded_before
+    and name (file name prefix). `prefix` reaches EncryptedFile fields
+    from another model, e.g. 'file__' for FileVisibility.
+    """
+    lookups = {}
+    owner = _int_param(params, 'owner')
+    if owner is not None:
+        lookups['user_id'] = owner
+    if params.get('file_type'):
+        lookups['file_type'] = params['file_type']
+    min_size = _int_param(params, 'min_size')
+    if min_size is not None:
+        lookups['file_size__gte'] = min_size
+    max_size = _int_param(params, 'max_size')
+    if max_size is not None:
+        lookups['file_size__lte'] = max_size
+    uploaded_after = _datetime_param(params, 'uploaded_after')
+    if uploaded_after is not None:
+        lookups['uploaded_at__gte'] = uploaded_after
+    uploaded_before = _datetime_param(params, 'uploaded_before')
+    if uploaded_before is not None:
+        lookups['uploaded_at__lt'] = uploaded_before
+    if params.get('name'):
+        lookups['file_name__startswith'] = params['name']
+    return rows.filter(**{prefix + lookup: value for lookup, value in lookups.items()})
+
+def visible_rows(user, params):
+    """
+    Return the filtered rows `user` may list and the field holding the file
+    id: EncryptedFile rows for admins, FileVisibility rows otherwise.
+    """
+    # Guard against principals without a role
+    user_type = getattr(user, 'role', None)
+    if user_type == 'admin':
+        return filter_files(EncryptedFile.objects.select_related('user'), params), 'id'
+
+    # Own and shared files come from the visibility index, one indexed
+    # range scan on (user, uploaded_at, file)
+    rows = FileVisibility.objects.filter(user_id=user.pk).select_related('file__user')
+    if user_type != 'regular':  # guest or undefined
+        rows = rows.exclude(permission='owner')
+    return filter_files(rows, params, prefix='file__'), 'file_id'
+
+def order_rows(rows, id_field='id'):
+    return rows.order_by('-uploaded_at', f'-{id_field}')
+
+def _page_query(rows, cursor, limit, id_field):
+    rows = order_rows(rows, id_field)
+    if cursor:
+        uploaded_at, file_id = decode_cursor(cursor)
+        rows = rows.filter(
+            Q(uploaded_at__lt=uploaded_at) |
+            Q(uploaded_at=uploaded_at, **{f'{id_field}__lt': file_id})
+        )
+    return rows[:limit + 1]
+
+def _split_page(page, limit, id_field):
+    next_cursor = None
+    if len(page) > limit:
+        last = page[limit - 1]
+        next_cursor = encode_cursor(last.uploaded_at, getattr(last, id_field))
+    return page[:limit], next_cursor
+
+def paginate_rows(rows, cursor, limit, id_field='id'):
+    """
+    Return one keyset page of `rows` and the cursor for the next page
+    (None on the last page). Rows are EncryptedFile instances, or
+    FileVisibility rows with id_field='file_id'; cursors work for both.
+    """
+    page = list(_page_query(rows, cursor, limit, id_field))
+    return _split_page(page, limit, id_field)
+
+async def apaginate_rows(rows, cursor, limit, id_field='id'):
+    page = [row async for row in _page_query(rows, cursor, limit, id_field)]
+    return _split_page(page, limit, id_field)
+
+def list_etag(kind, key, version):
+    # Weak: the body is the same list, not necessarily the same bytes
+    return f'W/"{kind}-{key}-{version}"'
+
+def conditional_list(request, etag, changed_at):
+    """
+    Answer a conditional GET for a list from its validators alone: returns
+    the 304 (or 412) response when the client's copy is current, else None
+    and the caller builds the list.
+    """
+    last_modified = int(changed_at.timestamp()) if changed_at else None
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    return response and set_list_validators(response, etag, changed_at)
+
+def set_list_validators(response, etag, changed_at):
+    response['ETag'] = etag
+    if changed_at:
+        response['Last-Modified'] = http_date(changed_at.timestamp())
+    # Lists are per user; clients may keep them but must revalidate
+    response['Cache-Control'] = 'private, no-cache'
+    return response
@@ -0,0 +1,59 @@
+from django.core.management.base import BaseCommand, CommandError
+from storage import dataset
+
+def size(value):
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    value = value.strip().upper().rstrip('B')
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+def roles(value):
+    # regular=90,guest=8,admin=2
+    try:
+        weights = {role: float(weight) for role, weight in (item.split('=') for item in value.split(','))}
+    except ValueError:
+        raise CommandError(f'Invalid --roles {value!r}, expected e.g. regular=90,guest=8,admin=2')
+    return weights
+
+class Command(BaseCommand):
+    help = 'Generate users, files, shares and share links in bulk for benchmarks and capacity planning'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, required=True)
+        parser.add_argument('--files', type=int, default=0)
+        parser.add_argument('--shares', type=int, default=0)
+        parser.add_argument('--links', type=int, default=0)
+        parser.add_argument('--roles', type=roles, help='Role weights (default regular=90,guest=8,admin=2)')
+        parser.add_argument('--prefix', default='user', help='Usernames are <prefix><n>; must not clash')
+        parser.add_argument('--min-size', type=size, default=1024, help='Smallest blob, e.g. 1K')
+        parser.add_argument('--max-size', type=size, default=1024 ** 2, help='Largest blob, e.g. 64M')
+        parser.add_argument('--blobs', choices=dataset.BLOB_MODES, default='sparse',
+                            help='Blob contents; "none" writes rows only')
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='Zipf exponent of share and link fan-out over files (0 is uniform)')
+        parser.add_argument('--batch-size', type=int, default=dataset.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, help='Blob writing threads')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        if options['roles'] is not None and set(options['roles']) - {'admin', 'regular', 'guest'}:
+            raise CommandError('Roles must be admin, regular or guest')
+
+        def progress(name, rows, seconds):
+            rate = f' ({rows / seconds:.0f}/s)' if seconds else ''
+            self.stdout.write(f'{name}: {rows} rows in {seconds:.1f}s{rate}')
+
+        results = dataset.generate(
+            options['users'], options['files'], options['shares'], options['links'],
+            roles=options['roles'], prefix=options['prefix'],
+            min_size=options['min_size'], max_size=options['max_size'], blobs=options['blobs'],
+            skew=options['skew'], batch_size=options['batch_size'], workers=options['workers'],
+            seed=options['seed'], progress=progress
+        )
+        total = sum(seconds for _, seconds in results.values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {results['users'][0]} users, {results['files'][0]} files, "
+            f"{results['shares'][0]} shares and {results['links'][0]} links in {total:.1f}s; "
+            f"every user's password is {dataset.PASSWORD!r}"
+        ))
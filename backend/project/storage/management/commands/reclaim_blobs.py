@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from storage.reclaim import BATCH_SIZE, reclaim_blobs
+import time
+
+class Command(BaseCommand):
+    help = 'Unlink the blobs of deleted files queued for reclamation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running, draining the queue every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            processed = freed = 0
+            while True:
+                count, size = reclaim_blobs(limit=options['batch_size'])
+                processed += count
+                freed += size
+                if count < options['batch_size']:
+                    break
+            self.stdout.write(self.style.SUCCESS(f'Reclaimed {processed} blobs, {freed} bytes freed'))
+
+            if options['every'] is None:
+                break
+            time.sleep(options['every'])
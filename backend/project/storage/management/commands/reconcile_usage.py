@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from storage import usage
+
+class Command(BaseCommand):
+    help = 'Recompute per-user storage usage counters and repair any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drift, do not repair')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        drift = usage.reconcile(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        for user_id, ((stored_bytes, stored_files), (used_bytes, file_count)) in sorted(drift.items()):
+            self.stdout.write(
+                f'user {user_id}: {stored_bytes} bytes / {stored_files} files counted, '
+                f'{used_bytes} bytes / {file_count} files stored'
+            )
+        action = 'found' if options['dry_run'] else 'repaired'
+        self.stdout.write(self.style.SUCCESS(f'{len(drift)} drifted counters {action}'))
@@ -0,0 +1,41 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from storage.models import ReclaimableBlob
+from storage.reclaim import reclaim_blobs, scan_orphans
+
+class Command(BaseCommand):
+    help = 'Report blobs under encrypted_files/ that no file refers to, and optionally reclaim them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--grace', type=float, metavar='SECONDS',
+                            help='Skip blobs modified this recently (default ORPHAN_GRACE_PERIOD)')
+        parser.add_argument('--reclaim', action='store_true', help='Queue the orphans and unlink them')
+        parser.add_argument('--list', action='store_true', help='Print every orphan')
+
+    def handle(self, *args, **options):
+        grace = None if options['grace'] is None else timedelta(seconds=options['grace'])
+        count = reclaimable = 0
+        queued = []
+        for name, size in scan_orphans(batch_size=options['batch_size'], grace=grace):
+            count += 1
+            reclaimable += size
+            if options['list']:
+                self.stdout.write(f'{name} {size}')
+            if options['reclaim']:
+                queued.append(ReclaimableBlob(name=name))
+                if len(queued) == options['batch_size']:
+                    ReclaimableBlob.objects.bulk_create(queued)
+                    queued = []
+        if queued:
+            ReclaimableBlob.objects.bulk_create(queued)
+
+        self.stdout.write(f'Found {count} orphaned blobs, {reclaimable} bytes reclaimable')
+        if options['reclaim']:
+            freed = 0
+            while True:
+                processed, size = reclaim_blobs(limit=options['batch_size'])
+                freed += size
+                if processed < options['batch_size']:
+                    break
+            self.stdout.write(self.style.SUCCESS(f'Reclaimed {freed} bytes'))
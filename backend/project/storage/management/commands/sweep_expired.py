@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from storage.sweeper import DEFAULT_BATCH_SIZE, TARGETS, sweep
+import time
+
+class Command(BaseCommand):
+    help = 'Delete expired share links, used or not, and expired refresh tokens in small batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument('--max-rate', type=float, help='Upper bound on deleted rows per second')
+        parser.add_argument('--target', action='append', choices=list(TARGETS), dest='targets',
+                            help='Sweep only this target (repeatable)')
+        parser.add_argument('--every', type=float, metavar='SECONDS',
+                            help='Keep running, sweeping every SECONDS')
+
+    def handle(self, *args, **options):
+        while True:
+            results = sweep(
+                options['targets'],
+                batch_size=options['batch_size'],
+                max_rows_per_second=options['max_rate']
+            )
+            for result in results:
+                cascaded = ''.join(f', {count} {model}' for model, count in result['cascaded'].items())
+                self.stdout.write(
+                    f"{result['target']}: {result['rows']} rows{cascaded} in {result['batches']} batches, "
+                    f"{result['seconds']:.2f}s ({result['rows_per_second'] or 0:.0f} rows/s)"
+                )
+            self.stdout.write(self.style.SUCCESS(f"Swept {sum(r['rows'] for r in results)} rows"))
+
+            if options['every'] is None:
+                break
+            time.sleep(options['every'])
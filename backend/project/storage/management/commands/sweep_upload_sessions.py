@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from storage.uploads import sweep_expired_sessions
+
+class Command(BaseCommand):
+    help = 'Delete chunked upload sessions that exceeded UPLOAD_SESSION_TTL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        total = 0
+        while True:
+            swept = sweep_expired_sessions(limit=options['batch_size'])
+            total += swept
+            if swept < options['batch_size']:
+                break
+        self.stdout.write(self.style.SUCCESS(f'Swept {total} abandoned upload sessions'))
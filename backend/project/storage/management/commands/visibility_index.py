@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from storage import visibility
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the FileVisibility index from EncryptedFile and FileShare'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='Only report drift, do not rebuild')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if not options['verify']:
+            written = visibility.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(f'Rebuilt visibility index with {written} rows')
+
+        drift = visibility.verify()
+        for name, count in drift.items():
+            self.stdout.write(f'{name}: {count}')
+        if any(drift.values()):
+            raise CommandError('Visibility index does not match its source tables')
+        self.stdout.write(self.style.SUCCESS('Visibility index is consistent'))
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:28
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0009_encryptedfile_sha256'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['-uploaded_at', '-id'], name='storage_enc_uploade_50e981_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='encryptedfile',
+            index=models.Index(fields=['user', '-uploaded_at', '-id'], name='storage_enc_user_id_0997d6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='fileshare',
+            index=models.Index(fields=['shared_with', 'file'], name='storage_fil_shared__81fca8_idx'),
+        ),
+    ]
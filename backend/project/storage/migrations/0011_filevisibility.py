@@ -0,0 +1,49 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_visibility(apps, schema_editor):
+    EncryptedFile = apps.get_model('storage', 'EncryptedFile')
+    FileShare = apps.get_model('storage', 'FileShare')
+    FileVisibility = apps.get_model('storage', 'FileVisibility')
+
+    rows = [
+        FileVisibility(user_id=user_id, file_id=file_id, permission='owner', uploaded_at=uploaded_at)
+        for user_id, file_id, uploaded_at in EncryptedFile.objects.values_list('user_id', 'id', 'uploaded_at').iterator()
+    ]
+    rows += [
+        FileVisibility(user_id=user_id, file_id=file_id, permission=permission, uploaded_at=uploaded_at)
+        for user_id, file_id, permission, uploaded_at in FileShare.objects.exclude(
+            shared_with=models.F('file__user')
+        ).values_list('shared_with_id', 'file_id', 'permission', 'file__uploaded_at').iterator()
+    ]
+    FileVisibility.objects.bulk_create(rows, batch_size=5000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0010_encryptedfile_storage_enc_uploade_50e981_idx_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileVisibility',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('permission', models.CharField(choices=[('owner', 'Owner'), ('view', 'View Only'), ('download', 'View and Download')], max_length=10)),
+                ('uploaded_at', models.DateTimeField()),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visible_to', to='storage.encryptedfile')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='visible_files', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', '-uploaded_at', '-file'], name='storage_fil_user_id_398481_idx')],
+                'unique_together': {('user', 'file')},
+            },
+        ),
+        migrations.RunPython(backfill_visibility, migrations.RunPython.noop),
+    ]
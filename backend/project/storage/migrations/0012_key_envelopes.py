@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def move_keys_to_envelopes(apps, schema_editor):
+    EncryptedFile = apps.get_model('storage', 'EncryptedFile')
+    KeyEnvelope = apps.get_model('storage', 'KeyEnvelope')
+    KeyEnvelope.objects.bulk_create(
+        (
+            KeyEnvelope(file_id=file_id, wrapped_key=encryption_key)
+            for file_id, encryption_key in EncryptedFile.objects.values_list('id', 'encryption_key').iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+def move_keys_to_files(apps, schema_editor):
+    EncryptedFile = apps.get_model('storage', 'EncryptedFile')
+    KeyEnvelope = apps.get_model('storage', 'KeyEnvelope')
+    for file_id, wrapped_key in KeyEnvelope.objects.filter(recipient__isnull=True).values_list('file_id', 'wrapped_key').iterator():
+        EncryptedFile.objects.filter(pk=file_id).update(encryption_key=wrapped_key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0011_filevisibility'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KeyEnvelope',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wrapped_key', models.BinaryField(editable=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('file', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='key_envelopes', to='storage.encryptedfile')),
+                ('recipient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='key_envelopes', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['file', 'recipient'], name='storage_key_file_id_8e771b_idx')],
+            },
+        ),
+        # Nullable while the keys move, so the reverse path can re-add the
+        # column to a populated table before refilling it
+        migrations.AlterField(
+            model_name='encryptedfile',
+            name='encryption_key',
+            field=models.BinaryField(editable=True, null=True),
+        ),
+        migrations.RunPython(move_keys_to_envelopes, move_keys_to_files),
+        migrations.RemoveField(
+            model_name='encryptedfile',
+            name='encryption_key',
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:46
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0012_key_envelopes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(condition=models.Q(('is_used', False)), fields=['expires_at'], name='storage_link_unused_expiry_idx'),
+        ),
+    ]
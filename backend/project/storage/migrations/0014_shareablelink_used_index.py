@@ -0,0 +1,19 @@
+# Generated by Django 5.1.4 on 2026-10-18 18:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('storage', '0013_shareablelink_partial_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(condition=models.Q(('is_used', True)), fields=['id'], name='storage_link_used_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def count_existing_files(apps, schema_editor):
+    EncryptedFile = apps.get_model('storage', 'EncryptedFile')
+    StorageUsage = apps.get_model('storage', 'StorageUsage')
+    totals = EncryptedFile.objects.values('user_id').annotate(used_bytes=Sum('file_size'), file_count=Count('id')).order_by()
+    StorageUsage.objects.bulk_create(
+        (StorageUsage(user_id=row['user_id'], used_bytes=row['used_bytes'], file_count=row['file_count']) for row in totals.iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0001_initial'),
+        ('storage', '0015_reclaimableblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('used_bytes', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(count_existing_files, migrations.RunPython.noop),
+    ]
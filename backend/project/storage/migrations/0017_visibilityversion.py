@@ -0,0 +1,36 @@
+# Generated by Django 5.1.4 on 2026-10-18 19:27
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def create_versions(apps, schema_editor):
+    # Removals only bump existing rows, so every user needs one up front
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    VisibilityVersion = apps.get_model('storage', 'VisibilityVersion')
+    VisibilityVersion.objects.bulk_create(
+        (VisibilityVersion(user_id=user_id) for user_id in User.objects.values_list('pk', flat=True).iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0001_initial'),
+        ('storage', '0016_storageusage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisibilityVersion',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='visibility_version', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('version', models.BigIntegerField(default=0)),
+                ('changed_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.RunPython(create_versions, migrations.RunPython.noop),
+    ]
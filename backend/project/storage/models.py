@@ -1,8 +1,12 @@
+from asgiref.sync import sync_to_async
 from django.db import models
+from django.db.models import Q
 from django.contrib.auth import get_user_model
 import uuid
 from django.utils import timezone
 from datetime import timedelta
+from .access_cache import access_cache
+import math
 
 User = get_user_model()
 
@@ -19,6 +23,24 @@ class ShareableLink(models.Model):
     is_used = models.BooleanField(default=False)
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='shared_links')
 
+    class Meta:
+        indexes = [
+            # Partial: only links that can still be redeemed are indexed,
+            # which serves "unused and not yet expired" lookups and expiry
+            # sweeps while used links drop out of the index
+            models.Index(
+                fields=['expires_at'],
+                condition=Q(is_used=False),
+                name='storage_link_unused_expiry_idx'
+            ),
+            # The complement: redeemed links, which only the sweeper reads
+            models.Index(
+                fields=['id'],
+                condition=Q(is_used=True),
+                name='storage_link_used_idx'
+            ),
+        ]
+
     def is_valid(self):
         return (
             not self.is_used and
@@ -27,7 +49,17 @@ class ShareableLink(models.Model):
 
     def mark_as_used(self):
         self.is_used = True
-        self.save()
+        self.save(update_fields=['is_used'])
+
+    @classmethod
+    def claim(cls, token):
+        """
+        Mark the link used if it is still redeemable, as one conditional
+        UPDATE. Returns True for exactly one caller per link.
+        """
+        return cls.objects.filter(
+            token=token, is_used=False, expires_at__gt=timezone.now()
+        ).update(is_used=True) == 1
 
 class FileShare(models.Model):
     PERMISSION_CHOICES = [
@@ -41,6 +73,10 @@ class FileShare(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     class Meta:
         unique_together = ('file', 'shared_with')
+        indexes = [
+            # Incoming shares for a user, resolved without touching the table
+            models.Index(fields=['shared_with', 'file']),
+        ]
 
 class EncryptedFile(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='files')
@@ -48,10 +84,24 @@ class EncryptedFile(models.Model):
     file_type = models.CharField(max_length=100)
     file_size = models.BigIntegerField()
     encrypted_file = models.FileField(upload_to='encrypted_files/')
-    encryption_key = models.BinaryField(editable=True)  # Store the encryption key as binary
+    sha256 = models.CharField(max_length=64, blank=True, default='')  # Digest of the stored blob
     uploaded_at = models.DateTimeField(auto_now_add=True)
     is_shared = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Keyset pagination order used by FileListView
+            models.Index(fields=['-uploaded_at', '-id']),
+            models.Index(fields=['user', '-uploaded_at', '-id']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the owner as loaded so ownership changes can be detected
+        instance._loaded_user_id = instance.__dict__.get('user_id')
+        return instance
+
     def __str__(self):
         return f"{self.file_name} ({self.user.username})"
     
@@ -74,12 +124,149 @@ class EncryptedFile(models.Model):
             permission=permission
         )
 
+    def wrapped_key(self, user=None):
+        # Prefer an envelope wrapped for this recipient, else the file's default
+        return wrapped_keys([self.pk], user).get(self.pk)
+
+    async def awrapped_key(self, user=None):
+        return (await awrapped_keys([self.pk], user)).get(self.pk)
+
     def can_access(self, user):
-        if user.role == 'admin' or user == self.user:
+        if user.role == 'admin' or user.pk == self.user_id:
+            return 'download'
+        return access_cache.get(self.pk, user.pk, lambda: self._shared_permission(user))
+
+    async def acan_access(self, user):
+        if user.role == 'admin' or user.pk == self.user_id:
             return 'download'
-        
-        share = self.shares.filter(shared_with=user).first()
-        if share:
-            return share.permission
-            
-        return None
\ No newline at end of file
+        # The cache and its lookup are synchronous; run them off the loop
+        return await sync_to_async(self.can_access)(user)
+
+    def _shared_permission(self, user):
+        permission = FileVisibility.objects.filter(
+            user=user, file=self
+        ).values_list('permission', flat=True).first()
+        if permission == 'owner':
+            return 'download'
+        return permission
+
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100)
+    file_size = models.BigIntegerField()
+    chunk_size = models.PositiveIntegerField()
+    encryption_key = models.BinaryField(editable=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['updated_at']),
+        ]
+
+    @property
+    def total_chunks(self):
+        return max(math.ceil(self.file_size / self.chunk_size), 1)
+
+    def chunk_length(self, index):
+        if index == self.total_chunks - 1:
+            return self.file_size - index * self.chunk_size
+        return self.chunk_size
+
+class KeyEnvelope(models.Model):
+    """
+    Wrapped encryption key for a file, kept out of the EncryptedFile row so
+    listing and metadata queries never load key material. A file has one
+    default envelope (recipient is null) and may hold more, e.g. one
+    wrapped per recipient.
+    """
+    file = models.ForeignKey('EncryptedFile', on_delete=models.CASCADE, related_name='key_envelopes')
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True, related_name='key_envelopes')
+    wrapped_key = models.BinaryField(editable=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['file', 'recipient']),
+        ]
+
+def _envelopes(file_ids, user):
+    recipients = Q(recipient__isnull=True)
+    if user is not None:
+        recipients |= Q(recipient_id=user.pk)
+    return KeyEnvelope.objects.filter(recipients, file_id__in=file_ids).values_list(
+        'file_id', 'recipient_id', 'wrapped_key'
+    )
+
+def _pick_key(keys, file_id, recipient_id, wrapped_key):
+    if recipient_id is not None or file_id not in keys:
+        keys[file_id] = bytes(wrapped_key)
+
+def wrapped_keys(file_ids, user=None):
+    """
+    Map file id to wrapped key for the given files in one query, preferring
+    envelopes wrapped for `user` over the default envelope.
+    """
+    keys = {}
+    for row in _envelopes(file_ids, user):
+        _pick_key(keys, *row)
+    return keys
+
+async def awrapped_keys(file_ids, user=None):
+    keys = {}
+    async for row in _envelopes(file_ids, user):
+        _pick_key(keys, *row)
+    return keys
+
+class FileVisibility(models.Model):
+    """
+    Denormalized (user, file) visibility index: one row for the owner and
+    one per FileShare. Kept in sync by storage.visibility; rebuild and
+    verify it with the visibility_index management command.
+    """
+    PERMISSION_CHOICES = [
+        ('owner', 'Owner'),
+        ('view', 'View Only'),
+        ('download', 'View and Download')
+    ]
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='visible_files')
+    file = models.ForeignKey('EncryptedFile', on_delete=models.CASCADE, related_name='visible_to')
+    permission = models.CharField(max_length=10, choices=PERMISSION_CHOICES)
+    uploaded_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'file')
+        indexes = [
+            models.Index(fields=['user', '-uploaded_at', '-file']),
+        ]
+
+class ReclaimableBlob(models.Model):
+    """
+    Storage name of a deleted file's blob, queued in the same transaction
+    as the delete and unlinked afterwards by storage.reclaim.
+    """
+    name = models.CharField(max_length=255)
+    queued_at = models.DateTimeField(auto_now_add=True)
+
+class StorageUsage(models.Model):
+    """
+    Running totals of a user's stored files, maintained with F() updates by
+    storage.usage so quota checks never aggregate over EncryptedFile.
+    Repair drift with the reconcile_usage management command.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    used_bytes = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+
+class VisibilityVersion(models.Model):
+    """
+    Per-user counter that storage.visibility bumps whenever the files the
+    user can list change, or the shares on the user's own files do. File
+    and share lists derive their ETag and Last-Modified from it; a user
+    without a row is at version 0.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='visibility_version')
+    version = models.BigIntegerField(default=0)
+    changed_at = models.DateTimeField(default=timezone.now)
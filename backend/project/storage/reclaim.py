@@ -0,0 +1,132 @@
+"""
+Blob reclamation for deleted files.
+
+Deleting an EncryptedFile, directly or by cascade from its owner, queues
+its blob name as a ReclaimableBlob in the same transaction. Once that
+commits, a single background thread per process unlinks queued blobs in
+batches; the reclaim_blobs management command drains the same queue, e.g.
+after a crash. scan_orphans walks encrypted_files/, subdirectories
+included, for blobs no row refers to at all.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from .models import EncryptedFile, ReclaimableBlob
+import os
+import threading
+import time
+
+BLOB_DIR = 'encrypted_files'
+BATCH_SIZE = 100
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='blob-reclaim')
+_lock = threading.Lock()
+_scheduled = False
+
+def enqueue(name):
+    ReclaimableBlob.objects.create(name=name)
+    if getattr(settings, 'BLOB_RECLAIM_IN_PROCESS', True):
+        transaction.on_commit(schedule)
+
+def schedule():
+    # Any number of commits wake the reclaimer once
+    global _scheduled
+    with _lock:
+        if _scheduled:
+            return
+        _scheduled = True
+    _executor.submit(_drain)
+
+def _drain():
+    global _scheduled
+    with _lock:
+        _scheduled = False
+    try:
+        while reclaim_blobs()[0] == BATCH_SIZE:
+            pass
+    finally:
+        connection.close()
+
+def _blob_size(name):
+    try:
+        return os.stat(default_storage.path(name)).st_size
+    except FileNotFoundError:
+        return None
+
+def reclaim_blobs(limit=BATCH_SIZE):
+    """
+    Unlink up to `limit` queued blobs and dequeue them. Returns the number
+    of queue entries processed and the bytes freed.
+    """
+    queued = list(ReclaimableBlob.objects.order_by('id')[:limit])
+    if not queued:
+        return 0, 0
+
+    # Never unlink a blob some row still points at
+    in_use = set(
+        EncryptedFile.objects.filter(encrypted_file__in={blob.name for blob in queued})
+        .values_list('encrypted_file', flat=True)
+    )
+    freed = 0
+    for blob in queued:
+        if blob.name in in_use:
+            continue
+        size = _blob_size(blob.name)
+        if size is not None:
+            default_storage.delete(blob.name)
+            freed += size
+
+    ReclaimableBlob.objects.filter(pk__in=[blob.pk for blob in queued]).delete()
+    return len(queued), freed
+
+def _unreferenced(batch):
+    names = [name for name, _ in batch]
+    known = set(
+        EncryptedFile.objects.filter(encrypted_file__in=names).values_list('encrypted_file', flat=True)
+    )
+    known.update(ReclaimableBlob.objects.filter(name__in=names).values_list('name', flat=True))
+    return [(name, size) for name, size in batch if name not in known]
+
+def _walk_blobs(root):
+    # (name relative to MEDIA_ROOT, DirEntry) for every regular file under
+    # `root`, subdirectories included: blobs stored before names were
+    # flattened may sit in nested directories. Directories are read one
+    # entry at a time, so memory grows with depth, not with file count
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            entries = os.scandir(default_storage.path(directory))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                name = f'{directory}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(name)
+                elif entry.is_file(follow_symlinks=False):
+                    yield name, entry
+
+def scan_orphans(batch_size=1000, grace=None):
+    """
+    Yield (name, size) for every blob under encrypted_files/ that neither
+    an EncryptedFile nor the reclaim queue refers to. The tree is read
+    incrementally and checked against the database one batch at a time,
+    so memory stays bounded by `batch_size` however many blobs there are.
+    """
+    grace = getattr(settings, 'ORPHAN_GRACE_PERIOD', timedelta(hours=1)) if grace is None else grace
+    cutoff = time.time() - grace.total_seconds()
+
+    batch = []
+    for name, entry in _walk_blobs(BLOB_DIR):
+        stat = entry.stat(follow_symlinks=False)
+        if stat.st_mtime > cutoff:
+            continue
+        batch.append((name, stat.st_size))
+        if len(batch) == batch_size:
+            yield from _unreferenced(batch)
+            batch = []
+    if batch:
+        yield from _unreferenced(batch)
@@ -1,5 +1,6 @@
 from rest_framework import serializers
-from .models import EncryptedFile, FileShare, ShareableLink
+from .models import EncryptedFile, FileShare, ShareableLink, UploadSession
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -19,6 +20,7 @@ class EncryptedFileSerializer(serializers.ModelSerializer):
             'file_name',
             'file_type',
             'file_size',
+            'sha256',
             'uploaded_at',
             'is_shared',
             'user',
@@ -33,6 +35,40 @@ class FileShareSerializer(serializers.ModelSerializer):
         model = FileShare
         fields = ['shared_with_email', 'permission']
 
+class BulkFileShareSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+    shared_with_emails = serializers.ListField(child=serializers.EmailField(), allow_empty=False)
+    permission = serializers.ChoiceField(choices=FileShare.PERMISSION_CHOICES, default='view')
+
+    def validate(self, attrs):
+        # De-duplicate while keeping the caller's order for the report
+        attrs['file_ids'] = list(dict.fromkeys(attrs['file_ids']))
+        attrs['shared_with_emails'] = list(dict.fromkeys(attrs['shared_with_emails']))
+        max_pairs = getattr(settings, 'BULK_SHARE_MAX_PAIRS', 10000)
+        if len(attrs['file_ids']) * len(attrs['shared_with_emails']) > max_pairs:
+            raise serializers.ValidationError(f'At most {max_pairs} file/recipient pairs per request')
+        return attrs
+
+class BatchDownloadSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_file_ids(self, value):
+        value = list(dict.fromkeys(value))
+        max_files = getattr(settings, 'DOWNLOAD_BATCH_MAX_FILES', 500)
+        if len(value) > max_files:
+            raise serializers.ValidationError(f'At most {max_files} files per archive')
+        return value
+
+class BulkFileDeleteSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_file_ids(self, value):
+        value = list(dict.fromkeys(value))
+        max_files = getattr(settings, 'BULK_DELETE_MAX_FILES', 1000)
+        if len(value) > max_files:
+            raise serializers.ValidationError(f'At most {max_files} files per request')
+        return value
+
 class FileShareDetailsSerializer(serializers.ModelSerializer):
     shared_with = UserSerializer()
     file = EncryptedFileSerializer()
@@ -45,4 +81,28 @@ class ShareableLinkSerializer(serializers.ModelSerializer):
     class Meta:
         model = ShareableLink
         fields = ['id', 'token', 'expires_at', 'is_used']
-        read_only_fields = ['id', 'token', 'is_used']
\ No newline at end of file
+        read_only_fields = ['id', 'token', 'is_used']
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(required=False, min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ['file_name', 'file_type', 'file_size', 'chunk_size']
+
+    def validate_file_name(self, value):
+        # A display name only; it must not read as a path
+        if value in ('.', '..') or '/' in value or '\\' in value or '\x00' in value:
+            raise serializers.ValidationError('File name cannot contain path separators')
+        return value
+
+    def validate_file_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError('File size cannot be negative')
+        return value
+
+    def validate_chunk_size(self, value):
+        max_chunk_size = getattr(settings, 'UPLOAD_MAX_CHUNK_SIZE', 64 * 1024 * 1024)
+        if value > max_chunk_size:
+            raise serializers.ValidationError(f'Chunk size cannot exceed {max_chunk_size} bytes')
+        return value
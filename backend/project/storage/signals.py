@@ -0,0 +1,79 @@
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .access_cache import access_cache
+from .models import EncryptedFile, FileShare, User
+from . import reclaim, usage, visibility
+
+def invalidate_access(file_id, user_id=None):
+    # Drop now, and again once the write is visible to other connections,
+    # so a lookup racing with the transaction cannot re-cache the old value
+    def invalidate():
+        if user_id is None:
+            access_cache.invalidate_file(file_id)
+        else:
+            access_cache.invalidate(file_id, user_id)
+    invalidate()
+    transaction.on_commit(invalidate)
+
+def invalidate_access_many(pairs):
+    # For bulk writes, which send no signals
+    pairs = list(pairs)
+    access_cache.invalidate_many(pairs)
+    transaction.on_commit(lambda: access_cache.invalidate_many(pairs))
+
+@receiver(post_save, sender=EncryptedFile)
+def sync_owner_visibility(sender, instance, created, **kwargs):
+    previous_user_id = getattr(instance, '_loaded_user_id', None)
+    if created:
+        visibility.grant_owner(instance)
+        usage.add(instance.user_id, instance.file_size)
+    elif previous_user_id is not None and previous_user_id != instance.user_id:
+        visibility.reassign_owner(instance, previous_user_id)
+        usage.release(previous_user_id, instance.file_size)
+        usage.add(instance.user_id, instance.file_size)
+        invalidate_access(instance.pk)
+    instance._loaded_user_id = instance.user_id
+
+@receiver(post_save, sender=FileShare)
+def sync_share_visibility(sender, instance, **kwargs):
+    visibility.grant_share(instance)
+    invalidate_access(instance.file_id, instance.shared_with_id)
+
+def _is_cascade(origin):
+    # Whether a share is going because its file or a user is: the
+    # visibility rows then go in the same cascade
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return model in (EncryptedFile, User)
+
+def revoke_cascaded_shares(origin):
+    # The users who lost shares in the cascade started by `origin`, bumped
+    # together once the cascade reaches the files or users it started from
+    shares = origin.__dict__.pop('_revoked_shares', None) if _is_cascade(origin) else None
+    if shares:
+        visibility.revoke_cascaded_shares(shares)
+
+@receiver(post_delete, sender=FileShare)
+def revoke_share_visibility(sender, instance, origin=None, **kwargs):
+    if _is_cascade(origin):
+        # Shares are deleted before what they point at, so this runs
+        # before the origin's own post_delete
+        origin.__dict__.setdefault('_revoked_shares', []).append(instance)
+    else:
+        visibility.revoke_share(instance)
+    invalidate_access(instance.file_id, instance.shared_with_id)
+
+@receiver(post_delete, sender=User)
+def release_deleted_user(sender, instance, origin=None, **kwargs):
+    revoke_cascaded_shares(origin)
+
+@receiver(post_delete, sender=EncryptedFile)
+def release_deleted_file(sender, instance, origin=None, **kwargs):
+    # Covers cascades from a deleted owner as well as the delete endpoints
+    revoke_cascaded_shares(origin)
+    invalidate_access(instance.pk)
+    visibility.bump([instance.user_id], create=False)
+    usage.release(instance.user_id, instance.file_size)
+    if instance.encrypted_file:
+        reclaim.enqueue(instance.encrypted_file.name)
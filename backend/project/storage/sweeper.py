@@ -0,0 +1,119 @@
+"""
+Batched deletion of rows that otherwise only accumulate: share links past
+their expiry, redeemed or not, and outstanding refresh tokens past their
+expiry together with their blacklist entries. A swept link's token then
+answers 404 instead of 403.
+
+Each batch picks at most `batch_size` primary keys through an index and
+deletes them in its own short statement, so no write lock is held for
+longer than one small DELETE. An optional rows/second ceiling spaces the
+batches out to leave room for request traffic.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.db import connection
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from .models import ShareableLink
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 500
+# Swept from request handlers at most this often per process
+SWEEP_INTERVAL = 300
+
+_last_sweep = 0.0
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sweeper')
+
+def _expired_links(now):
+    # storage_link_unused_expiry_idx
+    return ShareableLink.objects.filter(is_used=False, expires_at__lte=now).order_by('expires_at')
+
+def _used_links(now):
+    # storage_link_used_idx. Kept until they expire, so redeeming a used
+    # link again still says so (403) for as long as the link would have
+    # been valid
+    return ShareableLink.objects.filter(is_used=True, expires_at__lte=now).order_by('id')
+
+def _expired_tokens(now):
+    # expires_at is not indexed, but every refresh token gets the same
+    # lifetime, so tokens expire in id order and a primary key walk finds
+    # the expired ones at its start
+    return OutstandingToken.objects.filter(expires_at__lte=now).order_by('id')
+
+TARGETS = {
+    'expired_links': _expired_links,
+    'used_links': _used_links,
+    'expired_tokens': _expired_tokens,
+}
+
+def delete_batch(queryset, batch_size):
+    """
+    Delete up to `batch_size` rows of an ordered queryset. Returns the
+    per-model counts, including rows removed by cascade (BlacklistedToken
+    for OutstandingToken).
+    """
+    ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+    if not ids:
+        return {}
+    # The filter is re-applied, so a row that changed since it was picked
+    # is left alone
+    _, deleted = queryset.filter(pk__in=ids).delete()
+    return deleted
+
+def sweep_target(name, now=None, batch_size=DEFAULT_BATCH_SIZE, max_rows_per_second=None, max_batches=None):
+    now = now or timezone.now()
+    queryset = TARGETS[name](now)
+    label = queryset.model._meta.label
+    result = {'target': name, 'rows': 0, 'cascaded': {}, 'batches': 0}
+
+    started = time.monotonic()
+    while max_batches is None or result['batches'] < max_batches:
+        deleted = delete_batch(queryset, batch_size)
+        rows = deleted.get(label, 0)
+        result['batches'] += 1
+        result['rows'] += rows
+        for model, count in deleted.items():
+            if model != label:
+                result['cascaded'][model] = result['cascaded'].get(model, 0) + count
+        if rows < batch_size:
+            break
+        if max_rows_per_second:
+            delay = started + result['rows'] / max_rows_per_second - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    result['seconds'] = time.monotonic() - started
+    result['rows_per_second'] = result['rows'] / result['seconds'] if result['seconds'] else None
+    return result
+
+def sweep(targets=None, **options):
+    """
+    Sweep every target in turn (all of TARGETS by default) and return one
+    result per target: rows deleted, cascaded rows per model, batches,
+    seconds and rows/second. Options are passed to sweep_target.
+    """
+    now = options.pop('now', None) or timezone.now()
+    return [sweep_target(name, now=now, **options) for name in targets or TARGETS]
+
+def _background_sweep():
+    try:
+        sweep(max_batches=1)
+    except Exception:
+        logger.exception('Sweep failed')
+    finally:
+        connection.close()
+
+def maybe_sweep():
+    """
+    Start one batch per target on a background thread, at most once per
+    SWEEP_INTERVAL, so the request that triggers it neither waits for the
+    deletes nor fails with them. Returns whether a sweep was started.
+    """
+    global _last_sweep
+    if time.monotonic() - _last_sweep < SWEEP_INTERVAL:
+        return False
+    _last_sweep = time.monotonic()
+    _executor.submit(_background_sweep)
+    return True
@@ -1,3 +1,1166 @@
-from django.test import TestCase
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import include, path
+from django.utils import timezone
+from account.cache import user_cache
+from account.models import User
+from account.serializers import CustomTokenObtainPairSerializer
+from project import metrics
+from project.query_budget import QueryBudgetMixin, QueryLog, read_body
+from .models import EncryptedFile, FileShare, FileVisibility, KeyEnvelope, ReclaimableBlob, ShareableLink
+from . import dataset, reclaim, sweeper, usage, visibility
+from .access_cache import access_cache
+from .downloads import offload_response, parse_range_header
+from .uploads import ENCRYPTION_OVERHEAD, session_sha256
+from .urls import storage_urlpatterns
+
+def client_for(user):
+    token = CustomTokenObtainPairSerializer.get_token(user).access_token
+    return Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+def use_temporary_media(test, **overrides):
+    media = tempfile.TemporaryDirectory()
+    test.addCleanup(media.cleanup)
+    test.enterContext(override_settings(MEDIA_ROOT=media.name, **overrides))
+    os.makedirs(os.path.join(media.name, 'encrypted_files'))
+
+def create_file(owner, blob=b'0' * 64, **fields):
+    # A stored blob with its key envelope, recorded as an upload would be
+    file = EncryptedFile(user=owner, **{
+        'file_name': 'blob.bin', 'file_type': 'application/octet-stream',
+        'file_size': max(len(blob) - ENCRYPTION_OVERHEAD, 0), **fields,
+    })
+    file.encrypted_file.save(f'{uuid.uuid4().hex}.bin', ContentFile(blob))
+    KeyEnvelope.objects.create(file=file, wrapped_key=b'k' * 32)
+    return file
+
+class RangeHeaderTests(SimpleTestCase):
+    def test_single_and_suffix(self):
+        self.assertEqual(parse_range_header('bytes=0-9', 100), [(0, 9)])
+        self.assertEqual(parse_range_header('bytes=90-', 100), [(90, 99)])
+        self.assertEqual(parse_range_header('bytes=-10', 100), [(90, 99)])
+        # A suffix longer than the file is the whole file
+        self.assertEqual(parse_range_header('bytes=-500', 100), [(0, 99)])
+        self.assertEqual(parse_range_header('bytes=50-500', 100), [(50, 99)])
+
+    def test_overlapping_ranges_coalesce(self):
+        self.assertEqual(parse_range_header('bytes=20-29, 0-9, 5-14', 100), [(0, 14), (20, 29)])
+        # Adjacent ranges join too
+        self.assertEqual(parse_range_header('bytes=0-9,10-19', 100), [(0, 19)])
+
+    def test_unsatisfiable(self):
+        self.assertEqual(parse_range_header('bytes=100-', 100), [])
+        self.assertEqual(parse_range_header('bytes=-0', 100), [])
+        self.assertEqual(parse_range_header('bytes=0-', 0), [])
+        # Satisfiable parts are kept
+        self.assertEqual(parse_range_header('bytes=200-300,0-0', 100), [(0, 0)])
+
+    def test_ignored(self):
+        for header in ('items=0-9', 'bytes=', 'bytes=9-0', 'bytes=a-b', 'bytes=5', 'bytes=-',
+                       'bytes=' + ','.join(['0-0'] * 17)):
+            self.assertIsNone(parse_range_header(header, 100), header)
+
+class RangeDownloadTests(TestCase):
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+        self.file = create_file(self.owner)
+
+    def download(self, **headers):
+        return client_for(self.owner).get(f'/storage/download/{self.file.pk}', secure=True, **headers)
+
+    def test_partial_content(self):
+        response = self.download(HTTP_RANGE='bytes=-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 54-63/64')
+        self.assertEqual(read_body(response), b'0' * 10)
+
+    def test_unsatisfiable(self):
+        response = self.download(HTTP_RANGE='bytes=64-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */64')
+
+    def test_if_range(self):
+        full = self.download()
+        etag, last_modified = full['ETag'], full['Last-Modified']
+        self.assertEqual(self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        self.assertEqual(self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=last_modified).status_code, 206)
+        # A stale or weak validator gets the whole file
+        for validator in ('"stale"', f'W/{etag}', 'Mon, 01 Jan 2001 00:00:00 GMT'):
+            response = self.download(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=validator)
+            self.assertEqual(response.status_code, 200, validator)
+            self.assertEqual(len(read_body(response)), 64)
+
+class UploadSessionTests(TestCase):
+    """
+    Chunked uploads: chunks of the wrong size are refused, a session can
+    be resumed from its status, and completion needs every chunk.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def create_session(self, file_name='chunked.bin', file_size=100, chunk_size=40):
+        return client_for(self.owner).post('/storage/uploads', {
+            'file_name': file_name,
+            'file_type': 'application/octet-stream',
+            'file_size': file_size,
+            'chunk_size': chunk_size,
+            'encrypted_key': base64.b64encode(b'k' * 32).decode(),
+        }, content_type='application/json', secure=True)
+
+    def put_chunk(self, client, session_id, index, data):
+        return client.put(f'/storage/uploads/{session_id}/chunks/{index}', data,
+                          content_type='application/octet-stream', secure=True)
+
+    def test_path_names_are_refused(self):
+        for name in ('../evil.bin', 'sub/dir.bin', '..'):
+            response = self.create_session(file_name=name)
+            self.assertEqual(response.status_code, 400, name)
+            self.assertIn('file_name', response.json())
+
+    def test_chunk_size_mismatch(self):
+        client = client_for(self.owner)
+        session_id = self.create_session().json()['id']
+        response = self.put_chunk(client, session_id, 0, b'x' * 39)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.get(f'/storage/uploads/{session_id}', secure=True).json()['received_chunks'], [])
+
+    def test_resume_and_complete(self):
+        client = client_for(self.owner)
+        blob = os.urandom(100)
+        session_id = self.create_session().json()['id']
+        self.assertEqual(self.put_chunk(client, session_id, 0, blob[:40]).status_code, 200)
+        self.assertEqual(self.put_chunk(client, session_id, 2, blob[80:]).status_code, 200)
+
+        # Completing early reports what is still missing
+        response = client.post(f'/storage/uploads/{session_id}/complete', secure=True)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['next_chunk'], 1)
+
+        progress = client.get(f'/storage/uploads/{session_id}', secure=True).json()
+        self.assertEqual((progress['received_chunks'], progress['next_offset']), ([0, 2], 40))
+        self.put_chunk(client, session_id, 1, blob[40:80])
+
+        response = client.post(f'/storage/uploads/{session_id}/complete', secure=True)
+        self.assertEqual(response.status_code, 201)
+        file = EncryptedFile.objects.get(pk=response.json()['id'])
+        # Recorded as FileUploadView records a blob
+        self.assertEqual(file.file_size, 100 - ENCRYPTION_OVERHEAD)
+        self.assertEqual(file.sha256, hashlib.sha256(blob).hexdigest())
+        self.assertEqual(os.path.dirname(file.encrypted_file.name), 'encrypted_files')
+        with file.encrypted_file.open('rb') as stored:
+            self.assertEqual(stored.read(), blob)
+
+    def test_chunk_rewritten_while_hashing(self):
+        client = client_for(self.owner)
+        blob = os.urandom(100)
+        session_id = self.create_session().json()['id']
+        for index in range(3):
+            self.put_chunk(client, session_id, index, blob[index * 40:(index + 1) * 40])
+
+        def rewrite_after_hashing(session):
+            digest = session_sha256(session)
+            time.sleep(0.01)
+            self.put_chunk(client, session_id, 2, blob[80:])
+            return digest
+
+        with mock.patch('storage.views.session_sha256', rewrite_after_hashing):
+            response = client.post(f'/storage/uploads/{session_id}/complete', secure=True)
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(EncryptedFile.objects.filter(file_name='chunked.bin').exists())
+
+        response = client.post(f'/storage/uploads/{session_id}/complete', secure=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(EncryptedFile.objects.get(pk=response.json()['id']).sha256, hashlib.sha256(blob).hexdigest())
+
+def upload(user, blob, file_size=None):
+    return client_for(user).post('/storage/upload', {
+        'file': SimpleUploadedFile('blob.bin', blob),
+        'encrypted_key': SimpleUploadedFile('key', b'k' * 32),
+        'file_name': 'blob.bin',
+        'file_type': 'application/octet-stream',
+        'file_size': len(blob) - ENCRYPTION_OVERHEAD if file_size is None else file_size,
+    }, secure=True)
+
+class UploadLimitTests(TestCase):
+    """
+    FileUploadView enforces the per-role blob limit on the blob itself,
+    not on the multipart body around it, and refuses a declared size that
+    is not an integer before storing anything.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    @override_settings(UPLOAD_MAX_SIZE_BY_ROLE={'regular': 4096})
+    def test_role_limit(self):
+        self.assertEqual(upload(self.owner, os.urandom(4096)).status_code, 201)
+        response = upload(self.owner, os.urandom(4097))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(EncryptedFile.objects.filter(user=self.owner).count(), 1)
+
+    def test_declared_size(self):
+        for file_size in ('100.0', 'lots', ''):
+            response = upload(self.owner, os.urandom(128), file_size=file_size)
+            self.assertEqual(response.status_code, 400, file_size)
+            self.assertIn('file_size', response.json()['error'])
+        self.assertFalse(EncryptedFile.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'encrypted_files')), [])
+
+        response = upload(self.owner, os.urandom(128), file_size=' 100 ')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(EncryptedFile.objects.get(pk=response.json()['id']).file_size, 100)
+        self.assertEqual(usage.current_usage(self.owner.pk), (100, 1))
+
+class StorageQuotaTests(TestCase):
+    """
+    Uploads are held to the storage quota through the usage counters,
+    which uploads and deletes keep current.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+        # 36 bytes once the encryption overhead is taken off
+        self.file = create_file(self.owner)
+
+    def test_usage_counters(self):
+        self.assertEqual(usage.current_usage(self.owner.pk), (36, 1))
+        first = upload(self.owner, os.urandom(128)).json()['id']
+        second = upload(self.owner, os.urandom(60)).json()['id']
+        self.assertEqual(usage.current_usage(self.owner.pk), (36 + 100 + 32, 3))
+
+        client = client_for(self.owner)
+        self.assertEqual(client.delete(f'/storage/files/{first}', secure=True).status_code, 204)
+        self.assertEqual(usage.current_usage(self.owner.pk), (36 + 32, 2))
+        client.post('/storage/files/delete', {'file_ids': [second, self.file.pk]},
+                    content_type='application/json', secure=True)
+        self.assertEqual(usage.current_usage(self.owner.pk), (0, 0))
+        self.assertEqual(usage.reconcile(dry_run=True), {})
+
+    @override_settings(STORAGE_QUOTA_BY_ROLE={'regular': 136})
+    def test_quota(self):
+        self.assertEqual(upload(self.owner, os.urandom(128)).status_code, 201)
+        self.assertEqual(usage.remaining_quota(self.owner), 0)
+
+        response = upload(self.owner, os.urandom(29))
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(usage.current_usage(self.owner.pk), (136, 2))
+        # The refused blob is not left behind
+        self.assertEqual(len(os.listdir(os.path.join(settings.MEDIA_ROOT, 'encrypted_files'))), 2)
+
+        # Chunked sessions are held to the same quota
+        client = client_for(self.owner)
+        session = client.post('/storage/uploads', {
+            'file_name': 'chunked.bin', 'file_type': 'application/octet-stream', 'file_size': 29,
+            'encrypted_key': base64.b64encode(b'k' * 32).decode(),
+        }, content_type='application/json', secure=True)
+        self.assertEqual(session.status_code, 413)
+
+        # Deleting frees the space again
+        client.delete(f'/storage/files/{self.file.pk}', secure=True)
+        self.assertEqual(upload(self.owner, os.urandom(29)).status_code, 201)
+
+class FileListTests(TestCase):
+    """
+    Keyset pages cover every visible file exactly once, also when upload
+    times tie; filters narrow the list and bad parameters get 400.
+    """
+    def setUp(self):
+        user_cache.clear()
+        self.owner, self.other, self.admin = (
+            User.objects.create_user(username=name, email=f'{name}@example.com', role=role)
+            for name, role in (('owner', 'regular'), ('other', 'regular'), ('admin', 'admin'))
+        )
+        self.start = timezone.now().replace(microsecond=0) - timedelta(days=1)
+        self.files = []
+        for index in range(10):
+            owner = self.owner if index % 2 else self.other
+            file = EncryptedFile.objects.create(
+                user=owner, file_name=f'file-{index}.bin', file_size=index * 10,
+                file_type='text/plain' if index % 3 else 'image/png',
+            )
+            if owner == self.other:
+                file.share_with_user(self.owner)
+            self.files.append(file)
+        # Three runs of equal upload times, the index's copy included
+        for index, file in enumerate(self.files):
+            uploaded_at = self.start + timedelta(hours=index // 4)
+            EncryptedFile.objects.filter(pk=file.pk).update(uploaded_at=uploaded_at)
+            FileVisibility.objects.filter(file=file).update(uploaded_at=uploaded_at)
+            file.uploaded_at = uploaded_at
+
+    def get(self, user, **params):
+        return client_for(user).get('/storage/files', params, secure=True)
+
+    def walk(self, user, limit, **params):
+        ids, cursor = [], None
+        while True:
+            response = self.get(user, limit=limit, **params, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+            self.assertLessEqual(len(page['results']), limit)
+            ids += [file['id'] for file in page['results']]
+            cursor = page['next_cursor']
+            if cursor is None:
+                return ids
+
+    def expected(self, files):
+        return [file.pk for file in sorted(files, key=lambda file: (file.uploaded_at, file.pk), reverse=True)]
+
+    def test_pages(self):
+        for user in (self.owner, self.admin):
+            for limit in (1, 3, 4):
+                self.assertEqual(self.walk(user, limit), self.expected(self.files), (user.username, limit))
+        self.assertEqual(self.walk(self.other, 3), self.expected(self.files[::2]))
+
+    def test_filters(self):
+        own = [file for file in self.files if file.user_id == self.owner.pk]
+        self.assertEqual(self.walk(self.owner, 2, owner=self.owner.pk), self.expected(own))
+        self.assertEqual(self.walk(self.admin, 2, owner=self.other.pk),
+                         self.expected(set(self.files) - set(own)))
+
+        png = [file for file in self.files if file.file_type == 'image/png']
+        self.assertEqual(self.walk(self.owner, 2, file_type='image/png'), self.expected(png))
+
+        after, before = self.start + timedelta(hours=1), self.start + timedelta(hours=2)
+        self.assertEqual(
+            self.walk(self.owner, 2, uploaded_after=after.isoformat(), uploaded_before=before.isoformat()),
+            self.expected(self.files[4:8])
+        )
+        self.assertEqual(self.walk(self.admin, 2, min_size=30, max_size=50), self.expected(self.files[3:6]))
+        # Unpaginated lists filter the same way
+        response = self.get(self.owner, owner=self.owner.pk, file_type='text/plain')
+        self.assertEqual([file['id'] for file in response.json()],
+                         self.expected(file for file in own if file.file_type == 'text/plain'))
+
+    def test_bad_parameters(self):
+        for params in ({'cursor': 'not-a-cursor'}, {'cursor': base64.urlsafe_b64encode(b'{"t": 1}').decode()},
+                       {'limit': 0}, {'limit': 'ten'}, {'owner': 'me'}, {'min_size': 'big'},
+                       {'uploaded_after': 'yesterday'}):
+            for user in (self.owner, self.admin):
+                response = self.get(user, **params)
+                self.assertEqual(response.status_code, 400, params)
+                self.assertIn('error', response.json())
+
+class VisibilityIndexCommandTests(TestCase):
+    """
+    visibility_index --verify reports each kind of drift without touching
+    the index; a plain run rebuilds it from the files and shares.
+    """
+    def setUp(self):
+        self.owner, self.recipient, self.stranger = (
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('owner', 'recipient', 'stranger')
+        )
+        self.files = [
+            EncryptedFile.objects.create(user=self.owner, file_name=f'{index}.bin', file_size=0)
+            for index in range(3)
+        ]
+        for file in self.files:
+            file.share_with_user(self.recipient, 'download')
+
+    def run_command(self, *args):
+        stdout = StringIO()
+        try:
+            call_command('visibility_index', *args, stdout=stdout)
+        except CommandError:
+            return False, stdout.getvalue()
+        return True, stdout.getvalue()
+
+    def index(self):
+        return sorted(FileVisibility.objects.values_list('user_id', 'file_id', 'permission'))
+
+    def test_verify_and_rebuild(self):
+        consistent = self.index()
+        self.assertEqual(self.run_command('--verify'), (True, '\n'.join([
+            'missing_owner_rows: 0', 'missing_share_rows: 0', 'stale_owner_rows: 0', 'stale_share_rows: 0',
+            'Visibility index is consistent', ''
+        ])))
+
+        FileVisibility.objects.filter(file=self.files[0], permission='owner').delete()
+        FileVisibility.objects.filter(file=self.files[1], user=self.recipient).update(permission='view')
+        FileVisibility.objects.filter(file=self.files[2], permission='owner').update(user=self.stranger)
+        FileVisibility.objects.create(user=self.stranger, file=self.files[0], permission='view',
+                                      uploaded_at=self.files[0].uploaded_at)
+        corrupted = self.index()
+
+        ok, output = self.run_command('--verify')
+        self.assertFalse(ok)
+        for line in ('missing_owner_rows: 2', 'missing_share_rows: 1', 'stale_owner_rows: 1', 'stale_share_rows: 2'):
+            self.assertIn(line, output.splitlines())
+        self.assertEqual(self.index(), corrupted)
+
+        before = visibility.version(self.owner.pk)[0]
+        ok, output = self.run_command('--batch-size', '2')
+        self.assertTrue(ok, output)
+        self.assertIn('Rebuilt visibility index with 6 rows', output)
+        self.assertEqual(self.index(), consistent)
+        self.assertGreater(visibility.version(self.owner.pk)[0], before)
+        self.assertTrue(self.run_command('--verify')[0])
+
+class AccessCacheTests(SimpleTestCase):
+    """
+    Lookups are counted in the metrics registry by backend and result; the
+    per-process cache keeps grants but not denials.
+    """
+    def setUp(self):
+        metrics_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(metrics_dir.cleanup)
+        self.enterContext(override_settings(METRICS_DIR=metrics_dir.name))
+        access_cache.clear()
+        self.addCleanup(access_cache.clear)
+
+    def lookups(self):
+        series = metrics.collect().get('secureshare_access_cache_lookups_total', {})
+        return {dict(labels)['backend'] + ' ' + dict(labels)['result']: value for labels, value in series.items()}
+
+    def count(self, lookups):
+        before = self.lookups()
+        lookups()
+        after = self.lookups()
+        return {key: value - before.get(key, 0) for key, value in after.items() if value != before.get(key, 0)}
+
+    def test_local(self):
+        def lookups():
+            for _ in range(3):
+                access_cache.get(1, 2, lambda: 'read')
+                access_cache.get(1, 3, lambda: None)
+
+        self.assertEqual(self.count(lookups), {'local hit': 2, 'local miss': 4})
+
+    @override_settings(ACCESS_CACHE_BACKEND='default')
+    def test_shared(self):
+        caches['default'].clear()
+
+        def lookups():
+            for _ in range(3):
+                access_cache.get(1, 2, lambda: 'read')
+                access_cache.get(1, 3, lambda: None)
+
+        self.assertEqual(self.count(lookups), {'shared hit': 4, 'shared miss': 2})
+
+class BulkShareTests(TestCase):
+    """
+    Bulk shares report a status for every file and recipient pair and
+    create only the pairs that can be shared.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner, self.recipient = (
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('owner', 'recipient')
+        )
+        self.file = create_file(self.owner)
+
+    def share(self, file_ids, emails, **data):
+        return client_for(self.owner).post('/storage/share/bulk', {
+            'file_ids': file_ids, 'shared_with_emails': emails, **data
+        }, content_type='application/json', secure=True)
+
+    def test_statuses(self):
+        other = create_file(self.recipient)
+        shared = create_file(self.owner)
+        shared.share_with_user(self.recipient)
+        User.objects.bulk_create([
+            User(username='twin-1', email='twin@example.com'),
+            User(username='twin-2', email='twin@example.com'),
+        ])
+
+        response = self.share(
+            [self.file.pk, shared.pk, other.pk, 999999],
+            ['recipient@example.com', 'nobody@example.com', 'twin@example.com']
+        )
+        self.assertEqual(response.status_code, 200)
+        statuses = {(row['file_id'], row['email']): row['status'] for row in response.json()['results']}
+        self.assertEqual(statuses, {
+            (self.file.pk, 'recipient@example.com'): 'shared',
+            (self.file.pk, 'nobody@example.com'): 'user_not_found',
+            (self.file.pk, 'twin@example.com'): 'multiple_users',
+            (shared.pk, 'recipient@example.com'): 'already_shared',
+            (shared.pk, 'nobody@example.com'): 'user_not_found',
+            (shared.pk, 'twin@example.com'): 'multiple_users',
+            (other.pk, 'recipient@example.com'): 'forbidden',
+            (other.pk, 'nobody@example.com'): 'forbidden',
+            (other.pk, 'twin@example.com'): 'forbidden',
+            (999999, 'recipient@example.com'): 'file_not_found',
+            (999999, 'nobody@example.com'): 'file_not_found',
+            (999999, 'twin@example.com'): 'file_not_found',
+        })
+        self.assertEqual(response.json()['summary'], {
+            'shared': 1, 'user_not_found': 2, 'multiple_users': 2,
+            'already_shared': 1, 'forbidden': 3, 'file_not_found': 3,
+        })
+
+        # The new share is visible like one made one at a time
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.is_shared)
+        self.assertEqual(self.file.can_access(self.recipient), 'view')
+        listed = client_for(self.recipient).get('/storage/files', secure=True).json()
+        self.assertEqual({file['id'] for file in listed}, {self.file.pk, shared.pk, other.pk})
+
+    @override_settings(BULK_SHARE_MAX_PAIRS=3)
+    def test_pair_limit(self):
+        response = self.share([self.file.pk, self.file.pk + 1], ['a@example.com', 'b@example.com'])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FileShare.objects.exists())
+
+class BatchDownloadTests(TestCase):
+    """
+    The archive holds a manifest and every requested blob under a unique
+    name, in request order; any file the caller cannot see fails it all.
+    """
+    def setUp(self):
+        use_temporary_media(self, DOWNLOAD_CHUNK_SIZE=1000)
+        user_cache.clear()
+        self.owner, self.recipient = (
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('owner', 'recipient')
+        )
+        self.blobs = {}
+        self.files = [self.create_file(name, os.urandom(size))
+                      for name, size in (('report.pdf', 2500), ('report.pdf', 10), ('../notes/a.txt', 0))]
+        self.files[0].share_with_user(self.recipient)
+
+    def create_file(self, file_name, blob):
+        file = create_file(self.owner, blob, file_name=file_name, file_type='application/pdf',
+                           sha256=hashlib.sha256(blob).hexdigest())
+        self.blobs[file.pk] = blob
+        return file
+
+    def download(self, user, file_ids):
+        return client_for(user).post('/storage/download/batch', {'file_ids': file_ids},
+                                     content_type='application/json', secure=True)
+
+    def test_archive(self):
+        files = [self.files[2], self.files[0], self.files[1]]
+        response = self.download(self.owner, [file.pk for file in files])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="files.zip"')
+
+        with zipfile.ZipFile(io.BytesIO(read_body(response))) as archive:
+            self.assertIsNone(archive.testzip())
+            names = [f'{files[0].pk}-a.txt', f'{files[1].pk}-report.pdf', f'{files[2].pk}-report.pdf']
+            self.assertEqual(archive.namelist(), ['manifest.json'] + names)
+            manifest = json.loads(archive.read('manifest.json'))
+            for name, file in zip(names, files):
+                self.assertEqual(archive.read(name), self.blobs[file.pk])
+
+        self.assertEqual([entry['name'] for entry in manifest], names)
+        for entry, file in zip(manifest, files):
+            self.assertEqual(entry, {
+                'id': file.pk,
+                'name': f'{file.pk}-{os.path.basename(file.file_name)}',
+                'file_name': file.file_name,
+                'file_type': 'application/pdf',
+                'file_size': file.file_size,
+                'sha256': hashlib.sha256(self.blobs[file.pk]).hexdigest(),
+                'encrypted_key': base64.b64encode(bytes(file.key_envelopes.get().wrapped_key)).decode(),
+            })
+
+    def test_unavailable_files(self):
+        shared, unshared = self.files[0].pk, self.files[1].pk
+        self.assertEqual(self.download(self.recipient, [shared]).status_code, 200)
+
+        response = self.download(self.recipient, [shared, unshared, 10 ** 6])
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.json()['file_ids'], [unshared, 10 ** 6])
+
+class DownloadOffloadTests(TestCase):
+    """
+    With DOWNLOAD_OFFLOAD set, downloads answer with the front proxy's
+    header and the usual download headers, and no body.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+        self.file = create_file(self.owner, os.urandom(100), file_name='report.pdf', file_type='application/pdf')
+
+    def download(self):
+        return client_for(self.owner).get(f'/storage/download/{self.file.pk}', secure=True, HTTP_RANGE='bytes=0-9')
+
+    def assertOffloaded(self, response, header, value):
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response[header], value)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="report.pdf"')
+        self.assertEqual(response['Encrypted-Key'], base64.b64encode(b'k' * 32).decode())
+        # Ranges and validators are left to the proxy
+        self.assertNotIn('Content-Range', response)
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-accel-redirect', DOWNLOAD_OFFLOAD_PREFIX='/internal/')
+    def test_x_accel_redirect(self):
+        self.assertOffloaded(self.download(), 'X-Accel-Redirect', f'/internal/{self.file.encrypted_file.name}')
+
+    @override_settings(DOWNLOAD_OFFLOAD='x-sendfile')
+    def test_x_sendfile(self):
+        self.assertOffloaded(self.download(), 'X-Sendfile', self.file.encrypted_file.path)
+
+    def test_unknown_mode(self):
+        with self.assertRaisesMessage(ValueError, 'Unknown DOWNLOAD_OFFLOAD mode: x-nope'):
+            offload_response(self.file, b'k' * 32, 'x-nope')
+        with override_settings(DOWNLOAD_OFFLOAD='x-nope'):
+            self.assertEqual(self.download().status_code, 500)
+
+class AsyncURLConf:
+    # The storage routes served by the async views, as with ASYNC_VIEWS=1
+    urlpatterns = [path('storage/', include(storage_urlpatterns(async_views=True)))]
+
+@override_settings(ROOT_URLCONF=AsyncURLConf)
+class AsyncViewTests(TestCase):
+    """
+    The async views serve the same responses as the sync ones, with
+    bodies streamed by async iterators.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        user_cache.clear()
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+        self.blob = bytes(range(64))
+        self.file = create_file(self.owner, self.blob)
+        token = CustomTokenObtainPairSerializer.get_token(self.owner).access_token
+        self.headers = {'Authorization': f'Bearer {token}'}
+
+    async def request(self, method, path, *args, headers=None, **kwargs):
+        return await getattr(self.async_client, method)(
+            path, *args, headers={**self.headers, **(headers or {})}, secure=True, **kwargs
+        )
+
+    async def body(self, response):
+        self.assertTrue(response.is_async)
+        return b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_download(self):
+        response = await self.request('get', f'/storage/download/{self.file.pk}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.body(response), self.blob)
+
+    async def test_single_range(self):
+        response = await self.request('get', f'/storage/download/{self.file.pk}', headers={'Range': 'bytes=10-19'})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/64')
+        self.assertEqual(await self.body(response), self.blob[10:20])
+
+    async def test_multiple_ranges(self):
+        response = await self.request('get', f'/storage/download/{self.file.pk}', headers={'Range': 'bytes=0-3,60-'})
+        self.assertEqual(response.status_code, 206)
+        content_type, _, boundary = response['Content-Type'].partition('; boundary=')
+        self.assertEqual(content_type, 'multipart/byteranges')
+        body = await self.body(response)
+        self.assertEqual(len(body), int(response['Content-Length']))
+        parts = [part for part in body.split(b'--' + boundary.encode()) if part.strip(b'\r\n-')]
+        self.assertEqual(len(parts), 2)
+        for part, (first, last) in zip(parts, ((0, 3), (60, 63))):
+            headers, _, data = part.partition(b'\r\n\r\n')
+            self.assertIn(f'Content-Range: bytes {first}-{last}/64'.encode(), headers)
+            self.assertEqual(data.rstrip(b'\r\n'), self.blob[first:last + 1])
+
+    async def test_batch_download(self):
+        response = await self.request('post', '/storage/download/batch', {'file_ids': [self.file.pk]},
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(await self.body(response))) as archive:
+            self.assertIsNone(archive.testzip())
+            self.assertEqual(archive.namelist(), ['manifest.json', f'{self.file.pk}-blob.bin'])
+            self.assertEqual(archive.read(f'{self.file.pk}-blob.bin'), self.blob)
+
+        response = await self.request('post', '/storage/download/batch', {'file_ids': [self.file.pk + 1]},
+                                      content_type='application/json')
+        self.assertEqual(response.status_code, 404)
+
+    async def test_file_list(self):
+        response = await self.request('get', '/storage/files')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([file['id'] for file in response.json()], [self.file.pk])
+
+        response = await self.request('get', '/storage/files', headers={'If-None-Match': response['ETag']})
+        self.assertEqual(response.status_code, 304)
+
+    async def test_chunk_upload(self):
+        blob = os.urandom(50)
+        response = await self.request('post', '/storage/uploads', {
+            'file_name': 'chunked.bin',
+            'file_type': 'application/octet-stream',
+            'file_size': 50,
+            'chunk_size': 40,
+            'encrypted_key': base64.b64encode(b'k' * 32).decode(),
+        }, content_type='application/json')
+        session_id = response.json()['id']
+
+        response = await self.request('put', f'/storage/uploads/{session_id}/chunks/1', blob[:5],
+                                      content_type='application/octet-stream')
+        self.assertEqual(response.status_code, 400)
+        for index, chunk in enumerate((blob[:40], blob[40:])):
+            response = await self.request('put', f'/storage/uploads/{session_id}/chunks/{index}', chunk,
+                                          content_type='application/octet-stream')
+            self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['complete'])
+
+        response = await self.request('post', f'/storage/uploads/{session_id}/complete')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['file_size'], 50 - ENCRYPTION_OVERHEAD)
+
+    async def test_upload(self):
+        blob = os.urandom(128)
+
+        async def upload(file_size):
+            return await self.request('post', '/storage/upload', {
+                'file': SimpleUploadedFile('blob.bin', blob),
+                'encrypted_key': SimpleUploadedFile('key', b'k' * 32),
+                'file_name': 'blob.bin',
+                'file_type': 'application/octet-stream',
+                'file_size': file_size,
+            })
+
+        response = await upload('lots')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('file_size', response.json()['error'])
+
+        response = await upload(128 - ENCRYPTION_OVERHEAD)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['file_size'], 128 - ENCRYPTION_OVERHEAD)
+        self.assertEqual(await sync_to_async(usage.current_usage)(self.owner.pk), (36 + 100, 2))
+
+class ShareableLinkRedemptionTests(TransactionTestCase):
+    """
+    Redemption is one conditional UPDATE, so however many requests race
+    for a one-time link exactly one of them gets the share.
+    """
+    redeemers = 200
+    threads = 32
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner', email='owner@example.com', password='owner-password-123'
+        )
+        self.file = EncryptedFile.objects.create(
+            user=self.owner,
+            file_name='shared.bin',
+            file_type='application/octet-stream',
+            file_size=1,
+            encrypted_file='encrypted_files/shared.bin',
+        )
+        self.link = ShareableLink.objects.create(
+            file=self.file,
+            created_by=self.owner,
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+
+        # One hash for everyone; create_user would hash per user
+        password = make_password('redeemer-password-123')
+        User.objects.bulk_create(
+            User(username=f'redeemer{i}', email=f'redeemer{i}@example.com', password=password)
+            for i in range(self.redeemers)
+        )
+        self.tokens = [
+            str(CustomTokenObtainPairSerializer.get_token(user).access_token)
+            for user in User.objects.filter(username__startswith='redeemer')
+        ]
+
+    def redeem(self, token, start=None):
+        # Exceptions are reported through a process-wide signal, so a client
+        # that raised them would also raise other threads' errors
+        client = Client(raise_request_exception=False)
+        if start is not None:
+            start.wait()
+        try:
+            # The in-memory SQLite test database uses a shared cache, which
+            # fails contended statements with "table is locked" instead of
+            # waiting; the view's transaction is rolled back and re-sent
+            for _ in range(100):
+                response = client.get(
+                    f'/storage/share/link/{self.link.token}',
+                    secure=True,
+                    HTTP_AUTHORIZATION=f'Bearer {token}'
+                )
+                if response.status_code != 500:
+                    break
+                time.sleep(0.01)
+            return response.status_code
+        finally:
+            connection.close()
+
+    def test_concurrent_redemptions_share_once(self):
+        # Every redemption is queued before any is let through
+        start = threading.Event()
+        with ThreadPoolExecutor(self.threads) as pool:
+            futures = [pool.submit(self.redeem, token, start) for token in self.tokens]
+            start.set()
+            statuses = [future.result() for future in futures]
+
+        self.assertEqual(statuses.count(201), 1)
+        self.assertEqual(statuses.count(403), self.redeemers - 1)
+        self.assertEqual(FileShare.objects.filter(file=self.file).count(), 1)
+        self.link.refresh_from_db()
+        self.assertTrue(self.link.is_used)
+        self.file.refresh_from_db()
+        self.assertTrue(self.file.is_shared)
+
+    def test_expired_link_is_rejected(self):
+        ShareableLink.objects.filter(pk=self.link.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        status = self.redeem(self.tokens[0])
+
+        self.assertEqual(status, 403)
+        self.assertFalse(FileShare.objects.exists())
+
+    def test_unknown_link_is_not_found(self):
+        response = Client().get(
+            f'/storage/share/link/{uuid.uuid4()}',
+            secure=True,
+            HTTP_AUTHORIZATION=f'Bearer {self.tokens[0]}'
+        )
+        self.assertEqual(response.status_code, 404)
+
+class SweeperTests(TestCase):
+    """
+    Links are swept once expired, used or not, in batches of the given
+    size and no faster than the given rate; requests only start a sweep,
+    on a background thread.
+    """
+    def setUp(self):
+        user_cache.clear()
+        self.owner, self.recipient = (
+            User.objects.create_user(username=name, email=f'{name}@example.com')
+            for name in ('owner', 'recipient')
+        )
+        self.file = EncryptedFile.objects.create(user=self.owner, file_name='linked.bin', file_size=0)
+        self.now = timezone.now()
+
+    def create_links(self, count, expires_in, is_used=False):
+        return ShareableLink.objects.bulk_create([
+            ShareableLink(file=self.file, created_by=self.owner, is_used=is_used,
+                          expires_at=self.now + expires_in)
+            for _ in range(count)
+        ])
+
+    def redeem(self, link):
+        return client_for(self.recipient).get(f'/storage/share/link/{link.token}', secure=True)
+
+    def test_batches(self):
+        self.create_links(7, timedelta(hours=-1))
+        live = self.create_links(2, timedelta(hours=1))
+        result = sweeper.sweep_target('expired_links', now=self.now, batch_size=3, max_batches=2)
+        self.assertEqual((result['rows'], result['batches']), (6, 2))
+        result = sweeper.sweep_target('expired_links', now=self.now, batch_size=3)
+        self.assertEqual((result['rows'], result['batches']), (1, 1))
+        self.assertEqual(list(ShareableLink.objects.all()), live)
+
+    def test_rate_limit(self):
+        self.create_links(10, timedelta(hours=-1))
+        with mock.patch('storage.sweeper.time.sleep') as sleep:
+            result = sweeper.sweep_target('expired_links', now=self.now, batch_size=2, max_rows_per_second=4)
+        self.assertEqual((result['rows'], result['batches']), (10, 6))
+        # After each full batch the sweep waits until the rows deleted so
+        # far fit the rate; the clock stands still while sleep is mocked
+        delays = [call.args[0] for call in sleep.call_args_list]
+        self.assertEqual(len(delays), 5)
+        for batches, delay in enumerate(delays, 1):
+            self.assertAlmostEqual(delay, batches * 2 / 4, delta=0.05)
+
+    def test_used_links_are_kept_until_they_expire(self):
+        used = self.create_links(1, timedelta(hours=1), is_used=True)[0]
+        expired = self.create_links(1, timedelta(hours=-1), is_used=True)[0]
+        self.assertEqual(self.redeem(used).status_code, 403)
+        self.assertEqual(self.redeem(expired).status_code, 403)
+
+        result = sweeper.sweep_target('used_links', now=self.now)
+        self.assertEqual(result['rows'], 1)
+        # A redeemed link says so while it lasts; once swept it is unknown
+        self.assertEqual(self.redeem(used).status_code, 403)
+        self.assertEqual(self.redeem(expired).status_code, 404)
+
+    def test_background_sweep(self):
+        sweeper._last_sweep = 0.0
+        self.addCleanup(setattr, sweeper, '_last_sweep', 0.0)
+        threads = []
+        with mock.patch('storage.sweeper.sweep', lambda **options: threads.append(threading.current_thread())):
+            self.assertTrue(sweeper.maybe_sweep())
+            # Once per SWEEP_INTERVAL
+            self.assertFalse(sweeper.maybe_sweep())
+            sweeper._executor.submit(lambda: None).result()
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+        sweeper._last_sweep = 0.0
+        with mock.patch('storage.sweeper.sweep', side_effect=RuntimeError('database is locked')), \
+                self.assertLogs('storage.sweeper', 'ERROR') as logs:
+            self.assertTrue(sweeper.maybe_sweep())
+            sweeper._executor.submit(lambda: None).result()
+        self.assertIn('Sweep failed', logs.output[0])
+
+class ShareCascadeTests(TestCase):
+    """
+    Shares deleted with their file or with a user cost a fixed number of
+    queries, and still move every affected list to a new version.
+    """
+    def setUp(self):
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def share_file(self, recipients):
+        file = EncryptedFile.objects.create(user=self.owner, file_name='shared.bin',
+                                            file_type='application/octet-stream', file_size=0)
+        for recipient in recipients:
+            file.share_with_user(recipient)
+        return file
+
+    def recipients(self, count):
+        return User.objects.bulk_create([
+            User(username=f'recipient-{uuid.uuid4().hex}', email=f'{uuid.uuid4().hex}@example.com')
+            for _ in range(count)
+        ])
+
+    def versions(self, users):
+        return [visibility.version(user.pk)[0] for user in users]
+
+    def test_file_deletion(self):
+        counts = []
+        for size in (1, 10):
+            recipients = self.recipients(size)
+            file = self.share_file(recipients)
+            before = self.versions([self.owner, *recipients])
+            with QueryLog() as log:
+                file.delete()
+            counts.append(len(log))
+            self.assertTrue(all(new > old for old, new in zip(before, self.versions([self.owner, *recipients]))))
+            self.assertFalse(FileVisibility.objects.filter(file_id=file.pk).exists())
+        self.assertEqual(counts[0], counts[1])
+
+    def test_recipient_deletion(self):
+        counts = []
+        for size in (1, 10):
+            recipient, = self.recipients(1)
+            files = [self.share_file([recipient]) for _ in range(size)]
+            before, = self.versions([self.owner])
+            with QueryLog() as log:
+                recipient.delete()
+            counts.append(len(log))
+            self.assertGreater(self.versions([self.owner])[0], before)
+            self.assertEqual(FileVisibility.objects.filter(file__in=files).count(), size)
+        self.assertEqual(counts[0], counts[1])
+
+class BlobReclaimTests(TestCase):
+    """
+    scan_orphans finds blobs nothing refers to, nested ones included, and
+    reclaiming unlinks exactly those and the blobs of deleted files.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        self.owner = User.objects.create_user(username='owner', email='owner@example.com')
+
+    def write(self, name, size=10, age=timedelta(days=1)):
+        path = os.path.join(settings.MEDIA_ROOT, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as blob:
+            blob.write(os.urandom(size))
+        mtime = time.time() - age.total_seconds()
+        os.utime(path, (mtime, mtime))
+        return name
+
+    def create_file(self, name):
+        return EncryptedFile.objects.create(user=self.owner, file_name='blob.bin', file_size=0,
+                                            encrypted_file=self.write(name))
+
+    def blobs(self):
+        return {
+            os.path.relpath(os.path.join(directory, name), settings.MEDIA_ROOT)
+            for directory, _, names in os.walk(settings.MEDIA_ROOT) for name in names
+        }
+
+    def test_orphans_and_deleted_files(self):
+        kept = self.create_file('encrypted_files/kept.bin')
+        self.create_file('encrypted_files/deleted.bin').delete()
+        self.write('encrypted_files/legacy/2023/orphan.bin', size=30)
+        self.write('encrypted_files/fresh.bin', age=timedelta(seconds=0))
+        self.write('upload_sessions/partial/data')
+        # Queued by mistake, but still in use
+        ReclaimableBlob.objects.create(name=kept.encrypted_file.name)
+
+        self.assertEqual(list(reclaim.scan_orphans(batch_size=2)), [('encrypted_files/legacy/2023/orphan.bin', 30)])
+
+        stdout = StringIO()
+        call_command('scan_orphans', '--reclaim', '--list', '--batch-size', '2', stdout=stdout)
+        self.assertIn('encrypted_files/legacy/2023/orphan.bin 30', stdout.getvalue())
+        self.assertEqual(self.blobs(), {
+            'encrypted_files/kept.bin', 'encrypted_files/fresh.bin', 'upload_sessions/partial/data',
+        })
+        self.assertFalse(ReclaimableBlob.objects.exists())
+        self.assertEqual(list(reclaim.scan_orphans()), [])
+
+class DatasetTests(TestCase):
+    """
+    A generated dataset is one the application could have built itself:
+    the visibility index and usage counters match its files and shares.
+    """
+    def test_generated_dataset_is_consistent(self):
+        results = dataset.generate(users=20, files=50, shares=40, links=10, blobs='none', seed=23, batch_size=7)
+        self.assertEqual(
+            {phase: rows for phase, (rows, _) in results.items() if phase in ('users', 'files', 'shares', 'links')},
+            {'users': 20, 'files': 50, 'shares': 40, 'links': 10}
+        )
+        self.assertEqual(
+            (User.objects.count(), EncryptedFile.objects.count(), FileShare.objects.count(),
+             ShareableLink.objects.count()),
+            (20, 50, 40, 10)
+        )
+
+        stdout = StringIO()
+        call_command('visibility_index', '--verify', stdout=stdout)
+        self.assertIn('Visibility index is consistent', stdout.getvalue())
+
+        stdout = StringIO()
+        call_command('reconcile_usage', '--dry-run', stdout=stdout)
+        self.assertEqual(stdout.getvalue(), '0 drifted counters found\n')
+
+class ListFixtures:
+    """
+    An owner, a recipient and an admin, the owner's first file, and helpers
+    to grow the owner's files or the first file's shares.
+    """
+    def setUp(self):
+        use_temporary_media(self)
+        # Row ids are reused across tests, the cached rows are not
+        user_cache.clear()
+        password = make_password('budget-password-123')
+        self.owner, self.recipient, self.admin = User.objects.bulk_create([
+            User(username='owner', email='owner@example.com', password=password),
+            User(username='recipient', email='recipient@example.com', password=password),
+            User(username='admin', email='admin@example.com', password=password, role='admin'),
+        ])
+        self.file = create_file(self.owner)
+        self.file_ids = [self.file.pk]
+
+    def grow_files(self, count):
+        # The owner's files, each shared with the recipient
+        for _ in range(count - len(self.file_ids)):
+            file = create_file(self.owner)
+            file.share_with_user(self.recipient)
+            self.file_ids.append(file.pk)
+
+    def grow_shares(self, count):
+        users = User.objects.bulk_create([
+            User(username=f'recipient-{uuid.uuid4().hex}', email=f'{uuid.uuid4().hex}@example.com')
+            for _ in range(count - self.file.shares.count())
+        ])
+        for user in users:
+            self.file.share_with_user(user)
+
+    def get(self, user, path):
+        client = client_for(user)
+        return lambda: client.get(path, secure=True)
+
+class EndpointQueryBudgetTests(QueryBudgetMixin, ListFixtures, TestCase):
+    """
+    Listing and share endpoints run a fixed number of queries however many
+    files or shares they return. Non-admin file lists read the visibility
+    version first.
+    """
+    def setUp(self):
+        super().setUp()
+        # Authentication is served from the user cache in a running worker
+        for user in (self.owner, self.recipient, self.admin):
+            user_cache.get(user.pk)
+
+    def test_file_list(self):
+        self.assertQueryBudget(self.get(self.owner, '/storage/files'), self.grow_files, budget=2)
+
+    def test_file_list_page(self):
+        self.assertQueryBudget(self.get(self.owner, '/storage/files?limit=50'), self.grow_files, budget=2)
+
+    def test_file_list_shared(self):
+        self.assertQueryBudget(self.get(self.recipient, '/storage/files'), self.grow_files, budget=2)
+
+    def test_file_list_admin(self):
+        self.assertQueryBudget(self.get(self.admin, '/storage/files'), self.grow_files, budget=1)
+
+    def test_share_list(self):
+        self.assertQueryBudget(self.get(self.owner, f'/storage/share/{self.file.pk}'), self.grow_shares, budget=2)
+
+    def test_batch_download(self):
+        client = client_for(self.owner)
+
+        def download():
+            return client.post('/storage/download/batch', {'file_ids': self.file_ids},
+                               content_type='application/json', secure=True)
+
+        self.assertQueryBudget(download, self.grow_files, budget=2)
+
+class ConditionalListTests(ListFixtures, TestCase):
+    """
+    File and share lists answer If-None-Match from the visibility version,
+    without listing, until a change the user would see.
+    """
+    def assertNotModified(self, request, etag):
+        with QueryLog() as log:
+            response = request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        # The version read only
+        self.assertEqual(len(log), 1, log.report())
+
+    def test_file_list_not_modified(self):
+        client = client_for(self.recipient)
+        request = lambda **headers: client.get('/storage/files', secure=True, **headers)
+        self.grow_files(2)
+        etag = request()['ETag']
+        self.assertTrue(etag.startswith('W/'))
+        self.assertNotModified(request, etag)
+
+        # A new share moves the recipient's version on
+        self.grow_files(3)
+        response = request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('Last-Modified', response)
+
+        # So does the owner deleting a shared file
+        etag = response['ETag']
+        EncryptedFile.objects.get(pk=self.file_ids[-1]).delete()
+        self.assertEqual(request(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_share_list_not_modified(self):
+        client = client_for(self.owner)
+        request = lambda **headers: client.get(f'/storage/share/{self.file.pk}', secure=True, **headers)
+        self.grow_shares(1)
+        etag = request()['ETag']
+        self.assertNotModified(request, etag)
+
+        self.file.shares.first().delete()
+        response = request(HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [])
+
+    def test_admin_file_list_is_unconditional(self):
+        response = client_for(self.admin).get('/storage/files', secure=True)
+        self.assertNotIn('ETag', response)
@@ -0,0 +1,289 @@
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.db import transaction
+from django.utils import timezone
+from .models import EncryptedFile, KeyEnvelope, UploadSession
+from .usage import check_quota, remaining_quota
+from datetime import timedelta
+import hashlib
+import os
+import shutil
+import time
+
+SESSION_ROOT = 'upload_sessions'
+DATA_FILE = 'data.bin'
+# Bytes copied from the request stream per read
+COPY_BLOCK_SIZE = 64 * 1024
+# Sessions are swept from request handlers at most this often per process
+SWEEP_INTERVAL = 300
+
+# AES-GCM blobs carry a 12-byte IV and a 16-byte tag on top of the
+# plaintext size that clients declare as file_size
+ENCRYPTION_OVERHEAD = 12 + 16
+# Room for the form fields, wrapped key and multipart framing that come
+# with the blob in an upload body
+FORM_OVERHEAD = 64 * 1024
+
+_last_sweep = 0.0
+
+class ChunkSizeMismatch(Exception):
+    pass
+
+class UploadTooLarge(Exception):
+    pass
+
+def max_upload_size(user):
+    # None means unlimited
+    limits = getattr(settings, 'UPLOAD_MAX_SIZE_BY_ROLE', {})
+    return limits.get(getattr(user, 'role', None))
+
+def quota_upload_size(user):
+    # Largest blob the remaining storage quota admits; None means unlimited
+    remaining = remaining_quota(user)
+    if remaining is None:
+        return None
+    return max(remaining, 0) + ENCRYPTION_OVERHEAD
+
+def matches_declared_size(stored_size, declared_size):
+    return 0 <= stored_size - declared_size <= ENCRYPTION_OVERHEAD
+
+def plaintext_size(stored_size):
+    # The file_size recorded for a blob whose size is known exactly
+    return max(stored_size - ENCRYPTION_OVERHEAD, 0)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data:
+        while block := data.read(COPY_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+class AssembledUpload(File):
+    # FileSystemStorage moves files exposing temporary_file_path() instead
+    # of copying them, so finalizing a session is a rename.
+    def temporary_file_path(self):
+        return self.file.name
+
+class StoredUploadedFile(UploadedFile):
+    # Upload that already lives at its final storage name
+    def __init__(self, file, name, storage_name, sha256, content_type, size, charset, content_type_extra=None):
+        super().__init__(file, name, content_type, size, charset, content_type_extra)
+        self.storage_name = storage_name
+        self.sha256 = sha256
+
+class EncryptedBlobUploadHandler(FileUploadHandler):
+    """
+    Writes the multipart `file` field straight into encrypted_files/ while
+    counting bytes and hashing them, so the upload is stored exactly once.
+    Other file fields fall through to Django's default handlers.
+    """
+    field = 'file'
+
+    def __init__(self, request=None, max_size=None):
+        super().__init__(request)
+        self.max_size = max_size
+        self.storage_name = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name != self.field:
+            return
+
+        upload_to = EncryptedFile._meta.get_field('encrypted_file')
+        name = upload_to.generate_filename(None, self.file_name)
+        os.makedirs(os.path.dirname(default_storage.path(name)), exist_ok=True)
+        while True:
+            self.storage_name = default_storage.get_available_name(name)
+            try:
+                fd = os.open(
+                    default_storage.path(self.storage_name),
+                    os.O_RDWR | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0),
+                    0o666
+                )
+                break
+            except FileExistsError:
+                continue
+
+        self.file = os.fdopen(fd, 'wb+')
+        self.digest = hashlib.sha256()
+        self.size = 0
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.field_name != self.field:
+            return raw_data
+
+        self.size += len(raw_data)
+        if self.max_size is not None and self.size > self.max_size:
+            self.discard()
+            raise UploadTooLarge(f'Upload exceeds the {self.max_size} byte limit')
+        self.digest.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        if self.field_name != self.field:
+            return None
+
+        self.file.flush()
+        self.file.seek(0)
+        return StoredUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            storage_name=self.storage_name,
+            sha256=self.digest.hexdigest(),
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra
+        )
+
+    def upload_interrupted(self):
+        self.discard()
+
+    def discard(self):
+        if self.storage_name is None:
+            return
+        if hasattr(self, 'file'):
+            self.file.close()
+        default_storage.delete(self.storage_name)
+        self.storage_name = None
+
+def record_upload(user, data, file_size, file, wrapped_key):
+    # The file row and its key envelope are written together or not at
+    # all; file_size is the declared size, already parsed and checked
+    with transaction.atomic():
+        check_quota(user, file_size)
+        encrypted_file = EncryptedFile.objects.create(
+            user=user,
+            file_name=data['file_name'],
+            encrypted_file=file.storage_name,
+            sha256=file.sha256,
+            file_type=data['file_type'],
+            file_size=file_size
+        )
+        KeyEnvelope.objects.create(file=encrypted_file, wrapped_key=wrapped_key)
+    return encrypted_file
+
+def session_dir(session):
+    return default_storage.path(os.path.join(SESSION_ROOT, str(session.pk)))
+
+def data_path(session):
+    return os.path.join(session_dir(session), DATA_FILE)
+
+def marker_path(session, index):
+    return os.path.join(session_dir(session), f'{index}.done')
+
+def prepare_session(session):
+    os.makedirs(session_dir(session), exist_ok=True)
+    # Chunks are written in place at their offset, so the data file is
+    # sized up front (sparse on filesystems that support it).
+    with open(data_path(session), 'wb') as data:
+        data.truncate(session.file_size)
+
+def write_chunk(session, index, stream, length):
+    """
+    Copy exactly `length` bytes from `stream` into the session data file at
+    the chunk's offset, then mark the chunk as received. The marker is only
+    created once the bytes are on disk, so an interrupted PUT is simply
+    re-sent by the client.
+    """
+    expected = session.chunk_length(index)
+    if length != expected:
+        raise ChunkSizeMismatch(f'Chunk {index} must be {expected} bytes, got {length}')
+
+    offset = index * session.chunk_size
+    fd = os.open(data_path(session), os.O_WRONLY)
+    try:
+        remaining = length
+        while remaining > 0:
+            data = stream.read(min(COPY_BLOCK_SIZE, remaining))
+            if not data:
+                raise ChunkSizeMismatch(f'Chunk {index} ended after {length - remaining} bytes')
+            os.pwrite(fd, data, offset)
+            offset += len(data)
+            remaining -= len(data)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+    open(marker_path(session, index), 'wb').close()
+
+def received_chunks(session):
+    received = []
+    with os.scandir(session_dir(session)) as entries:
+        for entry in entries:
+            stem, _, suffix = entry.name.partition('.')
+            if suffix == 'done' and stem.isdigit():
+                received.append(int(stem))
+    return sorted(received)
+
+def session_status(session):
+    received = received_chunks(session)
+    received_set = set(received)
+    next_chunk = next(
+        (index for index in range(session.total_chunks) if index not in received_set),
+        None
+    )
+    return {
+        'id': str(session.pk),
+        'file_name': session.file_name,
+        'file_size': session.file_size,
+        'chunk_size': session.chunk_size,
+        'total_chunks': session.total_chunks,
+        'received_chunks': received,
+        'bytes_received': sum(session.chunk_length(index) for index in received),
+        'next_chunk': next_chunk,
+        'next_offset': None if next_chunk is None else next_chunk * session.chunk_size,
+        'complete': next_chunk is None,
+    }
+
+def data_stamp(session):
+    # Changes whenever a chunk is written into the data file
+    stat = os.stat(data_path(session))
+    return stat.st_size, stat.st_mtime_ns
+
+def session_sha256(session):
+    """
+    Digest of the data file, and its stamp from before hashing began.
+
+    Chunks arrive in any order, so the digest is taken once they are all
+    in. Hashing a large file takes a while and is done before any lock is
+    taken; comparing the stamp under the lock tells whether a chunk was
+    rewritten in the meantime.
+    """
+    stamp = data_stamp(session)
+    return file_sha256(data_path(session)), stamp
+
+def assembled_file(session):
+    # The storage name never derives from the client's display name
+    return AssembledUpload(open(data_path(session), 'rb'), name=f'{session.pk.hex}.bin')
+
+def discard_session_files(session):
+    shutil.rmtree(session_dir(session), ignore_errors=True)
+
+def sweep_expired_sessions(now=None, limit=100):
+    """
+    Delete sessions that have not received a chunk within
+    UPLOAD_SESSION_TTL, together with their on-disk data.
+    """
+    now = now or timezone.now()
+    ttl = getattr(settings, 'UPLOAD_SESSION_TTL', timedelta(hours=24))
+    expired = list(
+        UploadSession.objects.filter(updated_at__lt=now - ttl)
+        .order_by('updated_at')
+        .only('id')[:limit]
+    )
+    for session in expired:
+        discard_session_files(session)
+    UploadSession.objects.filter(pk__in=[session.pk for session in expired]).delete()
+    return len(expired)
+
+def maybe_sweep_expired_sessions():
+    global _last_sweep
+    if time.monotonic() - _last_sweep < SWEEP_INTERVAL:
+        return 0
+    _last_sweep = time.monotonic()
+    return sweep_expired_sessions()
@@ -1,18 +1,50 @@
+from django.conf import settings
 from django.urls import path
 from .views import (
     FileUploadView, 
     FileDownloadView, 
+    BatchDownloadView,
     FileListView,
+    FileDeleteView,
+    BulkFileDeleteView,
     FileShareView, 
+    BulkFileShareView,
     CreateShareableLinkView, 
-    ShareableLinkAccessView
+    ShareableLinkAccessView,
+    UploadSessionView,
+    UploadSessionDetailView,
+    UploadChunkView,
+    UploadSessionCompleteView
 )
+from .async_views import (
+    AsyncFileUploadView,
+    AsyncFileDownloadView,
+    AsyncBatchDownloadView,
+    AsyncFileListView,
+    AsyncUploadChunkView
+)
+
+def storage_urlpatterns(async_views=False):
+    # Served by an ASGI server, transfers, archives and listing run as
+    # native async views
+    return [
+        path('upload', (AsyncFileUploadView if async_views else FileUploadView).as_view(), name='upload'),
+        path('uploads', UploadSessionView.as_view(), name='upload-sessions'),
+        path('uploads/<uuid:session_id>', UploadSessionDetailView.as_view(), name='upload-session'),
+        path('uploads/<uuid:session_id>/chunks/<int:index>',
+             (AsyncUploadChunkView if async_views else UploadChunkView).as_view(), name='upload-chunk'),
+        path('uploads/<uuid:session_id>/complete', UploadSessionCompleteView.as_view(), name='upload-complete'),
+        path('download/batch', (AsyncBatchDownloadView if async_views else BatchDownloadView).as_view(),
+             name='batch-download'),
+        path('download/<str:file_id>', (AsyncFileDownloadView if async_views else FileDownloadView).as_view(),
+             name='download'),
+        path('files', (AsyncFileListView if async_views else FileListView).as_view(), name='files'),
+        path('files/delete', BulkFileDeleteView.as_view(), name='bulk-delete'),
+        path('files/<str:file_id>', FileDeleteView.as_view(), name='file'),
+        path('share/bulk', BulkFileShareView.as_view(), name='bulk-share'),
+        path('share/<str:file_id>', FileShareView.as_view(), name='share'),
+        path('share/<str:file_id>/share-link', CreateShareableLinkView.as_view(), name='create-share-link'),
+        path('share/link/<uuid:token>', ShareableLinkAccessView.as_view(), name='access-shared-file'),
+    ]
 
-urlpatterns = [
-    path('upload', FileUploadView.as_view(), name='upload'),
-    path('download/<str:file_id>', FileDownloadView.as_view(), name='download'),
-    path('files', FileListView.as_view(), name='files'),
-    path('share/<str:file_id>', FileShareView.as_view(), name='share'),
-    path('share/<str:file_id>/share-link', CreateShareableLinkView.as_view(), name='create-share-link'),
-    path('share/link/<uuid:token>', ShareableLinkAccessView.as_view(), name='access-shared-file'),
-]
+urlpatterns = storage_urlpatterns(settings.ASYNC_VIEWS)
@@ -0,0 +1,116 @@
+"""
+Per-user storage usage counters and role quotas.
+
+StorageUsage holds each user's file bytes (declared file_size) and file
+count. The EncryptedFile signals adjust them with F() updates in the same
+transaction as the insert or delete, so reading a user's usage is one
+primary key lookup. Uploads check the quota against the locked counter
+in the transaction that stores the file, and can be turned away before
+their body is read using the unlocked remaining_quota().
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from .models import EncryptedFile, StorageUsage, User
+
+class QuotaExceeded(Exception):
+    pass
+
+def storage_quota(user):
+    # None means unlimited
+    limits = getattr(settings, 'STORAGE_QUOTA_BY_ROLE', {})
+    return limits.get(getattr(user, 'role', None))
+
+def current_usage(user_id):
+    # (used_bytes, file_count)
+    row = StorageUsage.objects.filter(user_id=user_id).values_list('used_bytes', 'file_count').first()
+    return row or (0, 0)
+
+def remaining_quota(user):
+    quota = storage_quota(user)
+    if quota is None:
+        return None
+    return quota - current_usage(user.pk)[0]
+
+def add(user_id, size, files=1):
+    counters = StorageUsage.objects.filter(user_id=user_id)
+    if counters.update(used_bytes=F('used_bytes') + size, file_count=F('file_count') + files):
+        return
+    # First file for this user
+    StorageUsage.objects.bulk_create([StorageUsage(user_id=user_id)], ignore_conflicts=True)
+    counters.update(used_bytes=F('used_bytes') + size, file_count=F('file_count') + files)
+
+def release(user_id, size, files=1):
+    # Never creates a row: the user may be going away in the same cascade
+    StorageUsage.objects.filter(user_id=user_id).update(
+        used_bytes=F('used_bytes') - size, file_count=F('file_count') - files
+    )
+
+def check_quota(user, size):
+    """
+    Raise QuotaExceeded unless `size` more bytes fit the user's quota. Call
+    it inside the transaction that stores the file: the counter row stays
+    locked until commit, so concurrent uploads by one user are checked one
+    after another instead of all passing against the same old total.
+    """
+    quota = storage_quota(user)
+    if quota is None:
+        return
+    counters = StorageUsage.objects.select_for_update().filter(user_id=user.pk).values_list('used_bytes', flat=True)
+    used = counters.first()
+    if used is None:
+        StorageUsage.objects.bulk_create([StorageUsage(user_id=user.pk)], ignore_conflicts=True)
+        used = counters.first()
+    if used + size > quota:
+        raise QuotaExceeded(f'Upload exceeds the remaining storage quota of {max(quota - used, 0)} bytes')
+
+def reconcile(batch_size=1000, dry_run=False):
+    """
+    Recompute every counter from EncryptedFile, one batch of users at a
+    time, and fix the ones that drifted. Counter rows are locked while
+    their batch is compared, so uploads and deletes for those users wait
+    instead of racing the repair. Returns {user_id: (stored, actual)} for
+    the counters that were wrong.
+    """
+    user_ids = User.objects.order_by('pk').values_list('pk', flat=True)
+
+    drift = {}
+    batch = []
+    for user_id in user_ids.iterator(chunk_size=batch_size):
+        batch.append(user_id)
+        if len(batch) == batch_size:
+            drift.update(_reconcile_batch(batch, dry_run))
+            batch = []
+    if batch:
+        drift.update(_reconcile_batch(batch, dry_run))
+    return drift
+
+def _reconcile_batch(user_ids, dry_run):
+    with transaction.atomic():
+        if not dry_run:
+            StorageUsage.objects.bulk_create(
+                [StorageUsage(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+            )
+        stored = {
+            row[0]: row[1:]
+            for row in StorageUsage.objects.select_for_update()
+            .filter(user_id__in=user_ids).values_list('user_id', 'used_bytes', 'file_count')
+        }
+        actual = {
+            row['user_id']: (row['used_bytes'], row['file_count'])
+            for row in EncryptedFile.objects.filter(user_id__in=user_ids)
+            .values('user_id').annotate(used_bytes=Sum('file_size'), file_count=Count('id'))
+            .order_by()
+        }
+
+        drift = {}
+        for user_id in user_ids:
+            expected = actual.get(user_id, (0, 0))
+            current = stored.get(user_id, (0, 0))
+            if current != expected:
+                drift[user_id] = (current, expected)
+                if not dry_run:
+                    StorageUsage.objects.filter(user_id=user_id).update(
+                        used_bytes=expected[0], file_count=expected[1]
+                    )
+    return drift
@@ -2,16 +2,54 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.parsers import MultiPartParser
-from .models import EncryptedFile, FileShare, ShareableLink
-from .serializers import EncryptedFileSerializer, FileShareSerializer, FileShareDetailsSerializer, ShareableLinkSerializer
+from rest_framework.parsers import MultiPartParser, JSONParser
+from .models import EncryptedFile, FileShare, KeyEnvelope, ShareableLink, UploadSession, VisibilityVersion
+from .serializers import EncryptedFileSerializer, FileShareSerializer, BulkFileShareSerializer, BatchDownloadSerializer, BulkFileDeleteSerializer, FileShareDetailsSerializer, ShareableLinkSerializer, UploadSessionSerializer
+from .signals import invalidate_access_many
+from . import visibility
+from .archives import batch_files, stream_zip, zip_response
+from .downloads import stream_encrypted_file
+from .listing import (
+    InvalidListParameter,
+    conditional_list,
+    list_etag,
+    order_rows,
+    page_size,
+    paginate_rows,
+    set_list_validators,
+    visible_rows,
+)
+from .sweeper import maybe_sweep
+from .usage import QuotaExceeded, check_quota, remaining_quota
+from .uploads import (
+    FORM_OVERHEAD,
+    ChunkSizeMismatch,
+    EncryptedBlobUploadHandler,
+    UploadTooLarge,
+    assembled_file,
+    data_stamp,
+    discard_session_files,
+    matches_declared_size,
+    max_upload_size,
+    maybe_sweep_expired_sessions,
+    plaintext_size,
+    prepare_session,
+    quota_upload_size,
+    record_upload,
+    session_dir,
+    session_sha256,
+    session_status,
+    write_chunk,
+)
 from account.authentication import CustomTokenAuthentication
-from django.http import HttpResponse
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-import mimetypes
-import base64
-from django.db.models import Q
+from django.db import transaction
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+import base64
+import binascii
+import shutil
 
 User = get_user_model()
 
@@ -31,28 +69,67 @@ class FileUploadView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
 
+        # Reject oversized bodies before reading any of them. The body
+        # carries the form fields on top of the blob; the handler enforces
+        # the blob's exact size
+        max_size = max_upload_size(request.user)
+        try:
+            content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            content_length = 0
+        if max_size is not None and content_length > max_size + FORM_OVERHEAD:
+            return Response(
+                {'error': f'Upload exceeds the {max_size} byte limit'}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        # Checked against the usage counter, not a SUM over the user's files
+        quota_size = quota_upload_size(request.user)
+        if quota_size is not None:
+            if content_length > quota_size + FORM_OVERHEAD:
+                return Response(
+                    {'error': 'Upload exceeds the remaining storage quota'}, 
+                    status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                )
+            # The handler stops storing the blob once it outgrows the quota
+            max_size = quota_size if max_size is None else min(max_size, quota_size)
+
+        # Stream the blob straight to its final location in encrypted_files/
+        handler = EncryptedBlobUploadHandler(request, max_size)
+        request.upload_handlers.insert(0, handler)
+
         try:
             # Validate required fields
             required_fields = ['file', 'encrypted_key', 'file_name', 'file_type', 'file_size']
             for field in required_fields:
                 if field not in request.data:
+                    handler.discard()
                     return Response(
                         {'error': f'Missing required field: {field}'}, 
                         status=status.HTTP_400_BAD_REQUEST
                     )
 
+            try:
+                file_size = int(request.data['file_size'])
+            except ValueError:
+                handler.discard()
+                return Response(
+                    {'error': 'file_size must be an integer'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             file = request.FILES['file']
             encrypted_key = request.FILES['encrypted_key']
+
+            if not matches_declared_size(file.size, file_size):
+                handler.discard()
+                return Response(
+                    {'error': 'file_size does not match the uploaded file'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             
-            # Create encrypted file record
-            encrypted_file = EncryptedFile.objects.create(
-                user=request.user,
-                file_name=request.data['file_name'],
-                encrypted_file=file,
-                encryption_key=encrypted_key.read(),
-                file_type=request.data['file_type'],
-                file_size=request.data['file_size']
-            )
+            # Create encrypted file record and its key envelope
+            encrypted_file = record_upload(request.user, request.data, file_size, file, encrypted_key.read())
 
             serializer = EncryptedFileSerializer(encrypted_file)
             return Response(
@@ -60,12 +137,25 @@ class FileUploadView(APIView):
                 status=status.HTTP_201_CREATED
             )
 
+        except UploadTooLarge as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+        except QuotaExceeded as e:
+            handler.discard()
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
         except KeyError as e:
+            handler.discard()
             return Response(
                 {'error': f'Missing field: {str(e)}'}, 
                 status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
+            handler.discard()
             return Response(
                 {'error': str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
@@ -92,48 +182,12 @@ class FileDownloadView(APIView):
                 )
             
             try:
-                # Read the file content
-                file_content = file.encrypted_file.read()
-                
-                # Ensure encryption_key is bytes
-                encryption_key = file.encryption_key
-                if not isinstance(encryption_key, bytes):
-                    encryption_key = bytes(encryption_key)
-                
-                # Get the IV and encrypted data (first 12 bytes are IV)
-                iv = file_content[:12]
-                encrypted_data = file_content[12:]
-                
-                # Create response with IV prepended to encrypted data
-                response_data = iv + encrypted_data
-                
-                # Base64 encode the encryption key
-                encrypted_key_b64 = base64.b64encode(encryption_key).decode('utf-8')
-                
-                response = HttpResponse(
-                    content=response_data,
-                    content_type=str(file.file_type)
-                )
-                
-                # Set headers
-                response['Content-Disposition'] = f'attachment; filename="{file.file_name}"'
-                response['Content-Length'] = str(len(response_data))
-                response['Encrypted-Key'] = encrypted_key_b64
-                
-                # CORS headers
-                response['Access-Control-Expose-Headers'] = ', '.join([
-                    'Content-Disposition',
-                    'Content-Length',
-                    'Content-Type',
-                    'Encrypted-Key',
-                    'Original-Type'
-                ])
-                
-                return response
-            
-            except EncryptedFile.DoesNotExist:
+                # Stream the stored blob (IV followed by ciphertext) as-is
+                return stream_encrypted_file(file, request)
+
+            except FileNotFoundError:
                 return Response(
-                    {'error': 'File not found'}, 
+                    {'error': 'File not found on server'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
 
@@ -153,42 +207,143 @@ class FileDownloadView(APIView):
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+class BatchDownloadView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def post(self, request):
+        serializer = BatchDownloadSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        file_ids = serializer.validated_data['file_ids']
+
+        files, keys, unavailable = batch_files(request.user, file_ids)
+        if unavailable:
+            return Response(
+                {'error': 'Some files were not found or are not accessible', 'file_ids': unavailable}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        return zip_response(stream_zip(files, keys))
+
 class FileListView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [CustomTokenAuthentication]
     def get(self, request):
+        # Pagination is opt-in so existing clients keep getting a plain list
+        paginated = 'cursor' in request.query_params or 'limit' in request.query_params
         try:
-            # First, let's handle the case where user type methods might not exist
-            user_type = getattr(request.user, 'role', None)
-
-            if user_type == 'admin':
-                files = EncryptedFile.objects.all().distinct()
-            elif user_type == 'regular':
-                # Use Q objects for OR condition without union
-                files = EncryptedFile.objects.filter(
-                    Q(user=request.user) | 
-                    Q(is_shared=True, shares__shared_with=request.user)
-                ).distinct()
-            else:  # guest or undefined
-                files = EncryptedFile.objects.filter(
-                    is_shared=True,
-                    shares__shared_with=request.user
-                ).distinct()
-            # Apply ordering after the query is complete
-            files = files.order_by('-uploaded_at')
+            # Admins list every file, which no single version covers
+            etag = changed_at = None
+            if getattr(request.user, 'role', None) != 'admin':
+                version, changed_at = visibility.version(request.user.pk)
+                etag = list_etag('files', f"{request.user.pk}-{getattr(request.user, 'role', '')}", version)
+                not_modified = conditional_list(request, etag, changed_at)
+                if not_modified:
+                    return not_modified
+
+            rows, id_field = visible_rows(request.user, request.query_params)
+
+            if paginated:
+                page, next_cursor = paginate_rows(
+                    rows,
+                    request.query_params.get('cursor'),
+                    page_size(request.query_params.get('limit')),
+                    id_field
+                )
+            else:
+                page, next_cursor = order_rows(rows, id_field), None
 
+            files = page if id_field == 'id' else [row.file for row in page]
             serializer = EncryptedFileSerializer(files, many=True)
+
+            if paginated:
+                response = Response(
+                    {'results': serializer.data, 'next_cursor': next_cursor},
+                    status=status.HTTP_200_OK
+                )
+            else:
+                response = Response(
+                    serializer.data,
+                    status=status.HTTP_200_OK
+                )
+            return set_list_validators(response, etag, changed_at) if etag else response
+
+        except InvalidListParameter as e:
             return Response(
-                serializer.data,
-                status=status.HTTP_200_OK
+                {'error': str(e)},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            
-        except Exception as e:
+        except Exception:
             return Response(
                 {'error': 'An error occurred while fetching files'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class FileDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def delete(self, request, file_id):
+        try:
+            with transaction.atomic():
+                file = EncryptedFile.objects.get(id=file_id)
+
+                # Only the owner (or an admin) may delete a file
+                if request.user.role != 'admin' and file.user_id != request.user.pk:
+                    return Response(
+                        {'error': 'You do not have permission to delete this file'}, 
+                        status=status.HTTP_403_FORBIDDEN
+                    )
+
+                # Shares, links, key envelopes and visibility rows go with
+                # it; the blob is queued and unlinked after commit
+                file.delete()
+
+            return Response(status=status.HTTP_204_NO_CONTENT)
+
+        except (EncryptedFile.DoesNotExist, ValueError):
+            return Response(
+                {'error': 'File not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+class BulkFileDeleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def post(self, request):
+        serializer = BulkFileDeleteSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        file_ids = serializer.validated_data['file_ids']
+
+        with transaction.atomic():
+            owners = dict(EncryptedFile.objects.filter(id__in=file_ids).values_list('id', 'user_id'))
+            deletable = [
+                file_id for file_id in file_ids
+                if file_id in owners
+                and (request.user.role == 'admin' or owners[file_id] == request.user.pk)
+            ]
+            EncryptedFile.objects.filter(id__in=deletable).delete()
+
+        results = []
+        summary = {}
+        deletable = set(deletable)
+        for file_id in file_ids:
+            if file_id not in owners:
+                result = 'file_not_found'
+            elif file_id not in deletable:
+                result = 'forbidden'
+            else:
+                result = 'deleted'
+            results.append({'file_id': file_id, 'status': result})
+            summary[result] = summary.get(result, 0) + 1
+        return Response(
+            {'summary': summary, 'results': results},
+            status=status.HTTP_200_OK
+        )
+
 class FileShareView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [CustomTokenAuthentication]
@@ -210,13 +365,14 @@ class FileShareView(APIView):
                 )
 
             # Create share
-            share = file.share_with_user(
-                user=shared_with,
-                permission=serializer.validated_data['permission'],
-            )
+            with transaction.atomic():
+                share = file.share_with_user(
+                    user=shared_with,
+                    permission=serializer.validated_data['permission'],
+                )
 
-            file.is_shared = True
-            file.save()
+                file.is_shared = True
+                file.save(update_fields=['is_shared'])
 
             return Response(
                 FileShareDetailsSerializer(share).data,
@@ -236,10 +392,21 @@ class FileShareView(APIView):
 
     def get(self, request, file_id):
         try:
-            file = EncryptedFile.objects.get(id=file_id)
-            shares = file.shares.all()
-            return Response(
-                FileShareDetailsSerializer(shares, many=True).data
+            # The owner's visibility version covers the file's shares
+            file = EncryptedFile.objects.select_related('user__visibility_version').get(id=file_id)
+            try:
+                version, changed_at = file.user.visibility_version.version, file.user.visibility_version.changed_at
+            except VisibilityVersion.DoesNotExist:
+                version, changed_at = 0, None
+            etag = list_etag('shares', file.pk, version)
+            not_modified = conditional_list(request, etag, changed_at)
+            if not_modified:
+                return not_modified
+
+            # Each share serializes its recipient and the file with its owner
+            shares = file.shares.select_related('shared_with', 'file__user')
+            return set_list_validators(
+                Response(FileShareDetailsSerializer(shares, many=True).data), etag, changed_at
             )
         except EncryptedFile.DoesNotExist:
             return Response(
@@ -247,11 +414,94 @@ class FileShareView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
 
+class BulkFileShareView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def post(self, request):
+        serializer = BulkFileShareSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        file_ids = serializer.validated_data['file_ids']
+        emails = serializer.validated_data['shared_with_emails']
+        permission = serializer.validated_data['permission']
+
+        try:
+            with transaction.atomic():
+                files = {
+                    file.pk: file
+                    for file in EncryptedFile.objects.filter(id__in=file_ids).only('id', 'user_id', 'uploaded_at')
+                }
+
+                # Resolve every recipient in one query; emails are not unique
+                user_ids = {}
+                for email, user_id in User.objects.filter(email__in=emails).values_list('email', 'id'):
+                    user_ids[email] = None if email in user_ids else user_id
+
+                # Only owners (and admins) may share in bulk
+                shareable = [
+                    file_id for file_id in file_ids
+                    if file_id in files
+                    and (request.user.role == 'admin' or files[file_id].user_id == request.user.pk)
+                ]
+                recipients = [user_id for user_id in user_ids.values() if user_id is not None]
+                existing = set(
+                    FileShare.objects.filter(
+                        file_id__in=shareable, shared_with_id__in=recipients
+                    ).values_list('file_id', 'shared_with_id')
+                )
+
+                results = []
+                new_shares = []
+                shareable = set(shareable)
+                for file_id in file_ids:
+                    for email in emails:
+                        user_id = user_ids.get(email)
+                        if file_id not in files:
+                            result = 'file_not_found'
+                        elif file_id not in shareable:
+                            result = 'forbidden'
+                        elif email not in user_ids:
+                            result = 'user_not_found'
+                        elif user_id is None:
+                            result = 'multiple_users'
+                        elif (file_id, user_id) in existing:
+                            result = 'already_shared'
+                        else:
+                            result = 'shared'
+                            new_shares.append(FileShare(file_id=file_id, shared_with_id=user_id, permission=permission))
+                        results.append({'file_id': file_id, 'email': email, 'status': result})
+
+                FileShare.objects.bulk_create(new_shares, ignore_conflicts=True)
+                shared_file_ids = {share.file_id for share in new_shares}
+                EncryptedFile.objects.filter(id__in=shared_file_ids, is_shared=False).update(is_shared=True)
+
+                # bulk_create sends no signals, so sync the derived state here
+                visibility.grant_shares(new_shares, files)
+                invalidate_access_many((share.file_id, share.shared_with_id) for share in new_shares)
+
+        except Exception as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+        summary = {}
+        for result in results:
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+        return Response(
+            {'summary': summary, 'results': results},
+            status=status.HTTP_200_OK
+        )
+
 class CreateShareableLinkView(APIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [CustomTokenAuthentication]
 
     def post(self, request, file_id):
+        maybe_sweep()
+
         try:
             file = EncryptedFile.objects.get(id=file_id)
             expiration_hours = request.data.get('expiration_hours', 24)
@@ -281,23 +531,23 @@ class ShareableLinkAccessView(APIView):
 
     def get(self, request, token):
         try:
-            link = get_object_or_404(ShareableLink, token=token)
-            
-            if not link.is_valid():
-                return Response(
-                    {'error': 'This link has expired or has been used'}, 
-                    status=status.HTTP_403_FORBIDDEN
-                )
-
-            # Get the file data
-            file = link.file
-            share = file.share_with_user(request.user, link.permission)
-
-            file.is_shared = True
-            file.save()
+            # One write transaction for the whole redemption; with the
+            # tuned SQLite profile it starts as BEGIN IMMEDIATE
+            with transaction.atomic():
+                # The conditional UPDATE is the redemption: only one request
+                # can flip is_used for a token, however many race for it
+                if not ShareableLink.claim(token):
+                    # Tell a missing link (404) from a used or expired one
+                    get_object_or_404(ShareableLink.objects.only('pk'), token=token)
+                    return Response(
+                        {'error': 'This link has expired or has been used'}, 
+                        status=status.HTTP_403_FORBIDDEN
+                    )
 
-            link.is_used = True
-            link.save()
+                link = ShareableLink.objects.select_related('file').get(token=token)
+                share = link.file.share_with_user(request.user, link.permission)
+                EncryptedFile.objects.filter(pk=link.file_id, is_shared=False).update(is_shared=True)
+                link.file.is_shared = True
             return Response(
                 FileShareDetailsSerializer(share).data,
                 status=status.HTTP_201_CREATED
@@ -307,4 +557,188 @@ class ShareableLinkAccessView(APIView):
             return Response(
                 {'error': 'Invalid or expired link'}, 
                 status=status.HTTP_404_NOT_FOUND
-            )
\ No newline at end of file
+            )
+
+class UploadSessionView(APIView):
+    parser_classes = (MultiPartParser, JSONParser)
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def post(self, request):
+        if request.user.role == 'guest':
+            return Response(
+                {'error': 'Guest users cannot upload files'}, 
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        maybe_sweep_expired_sessions()
+
+        serializer = UploadSessionSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        max_size = max_upload_size(request.user)
+        if max_size is not None and serializer.validated_data['file_size'] > max_size:
+            return Response(
+                {'error': f'Upload exceeds the {max_size} byte limit'}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        remaining = remaining_quota(request.user)
+        if remaining is not None and plaintext_size(serializer.validated_data['file_size']) > remaining:
+            return Response(
+                {'error': 'Upload exceeds the remaining storage quota'}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        # The wrapped key is sent either as a multipart file, like
+        # FileUploadView, or base64-encoded in a JSON body
+        if 'encrypted_key' in request.FILES:
+            encryption_key = request.FILES['encrypted_key'].read()
+        elif request.data.get('encrypted_key'):
+            try:
+                encryption_key = base64.b64decode(request.data['encrypted_key'], validate=True)
+            except (binascii.Error, ValueError):
+                return Response(
+                    {'error': 'encrypted_key must be base64 encoded'}, 
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            return Response(
+                {'error': 'Missing required field: encrypted_key'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        session = UploadSession.objects.create(
+            user=request.user,
+            file_name=serializer.validated_data['file_name'],
+            file_type=serializer.validated_data['file_type'],
+            file_size=serializer.validated_data['file_size'],
+            chunk_size=serializer.validated_data.get('chunk_size', settings.UPLOAD_CHUNK_SIZE),
+            encryption_key=encryption_key
+        )
+        prepare_session(session)
+
+        return Response(session_status(session), status=status.HTTP_201_CREATED)
+
+class UploadSessionDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def get(self, request, session_id):
+        session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+        try:
+            return Response(session_status(session))
+        except FileNotFoundError:
+            return Response(
+                {'error': 'Upload session data not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+    def delete(self, request, session_id):
+        session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+        discard_session_files(session)
+        session.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class UploadChunkView(APIView):
+    # The chunk body is copied straight from the request stream
+    parser_classes = ()
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def put(self, request, session_id, index):
+        session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+
+        if index >= session.total_chunks:
+            return Response(
+                {'error': f'Chunk index must be below {session.total_chunks}'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+            write_chunk(session, index, request.stream, length)
+        except (ChunkSizeMismatch, ValueError) as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except FileNotFoundError:
+            return Response(
+                {'error': 'Upload session data not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Keep active sessions away from the sweeper
+        UploadSession.objects.filter(pk=session.pk).update(updated_at=timezone.now())
+
+        return Response(session_status(session))
+
+class UploadSessionCompleteView(APIView):
+    permission_classes = [IsAuthenticated]
+    authentication_classes = [CustomTokenAuthentication]
+
+    def post(self, request, session_id):
+        try:
+            session = get_object_or_404(UploadSession, pk=session_id, user=request.user)
+            progress = session_status(session)
+            if not progress['complete']:
+                return Response(
+                    {'error': 'Upload is incomplete', **progress}, 
+                    status=status.HTTP_409_CONFLICT
+                )
+            # Outside the transaction: hashing a large file must not hold
+            # the session and usage locks. Recorded as FileUploadView
+            # records it, the digest of the stored blob
+            sha256, stamp = session_sha256(session)
+
+            with transaction.atomic():
+                session = get_object_or_404(
+                    UploadSession.objects.select_for_update(),
+                    pk=session_id,
+                    user=request.user
+                )
+                if data_stamp(session) != stamp:
+                    return Response(
+                        {'error': 'Upload changed while it was being completed; retry'}, 
+                        status=status.HTTP_409_CONFLICT
+                    )
+
+                # Before the data file is moved; the quota may have been
+                # used up by other uploads since the session was created.
+                # Sizes are recorded in plaintext bytes
+                file_size = plaintext_size(session.file_size)
+                check_quota(request.user, file_size)
+
+                # The data file is moved into encrypted_files/, not copied
+                with assembled_file(session) as upload:
+                    encrypted_file = EncryptedFile.objects.create(
+                        user=request.user,
+                        file_name=session.file_name,
+                        encrypted_file=upload,
+                        sha256=sha256,
+                        file_type=session.file_type,
+                        file_size=file_size
+                    )
+                KeyEnvelope.objects.create(file=encrypted_file, wrapped_key=session.encryption_key)
+
+                directory = session_dir(session)
+                session.delete()
+                transaction.on_commit(lambda: shutil.rmtree(directory, ignore_errors=True))
+
+        except FileNotFoundError:
+            return Response(
+                {'error': 'Upload session data not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        except QuotaExceeded as e:
+            return Response(
+                {'error': str(e)}, 
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+            )
+
+        return Response(
+            EncryptedFileSerializer(encrypted_file).data, 
+            status=status.HTTP_201_CREATED
+        )
@@ -0,0 +1,170 @@
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q
+from django.utils import timezone
+from .models import EncryptedFile, FileShare, FileVisibility, User, VisibilityVersion
+
+def bump(user_ids, create=True):
+    """
+    Move the given users' visibility versions on, in the transaction that
+    changes what they see, so no list can be served under an old version.
+    Removals pass create=False: the user may be going away in the same
+    cascade, and a user without a row has never been granted anything.
+    """
+    user_ids = {user_id for user_id in user_ids if user_id is not None}
+    if not user_ids:
+        return
+    versions = VisibilityVersion.objects.filter(user_id__in=user_ids)
+    changes = {'version': F('version') + 1, 'changed_at': timezone.now()}
+    if versions.update(**changes) == len(user_ids) or not create:
+        return
+    # First change for some of them; bumping the others twice is harmless
+    VisibilityVersion.objects.bulk_create(
+        [VisibilityVersion(user_id=user_id) for user_id in user_ids], ignore_conflicts=True
+    )
+    versions.update(**changes)
+
+def version(user_id):
+    # (version, changed_at); changed_at is None before the first change
+    return VisibilityVersion.objects.filter(user_id=user_id).values_list('version', 'changed_at').first() or (0, None)
+
+async def aversion(user_id):
+    return await VisibilityVersion.objects.filter(user_id=user_id).values_list('version', 'changed_at').afirst() or (0, None)
+
+def _owner_id(file_id):
+    return EncryptedFile.objects.filter(pk=file_id).values_list('user_id', flat=True).first()
+
+def grant_owner(file):
+    FileVisibility.objects.update_or_create(
+        user_id=file.user_id,
+        file_id=file.pk,
+        defaults={'permission': 'owner', 'uploaded_at': file.uploaded_at}
+    )
+    bump([file.user_id])
+
+def grant_share(share, file=None):
+    file = file or share.file
+    # The owner's share list changes either way
+    bump([file.user_id, share.shared_with_id])
+    # The owner row always wins over a share with oneself
+    if share.shared_with_id == file.user_id:
+        return
+    FileVisibility.objects.update_or_create(
+        user_id=share.shared_with_id,
+        file_id=file.pk,
+        defaults={'permission': share.permission, 'uploaded_at': file.uploaded_at}
+    )
+
+def grant_shares(shares, files):
+    """
+    Bulk variant of grant_share for rows written with bulk_create, which
+    sends no signals. `files` maps file id to its EncryptedFile.
+    """
+    FileVisibility.objects.bulk_create(
+        [
+            FileVisibility(
+                user_id=share.shared_with_id,
+                file_id=share.file_id,
+                permission=share.permission,
+                uploaded_at=files[share.file_id].uploaded_at
+            )
+            for share in shares
+            if share.shared_with_id != files[share.file_id].user_id
+        ],
+        ignore_conflicts=True
+    )
+    bump(
+        [share.shared_with_id for share in shares] +
+        [files[share.file_id].user_id for share in shares]
+    )
+
+def revoke_share(share):
+    FileVisibility.objects.filter(
+        user_id=share.shared_with_id, file_id=share.file_id
+    ).exclude(permission='owner').delete()
+    bump([share.shared_with_id, _owner_id(share.file_id)], create=False)
+
+def revoke_cascaded_shares(shares):
+    """
+    Bulk variant of revoke_share for shares deleted in the cascade of a
+    file or user deletion, which deletes their visibility rows too. One
+    query finds the owners of the files that outlive the cascade.
+    """
+    owners = EncryptedFile.objects.filter(
+        pk__in={share.file_id for share in shares}
+    ).values_list('user_id', flat=True)
+    bump([share.shared_with_id for share in shares] + list(owners), create=False)
+
+def reassign_owner(file, previous_user_id):
+    with transaction.atomic():
+        # Everyone who lists the file sees its owner
+        bump(
+            [previous_user_id, file.user_id] +
+            list(FileVisibility.objects.filter(file_id=file.pk).values_list('user_id', flat=True))
+        )
+        FileVisibility.objects.filter(user_id=previous_user_id, file_id=file.pk, permission='owner').delete()
+        # A share the new owner held on the file is superseded
+        FileVisibility.objects.filter(user_id=file.user_id, file_id=file.pk).delete()
+        grant_owner(file)
+        share = FileShare.objects.filter(file_id=file.pk, shared_with_id=previous_user_id).first()
+        if share is not None:
+            grant_share(share, file)
+
+def _expected_rows(batch_size):
+    owners = EncryptedFile.objects.values_list('user_id', 'id', 'uploaded_at')
+    for user_id, file_id, uploaded_at in owners.iterator(chunk_size=batch_size):
+        yield FileVisibility(user_id=user_id, file_id=file_id, permission='owner', uploaded_at=uploaded_at)
+
+    shares = FileShare.objects.exclude(shared_with=F('file__user')).values_list(
+        'shared_with_id', 'file_id', 'permission', 'file__uploaded_at'
+    )
+    for user_id, file_id, permission, uploaded_at in shares.iterator(chunk_size=batch_size):
+        yield FileVisibility(user_id=user_id, file_id=file_id, permission=permission, uploaded_at=uploaded_at)
+
+def rebuild(batch_size=5000):
+    """
+    Replace the whole index with rows derived from EncryptedFile and
+    FileShare. Returns the number of rows written.
+    """
+    written = 0
+    batch = []
+    with transaction.atomic():
+        # Any list may change, so every user moves to a new version
+        VisibilityVersion.objects.bulk_create(
+            (VisibilityVersion(user_id=user_id) for user_id in User.objects.values_list('pk', flat=True).iterator()),
+            batch_size=batch_size, ignore_conflicts=True
+        )
+        VisibilityVersion.objects.update(version=F('version') + 1, changed_at=timezone.now())
+        FileVisibility.objects.all().delete()
+        for row in _expected_rows(batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                FileVisibility.objects.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            FileVisibility.objects.bulk_create(batch)
+            written += len(batch)
+    return written
+
+def verify():
+    """
+    Count drift between the index and its source tables without loading
+    either into memory. All counts are zero for a consistent index.
+    """
+    owner_rows = FileVisibility.objects.filter(
+        file=OuterRef('pk'), user=OuterRef('user'), permission='owner'
+    )
+    share_rows = FileVisibility.objects.filter(
+        file=OuterRef('file'), user=OuterRef('shared_with'), permission=OuterRef('permission')
+    )
+    share_sources = FileShare.objects.filter(
+        file=OuterRef('file'), shared_with=OuterRef('user'), permission=OuterRef('permission')
+    )
+    return {
+        'missing_owner_rows': EncryptedFile.objects.exclude(Exists(owner_rows)).count(),
+        'missing_share_rows': FileShare.objects.exclude(shared_with=F('file__user')).exclude(Exists(share_rows)).count(),
+        'stale_owner_rows': FileVisibility.objects.filter(permission='owner').exclude(file__user=F('user')).count(),
+        'stale_share_rows': FileVisibility.objects.exclude(permission='owner').filter(
+            Q(user=F('file__user')) | ~Exists(share_sources)
+        ).count(),
+    }